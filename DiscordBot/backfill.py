@@ -0,0 +1,347 @@
+"""
+Scores existing channel history, for onboarding a guild or re-scoring after a
+threshold change. Messages are streamed a page at a time (oldest first),
+scored through eval_text with bounded concurrency, optionally run through the
+deepfake service for image attachments, and upserted into Mongo in bulk. The
+last message of each finished page is checkpointed per channel, so an
+interrupted run resumes where it stopped. Perspective outages (open circuit,
+timeouts, 429 and 5xx responses) are retried with backoff; a page that still
+has such failures is not checkpointed and its channel stops there, so the
+next run picks it up again.
+
+    python backfill.py 1211760623969370122 --channels 123 456 --record history.jsonl
+    python backfill.py --fixtures history.jsonl --scores scores.jsonl --threshold 0.8
+
+--fixtures replays recorded history (one message per line: channel_id, id,
+content, author_id, attachments) instead of calling Discord, and --scores
+preloads recorded Perspective responses ({"text", "response"} lines) into the
+score cache, so a run can be reproduced offline with MONGO_BACKEND=memory.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import aiohttp
+from pymongo import MongoClient, UpdateOne
+from circuit_breaker import CircuitOpenError
+from memory_mongo import MemoryClient
+from perspective_api import (
+    PerspectiveError,
+    eval_text,
+    perspective_client,
+    score_cache,
+    score_format,
+)
+from rate_limiter import Priority, QueueFullError
+
+ATLAS_URI = os.getenv("ATLAS_URI")
+MONGO_BACKEND = os.getenv("MONGO_BACKEND", "atlas")
+BACKFILL_CHECKPOINT_PATH = os.getenv(
+    "BACKFILL_CHECKPOINT_PATH", "backfill_checkpoint.json"
+)
+
+# Transient Perspective failures are retried BACKFILL_RETRIES times, waiting
+# 1, 2, 4, ... seconds (at most BACKFILL_MAX_BACKOFF) in between
+BACKFILL_RETRIES = int(os.getenv("BACKFILL_RETRIES", "5"))
+BACKFILL_MAX_BACKOFF = float(os.getenv("BACKFILL_MAX_BACKOFF", "60"))
+
+IMAGE_TYPES = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def is_transient(error):
+    """
+    Whether a scoring error is worth retrying later rather than recording.
+    """
+    if isinstance(error, PerspectiveError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(
+        error, (CircuitOpenError, asyncio.TimeoutError, aiohttp.ClientError)
+    )
+
+
+class FixtureHistory:
+    """
+    Channel history recorded to a JSONL file.
+    """
+
+    def __init__(self, path):
+        self.channels = {}
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    message = json.loads(line)
+                    self.channels.setdefault(message["channel_id"], []).append(message)
+        for messages in self.channels.values():
+            messages.sort(key=lambda m: m["id"])
+
+    async def channel_ids(self):
+        return list(self.channels)
+
+    async def pages(self, channel_id, after, page_size):
+        messages = [m for m in self.channels.get(channel_id, []) if m["id"] > after]
+        for i in range(0, len(messages), page_size):
+            yield messages[i : i + page_size]
+
+    async def close(self):
+        pass
+
+
+class DiscordHistory:
+    """
+    Channel history read over the Discord REST API, without connecting to the
+    gateway. Messages are written to `record_path` as fixtures if given.
+    """
+
+    def __init__(self, guild_id, channel_ids=None, record_path=None):
+        import discord
+
+        self.discord = discord
+        self.guild_id = guild_id
+        self.requested = channel_ids
+        self.client = discord.Client(intents=discord.Intents.default())
+        self.record = open(record_path, "a") if record_path else None
+
+    async def channel_ids(self):
+        from bot import load_token
+
+        await self.client.login(load_token())
+        if self.requested:
+            return self.requested
+        channels = await (await self.client.fetch_guild(self.guild_id)).fetch_channels()
+        return [c.id for c in channels if isinstance(c, self.discord.TextChannel)]
+
+    async def pages(self, channel_id, after, page_size):
+        channel = await self.client.fetch_channel(channel_id)
+        while True:
+            page = [
+                {
+                    "channel_id": channel_id,
+                    "id": m.id,
+                    "content": m.content,
+                    "author_id": m.author.id,
+                    "attachments": [a.url for a in m.attachments],
+                }
+                async for m in channel.history(
+                    limit=page_size,
+                    after=self.discord.Object(id=after),
+                    oldest_first=True,
+                )
+            ]
+            if not page:
+                return
+            if self.record:
+                for message in page:
+                    self.record.write(json.dumps(message) + "\n")
+                self.record.flush()
+            yield page
+            after = page[-1]["id"]
+
+    async def close(self):
+        if self.record:
+            self.record.close()
+        await self.client.close()
+
+
+def load_checkpoint(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return {int(k): v for k, v in json.load(f).items()}
+
+
+def save_checkpoint(path, checkpoint):
+    # Write-then-rename so an interrupted run never leaves a torn checkpoint
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+def load_recorded_scores(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                score_cache.put(record["text"], record["response"])
+
+
+class Backfill:
+    def __init__(
+        self,
+        history,
+        collection,
+        checkpoint_path,
+        concurrency=8,
+        page_size=100,
+        threshold=0.6,
+        deepfake=False,
+    ):
+        self.history = history
+        self.collection = collection
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint = load_checkpoint(checkpoint_path)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.page_size = page_size
+        self.threshold = threshold
+        self.deepfake = deepfake
+        self.scored = 0
+        self.flagged = 0
+        self.failed = 0
+
+    async def score_text(self, content):
+        # Backfill runs at channel priority, so it waits out a full queue
+        # instead of being shed, and backs off while Perspective is failing
+        retries = 0
+        while True:
+            try:
+                return score_format(
+                    await eval_text(
+                        content, use_prefilter=True, priority=Priority.CHANNEL
+                    )
+                )["scores"]
+            except QueueFullError:
+                await asyncio.sleep(1)
+            except Exception as e:
+                if not is_transient(e) or retries >= BACKFILL_RETRIES:
+                    raise
+                delay = min(2**retries, BACKFILL_MAX_BACKOFF)
+                if isinstance(e, CircuitOpenError):
+                    delay = max(delay, e.retry_in)
+                retries += 1
+                await asyncio.sleep(delay)
+
+    async def score_message(self, message):
+        """
+        Scores one message into the document to store, or returns None if
+        Perspective kept failing and the message should be scored again later.
+        Other errors are recorded in the document.
+        """
+        async with self.semaphore:
+            document = {
+                "channel_id": message["channel_id"],
+                "author_id": message["author_id"],
+                "content": message["content"],
+                "scored_at": time.time(),
+            }
+            try:
+                if message["content"]:
+                    document["scores"] = await self.score_text(message["content"])
+                    document["flagged"] = (
+                        max(document["scores"].values()) > self.threshold
+                    )
+                if self.deepfake:
+                    from deepfake_detector import deepfake_service
+
+                    document["deepfake"] = [
+                        await deepfake_service.predict(url)
+                        for url in message.get("attachments", [])
+                        if url.lower().split("?")[0].endswith(IMAGE_TYPES)
+                    ]
+            except Exception as e:
+                print(f"Could not score message {message['id']}: {e}")
+                self.failed += 1
+                if is_transient(e):
+                    return None
+                document["error"] = str(e)
+            return document
+
+    async def run_channel(self, channel_id):
+        after = self.checkpoint.get(channel_id, 0)
+        async for page in self.history.pages(channel_id, after, self.page_size):
+            documents = await asyncio.gather(*(self.score_message(m) for m in page))
+            requests = [
+                UpdateOne({"_id": m["id"]}, {"$set": d}, upsert=True)
+                for m, d in zip(page, documents)
+                if d is not None
+            ]
+            if requests:
+                await asyncio.to_thread(
+                    self.collection.bulk_write, requests, ordered=False
+                )
+            self.scored += len(requests)
+            self.flagged += sum(1 for d in documents if d and d.get("flagged"))
+            if len(requests) < len(page):
+                print(
+                    f"channel {channel_id}: Perspective is unavailable, stopping "
+                    f"before message {page[0]['id']}; rerun to continue"
+                )
+                return
+            # Only checkpoint once the whole page is safely written
+            self.checkpoint[channel_id] = page[-1]["id"]
+            save_checkpoint(self.checkpoint_path, self.checkpoint)
+
+    async def run(self):
+        start = time.perf_counter()
+        try:
+            for channel_id in await self.history.channel_ids():
+                channel_start = self.scored
+                await self.run_channel(channel_id)
+                elapsed = time.perf_counter() - start
+                print(
+                    f"channel {channel_id}: {self.scored - channel_start} messages, "
+                    f"{self.scored / elapsed:.1f} messages/s overall"
+                )
+        finally:
+            await self.history.close()
+            await perspective_client.close()
+        elapsed = time.perf_counter() - start
+        return {
+            "scored": self.scored,
+            "flagged": self.flagged,
+            "failed": self.failed,
+            "seconds": elapsed,
+            "messages_per_s": self.scored / elapsed if elapsed else 0.0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("guild", type=int, nargs="?", help="guild to scan")
+    parser.add_argument("--channels", type=int, nargs="+", help="default: all")
+    parser.add_argument("--fixtures", help="replay recorded history from JSONL")
+    parser.add_argument("--record", help="also record fetched history to JSONL")
+    parser.add_argument("--scores", help="recorded Perspective responses (JSONL)")
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT_PATH)
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--deepfake", action="store_true", help="score images too")
+    parser.add_argument("--collection", default="message_scores")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        history = FixtureHistory(args.fixtures)
+    elif args.guild:
+        history = DiscordHistory(args.guild, args.channels, args.record)
+    else:
+        parser.error("give a guild ID or --fixtures")
+    if args.scores:
+        load_recorded_scores(args.scores)
+    if args.restart and os.path.isfile(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    if MONGO_BACKEND == "memory":
+        client = MemoryClient()
+    else:
+        client = MongoClient(ATLAS_URI)
+    backfill = Backfill(
+        history,
+        client["DiscordBot"][args.collection],
+        args.checkpoint,
+        concurrency=args.concurrency,
+        page_size=args.page_size,
+        threshold=args.threshold,
+        deepfake=args.deepfake,
+    )
+    stats = asyncio.run(backfill.run())
+    print(
+        f"{stats['scored']} messages scored, {stats['flagged']} flagged, "
+        f"{stats['failed']} failed in {stats['seconds']:.1f}s "
+        f"({stats['messages_per_s']:.1f} messages/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmarks the deepfake inference backends on a local directory of images,
+reporting per-image p50/p99 latency, throughput and agreement with the eager
+fp32 labels.
+
+    python bench_deepfake.py images/ --backends eager int8 onnx --batch-size 8
+"""
+
+import argparse
+import json
+import os
+import time
+import deepfake_detector
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def load_images(directory, limit=None):
+    from PIL import Image
+
+    paths = sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    return [Image.open(path).convert("RGB") for path in paths]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def run_backend(backend, images, batch_size, warmup=2):
+    batches = [images[i : i + batch_size] for i in range(0, len(images), batch_size)]
+    for batch in batches[:warmup]:
+        deepfake_detector.classify_images(batch, backend)
+
+    latencies = []  # Per-image latency, i.e. batch time / batch size
+    labels = []
+    start = time.perf_counter()
+    for batch in batches:
+        batch_start = time.perf_counter()
+        results = deepfake_detector.classify_images(batch, backend)
+        elapsed = time.perf_counter() - batch_start
+        latencies += [elapsed / len(batch)] * len(batch)
+        labels += [result[0]["label"] for result in results]
+    total = time.perf_counter() - start
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "images_per_s": len(images) / total,
+    }, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("images", help="directory of local images")
+    parser.add_argument(
+        "--backends", nargs="+", default=list(deepfake_detector.BACKENDS)
+    )
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument(
+        "--threads", type=int, default=deepfake_detector.DEEPFAKE_THREADS
+    )
+    parser.add_argument("--limit", type=int, help="use at most this many images")
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args()
+
+    deepfake_detector.configure_threads(args.threads)
+    images = load_images(args.images, args.limit)
+    if not images:
+        raise Exception(f"No images found in {args.images}")
+
+    reference = None
+    results = {}
+    # fp32 eager always runs first so the others can be compared against it
+    for name in ["eager"] + [b for b in args.backends if b != "eager"]:
+        backend = deepfake_detector.load_backend(name, threads=args.threads)
+        stats, labels = run_backend(backend, images, args.batch_size)
+        if reference is None:
+            reference = labels
+        stats["agreement"] = sum(a == b for a, b in zip(labels, reference)) / len(
+            labels
+        )
+        results[name] = stats
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{len(images)} images, batch size {args.batch_size}")
+    print(f"{'backend':<8} {'p50 ms':>8} {'p99 ms':>8} {'img/s':>8} {'agree':>7}")
+    for name, r in results.items():
+        print(
+            f"{name:<8} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+            f"{r['images_per_s']:>8.1f} {r['agreement']:>7.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
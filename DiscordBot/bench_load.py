@@ -0,0 +1,536 @@
+"""
+End-to-end load benchmark for ModBot.on_message. Starts a local
+Perspective-compatible server with configurable latency and error rate, runs
+the bot against fake Discord guilds and channels and the in-memory Mongo
+backend, and replays a message corpus at a fixed rate while users file DM
+reports and a moderator works through the review queue. Reports throughput,
+on_message latency percentiles per kind of message and event-loop lag.
+
+    python bench_load.py --rate 200 --duration 30 --save baseline.json
+    python bench_load.py --corpus history.jsonl --baseline baseline.json
+
+--corpus replays recorded messages (JSONL with "content" and optionally
+"author_id", e.g. backfill.py --record output); otherwise a synthetic corpus
+of chatter, toxic messages and raid copies is generated. Latency is measured
+from each message's scheduled time, so a backed-up bot isn't flattered by
+sending fewer messages. --save writes the results, and --baseline prints
+them next to saved results, so performance changes can be measured against
+a fixed run.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import zlib
+from collections import defaultdict
+from types import SimpleNamespace
+
+GROUP = 27
+BOT_ID = 1
+GUILD_ID = 1000
+MOD_CHANNEL_ID = 2000
+GROUP_CHANNEL_ID = 3000
+DM_CHANNEL_ID = 3001
+REPORTED_MESSAGE_ID = 4000
+MODERATOR_ID = 5000
+USER_BASE = 6000
+REPORTER_BASE = 100000
+# Simulated messages get increasing IDs from here
+message_ids = itertools.count(10**9)
+PERSPECTIVE_PATH = "/v1alpha1/comments:analyze"
+
+WORDS = (
+    "the a to and is it you that in of for on this was with but are have not be "
+    "just so what like can get if do all about out up one my no at your me we "
+    "game lol tonight anyone play server match team win lost map ranked patch "
+    "update stream clip build meta queue mod channel voice link event week"
+).split()
+TOXIC_WORDS = ("idiot", "stupid", "trash", "loser", "pathetic")
+THREAT_WORDS = ("kill", "hurt", "regret", "find you", "watch your back")
+RAID_TEMPLATE = "free nitro for everyone who joins this server now {} no scam"
+
+REPORT_REPLIES = ["report", None, "yes", "spam", "details", "no", "no", "yes"]
+
+
+def fake_scores(text):
+    """
+    Perspective-shaped response for `text`: high threat or toxicity for a few
+    keywords, otherwise a low score that varies with the text.
+    """
+    lowered = text.lower()
+    base = (zlib.crc32(text.encode("utf-8")) % 100) / 400
+    scores = {"TOXICITY": base, "SEXUALLY_EXPLICIT": base / 4, "THREAT": base / 2}
+    if any(word in lowered for word in TOXIC_WORDS):
+        scores["TOXICITY"] = 0.85
+    if any(word in lowered for word in THREAT_WORDS):
+        scores["THREAT"] = 0.9
+    return {
+        "attributeScores": {
+            name: {"summaryScore": {"value": value, "type": "PROBABILITY"}}
+            for name, value in scores.items()
+        },
+        "languages": ["en"],
+    }
+
+
+def serve_perspective(ports, latency_ms, jitter_ms, error_rate, seed, outage=None):
+    from aiohttp import web
+
+    rng = random.Random(seed)
+    counts = {"requests": 0, "errors": 0}
+    started = []
+
+    async def analyze(request):
+        body = await request.json()
+        counts["requests"] += 1
+        loop = asyncio.get_running_loop()
+        if not started:
+            started.append(loop.time())
+        if outage and 0 <= loop.time() - started[0] - outage[0] < outage[1]:
+            await asyncio.sleep(60)  # Hangs, as an overloaded backend would
+        await asyncio.sleep(max(0.0, rng.gauss(latency_ms, jitter_ms)) / 1000)
+        if rng.random() < error_rate:
+            counts["errors"] += 1
+            return web.json_response(
+                {"error": {"code": 503, "message": "Backend Error"}}, status=503
+            )
+        return web.json_response(fake_scores(body["comment"]["text"]))
+
+    async def stats(request):
+        return web.json_response(counts)
+
+    async def run():
+        app = web.Application()
+        app.router.add_post(PERSPECTIVE_PATH, analyze)
+        app.router.add_get("/stats", stats)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        ports.put(runner.addresses[0][1])
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+class FakeChannel:
+    """
+    Channel that keeps what the bot sends in memory, after an optional delay
+    standing in for the Discord REST call.
+    """
+
+    def __init__(self, channel_id, name, latency=0.0):
+        self.id = channel_id
+        self.name = name
+        self.latency = latency
+        self.sent = 0
+
+    async def send(self, content):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        return FakeMessage(content)
+
+    async def fetch_message(self, message_id):
+        return SimpleNamespace(
+            id=message_id,
+            content="you will regret this",
+            author=SimpleNamespace(id=USER_BASE - 1, name="offender"),
+            attachments=[],
+        )
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.id = None
+        self.content = content
+
+    async def edit(self, content):
+        self.content = content
+
+
+def make_message(content, author_id, channel, guild=None):
+    return SimpleNamespace(
+        id=next(message_ids),
+        content=content,
+        author=SimpleNamespace(id=author_id, name=f"user {author_id}"),
+        channel=channel,
+        guild=guild,
+        attachments=[],
+    )
+
+
+def synthetic_corpus(count, users, toxic, raid, seed):
+    rng = random.Random(seed)
+    for _ in range(count):
+        roll = rng.random()
+        if roll < raid:
+            content = RAID_TEMPLATE.format(rng.randint(0, 9))
+        else:
+            content = " ".join(rng.choices(WORDS, k=rng.randint(3, 15)))
+            if roll < raid + toxic:
+                content += " " + rng.choice(TOXIC_WORDS + THREAT_WORDS)
+        yield {"content": content, "author_id": USER_BASE + rng.randrange(users)}
+
+
+def recorded_corpus(path, count):
+    messages = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                messages.append(json.loads(line))
+    if not messages:
+        raise SystemExit(f"{path} has no messages")
+    for i in range(count):
+        message = messages[i % len(messages)]
+        yield {
+            "content": message["content"],
+            "author_id": message.get("author_id", USER_BASE + i % 500),
+        }
+
+
+def make_bot(discord_latency):
+    import bot
+
+    mod_channel = FakeChannel(MOD_CHANNEL_ID, f"group-{GROUP}-mod", discord_latency)
+    group_channel = FakeChannel(GROUP_CHANNEL_ID, f"group-{GROUP}", discord_latency)
+    channels = {MOD_CHANNEL_ID: mod_channel, GROUP_CHANNEL_ID: group_channel}
+    guild = SimpleNamespace(
+        id=GUILD_ID,
+        name="bench guild",
+        text_channels=list(channels.values()),
+        get_channel=channels.get,
+    )
+
+    class BenchBot(bot.ModBot):
+        user = SimpleNamespace(id=BOT_ID, name=f"Group {GROUP} Bot")
+        guilds = [guild]
+
+        def get_guild(self, guild_id):
+            return guild if guild_id == guild.id else None
+
+        def get_partial_messageable(self, channel_id, guild_id=None):
+            return channels.get(channel_id) or FakeChannel(channel_id, "remote")
+
+    client = BenchBot(group_num=GROUP, guild_id=GUILD_ID, metrics_port=0)
+    client.register_guild(guild)
+    return client, guild, channels
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": max(values) * 1000,
+    }
+
+
+class LoadRun:
+    def __init__(self, client, guild, channels, args):
+        self.client = client
+        self.guild = guild
+        self.channels = channels
+        self.args = args
+        self.latencies = defaultdict(list)  # Map from kind to on_message times
+        self.errors = defaultdict(int)
+        self.lags = []
+        self.last_done = {}  # Map from kind to when its last message finished
+        self.tasks = set()
+        self.running = True
+
+    async def deliver(self, kind, message, scheduled):
+        loop = asyncio.get_running_loop()
+        try:
+            await self.client.on_message(message)
+        except Exception:
+            self.errors[kind] += 1
+        self.last_done[kind] = loop.time()
+        self.latencies[kind].append(loop.time() - scheduled)
+
+    async def monitor_lag(self, interval=0.01):
+        loop = asyncio.get_running_loop()
+        while self.running:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.lags.append(loop.time() - start - interval)
+
+    async def report_session(self, reporter_id):
+        """
+        One user filing a spam report over DM, pausing between replies.
+        """
+        loop = asyncio.get_running_loop()
+        dm = FakeChannel(DM_CHANNEL_ID, "dm")
+        link = (
+            f"https://discord.com/channels/{GUILD_ID}/"
+            f"{GROUP_CHANNEL_ID}/{REPORTED_MESSAGE_ID}"
+        )
+        for reply in REPORT_REPLIES:
+            message = make_message(reply or link, reporter_id, dm)
+            await self.deliver("dm", message, loop.time())
+            await asyncio.sleep(self.args.think_ms / 1000)
+
+    async def moderator(self):
+        """
+        One moderator claiming and accepting reports at --review-rate.
+        """
+        loop = asyncio.get_running_loop()
+        mod_channel = self.channels[MOD_CHANNEL_ID]
+        while self.running:
+            await asyncio.sleep(1 / self.args.review_rate)
+            message = make_message("claim", MODERATOR_ID, mod_channel, self.guild)
+            await self.deliver("review", message, loop.time())
+            if self.client.review_queue.claim_of(MODERATOR_ID) is not None:
+                message = make_message("yes", MODERATOR_ID, mod_channel, self.guild)
+                await self.deliver("review", message, loop.time())
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, corpus):
+        loop = asyncio.get_running_loop()
+        group_channel = self.channels[GROUP_CHANNEL_ID]
+        background = [asyncio.create_task(self.monitor_lag())]
+        if self.args.review_rate > 0:
+            background.append(asyncio.create_task(self.moderator()))
+        # Report sessions are started every this many channel messages
+        report_every = (
+            max(1, round(self.args.rate / self.args.report_rate))
+            if self.args.report_rate > 0
+            else 0
+        )
+
+        start = loop.time()
+        sent = 0
+        for i, entry in enumerate(corpus):
+            scheduled = start + i / self.args.rate
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            message = make_message(
+                entry["content"], entry["author_id"], group_channel, self.guild
+            )
+            self.spawn(self.deliver("channel", message, scheduled))
+            if report_every and i % report_every == 0:
+                self.spawn(self.report_session(REPORTER_BASE + i))
+            sent += 1
+        send_done = loop.time()
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
+        # Until the last channel message was handled, not the last report reply
+        elapsed = self.last_done.get("channel", loop.time()) - start
+        self.running = False
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        return sent, send_done - start, elapsed
+
+
+async def fetch_server_stats(port):
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://127.0.0.1:{port}/stats") as response:
+            return await response.json()
+
+
+async def run(args, port):
+    from perspective_api import perspective_client, prefilter, score_cache
+
+    client, guild, channels = make_bot(args.discord_latency_ms / 1000)
+    await client.report_store.ensure_indexes()
+    if args.corpus:
+        corpus = recorded_corpus(args.corpus, int(args.rate * args.duration))
+    else:
+        corpus = synthetic_corpus(
+            int(args.rate * args.duration), args.users, args.toxic, args.raid, args.seed
+        )
+    load = LoadRun(client, guild, channels, args)
+    sent, send_seconds, elapsed = await load.run(corpus)
+    server = await fetch_server_stats(port)
+
+    results = {
+        "config": {
+            key: getattr(args, key)
+            for key in (
+                "rate",
+                "duration",
+                "corpus",
+                "latency_ms",
+                "error_rate",
+                "qps",
+                "discord_latency_ms",
+                "report_rate",
+                "review_rate",
+            )
+        },
+        "messages": sent,
+        "offered_per_s": sent / send_seconds if send_seconds else 0.0,
+        "throughput_per_s": sent / elapsed,
+        "latency": {kind: summarize(v) for kind, v in sorted(load.latencies.items())},
+        "errors": dict(load.errors),
+        "loop_lag": summarize(load.lags),
+        "perspective_requests": server["requests"],
+        "perspective_errors": server["errors"],
+        "perspective_queue": perspective_client.limiter.stats(),
+        "perspective_client": perspective_client.stats(),
+        "deferred_messages": len(client.deferred),
+        "score_cache": score_cache.stats(),
+        "prefilter": prefilter.stats(),
+        "near_duplicates": client.near_duplicates.stats(),
+        "discord_sends": sum(c.sent for c in channels.values()),
+        "outbound_pending": client.outbox.pending(),
+        "reports_waiting": len(client.review_queue),
+    }
+    await client.report_store.flush()
+    await perspective_client.close()
+    client.reports.close()
+    return results
+
+
+def print_results(results, baseline=None):
+    def compare(value, key):
+        if baseline is None:
+            return f"{value:>10.2f}"
+        old = key(baseline)
+        if old is None:
+            return f"{value:>10.2f} {'':>10}"
+        change = (value - old) / old * 100 if old else 0.0
+        return f"{value:>10.2f} {old:>10.2f} {change:>+7.1f}%"
+
+    def lookup(*path):
+        def get(results):
+            for key in path:
+                if not isinstance(results, dict) or key not in results:
+                    return None
+                results = results[key]
+            return results
+
+        return get
+
+    header = f"{'':<24} {'this run':>10}"
+    if baseline is not None:
+        header += f" {'baseline':>10} {'change':>8}"
+    print(header)
+    rows = [
+        ("throughput/s", ("throughput_per_s",)),
+        ("perspective requests", ("perspective_requests",)),
+        ("discord sends", ("discord_sends",)),
+    ]
+    for kind in results["latency"]:
+        for q in ("p50", "p99", "max"):
+            rows.append((f"{kind} {q} ms", ("latency", kind, f"{q}_ms")))
+    for q in ("p50", "p99", "max"):
+        rows.append((f"loop lag {q} ms", ("loop_lag", f"{q}_ms")))
+    for label, path in rows:
+        value = lookup(*path)(results)
+        if value is not None:
+            print(f"{label:<24} {compare(value, lookup(*path))}")
+    errors = ", ".join(f"{k} {v}" for k, v in results["errors"].items()) or "none"
+    print(
+        f"\n{results['messages']} messages offered at "
+        f"{results['offered_per_s']:.0f}/s; errors: {errors}; "
+        f"{results['outbound_pending']} sends still queued, "
+        f"{results['reports_waiting']} reports waiting for review"
+    )
+    perspective = results["perspective_client"]
+    fallbacks = ", ".join(f"{k} {v}" for k, v in perspective["fallbacks"].items())
+    print(
+        f"Perspective circuit {perspective['breaker']['state']}, opened "
+        f"{perspective['breaker']['opened']} times; {perspective['hedged']} hedged "
+        f"requests; degraded answers: {fallbacks or 'none'}; "
+        f"{results['deferred_messages']} messages waiting to be re-checked"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=100, help="messages/s")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--corpus", help="recorded messages to replay (JSONL)")
+    parser.add_argument("--users", type=int, default=500, help="synthetic authors")
+    parser.add_argument("--toxic", type=float, default=0.05, help="toxic fraction")
+    parser.add_argument("--raid", type=float, default=0.05, help="raid fraction")
+    parser.add_argument("--seed", type=int, default=152)
+    parser.add_argument("--latency-ms", type=float, default=80, help="Perspective")
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--outage",
+        type=float,
+        nargs=2,
+        metavar=("START", "SECONDS"),
+        help="Perspective hangs for SECONDS, from START seconds into the run",
+    )
+    parser.add_argument("--qps", type=float, default=100, help="Perspective quota")
+    parser.add_argument("--discord-latency-ms", type=float, default=50)
+    parser.add_argument("--report-rate", type=float, default=1, help="sessions/s")
+    parser.add_argument("--review-rate", type=float, default=2, help="claims/s")
+    parser.add_argument("--think-ms", type=float, default=200)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with saved results")
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    ports = context.Queue()
+    server = context.Process(
+        target=serve_perspective,
+        args=(
+            ports,
+            args.latency_ms,
+            args.jitter_ms,
+            args.error_rate,
+            args.seed,
+            args.outage,
+        ),
+        daemon=True,
+    )
+    server.start()
+    port = ports.get(timeout=30)
+
+    # Read by the bot's modules on import
+    directory = tempfile.mkdtemp(prefix="bench_load_")
+    os.environ["PERSPECTIVE_URL"] = f"http://127.0.0.1:{port}{PERSPECTIVE_PATH}"
+    os.environ["PERSPECTIVE_QPS"] = str(args.qps)
+    os.environ["API_KEY"] = "bench"
+    os.environ["MONGO_BACKEND"] = "memory"
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["SESSION_DB_PATH"] = os.path.join(directory, "sessions.sqlite")
+    os.environ["REPORT_SPOOL_PATH"] = os.path.join(directory, "spool.jsonl")
+    os.environ.pop("SCORE_CACHE_PATH", None)
+
+    try:
+        results = asyncio.run(run(args, port))
+    finally:
+        server.terminate()
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
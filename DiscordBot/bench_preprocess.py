@@ -0,0 +1,207 @@
+"""
+Benchmarks deepfake image preprocessing, comparing the feature extractor
+(full decode, RGB conversion, resize and normalize in PIL) with
+image_preprocess.FastPreprocessor, and checks that both produce the same
+model input.
+
+    python bench_preprocess.py images/
+    python bench_preprocess.py --synthetic 20 --megapixels 12 --check
+
+--check fails (exit status 1) if the fast path without draft decoding
+differs from the feature extractor by more than --exact-tolerance anywhere,
+or if draft decoding differs by more than --draft-tolerance on average.
+Values are compared after normalization, where pixels span [-1, 1] for the
+default model.
+"""
+
+import argparse
+import json
+import os
+import time
+from io import BytesIO
+import numpy as np
+from deepfake_detector import model_name
+from image_preprocess import FastPreprocessor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def load_files(directory, limit=None):
+    paths = sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            files.append(f.read())
+    return files
+
+
+def synthetic_photos(count, megapixels, seed=152):
+    """
+    Photo-like JPEGs (smooth gradients plus sensor noise) at a 4:3 aspect
+    ratio, with the odd PNG for the non-draft path.
+    """
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    files = []
+    for i in range(count):
+        phase = rng.uniform(0, 2 * np.pi, 3)
+        channels = [
+            127 + 100 * np.sin(x / rng.uniform(50, 400) + y / 300 + p) for p in phase
+        ]
+        pixels = np.stack(channels, axis=-1) + rng.normal(0, 8, (height, width, 1))
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+        buffer = BytesIO()
+        if i % 5 == 4:
+            image.save(buffer, "PNG")
+        else:
+            image.save(buffer, "JPEG", quality=90)
+        files.append(buffer.getvalue())
+    return files
+
+
+def load_feature_extractor(default_vit):
+    if default_vit:
+        from transformers import ViTImageProcessor
+
+        return ViTImageProcessor(size={"height": 224, "width": 224})
+    from transformers import AutoFeatureExtractor
+
+    return AutoFeatureExtractor.from_pretrained(model_name)
+
+
+def reference_preprocess(feature_extractor, data):
+    from PIL import Image
+
+    image = Image.open(BytesIO(data)).convert("RGB")
+    return feature_extractor(images=image, return_tensors="np")["pixel_values"][0]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def time_each(function, files):
+    times = []
+    for data in files:
+        start = time.perf_counter()
+        function(data)
+        times.append(time.perf_counter() - start)
+    return {
+        "p50_ms": percentile(times, 50) * 1000,
+        "p99_ms": percentile(times, 99) * 1000,
+        "images_per_s": len(times) / sum(times),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("images", nargs="?", help="directory of local images")
+    parser.add_argument("--synthetic", type=int, help="generate this many images")
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--limit", type=int, help="use at most this many images")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument(
+        "--default-vit",
+        action="store_true",
+        help="use a default 224x224 ViT feature extractor instead of downloading "
+        "the model's",
+    )
+    parser.add_argument("--check", action="store_true", help="fail on mismatch")
+    parser.add_argument("--exact-tolerance", type=float, default=1e-4)
+    parser.add_argument("--draft-tolerance", type=float, default=0.02)
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        files = synthetic_photos(args.synthetic, args.megapixels)
+    elif args.images:
+        files = load_files(args.images, args.limit)
+    else:
+        parser.error("give an image directory or --synthetic")
+    if not files:
+        raise Exception(f"No images found in {args.images}")
+
+    feature_extractor = load_feature_extractor(args.default_vit)
+    fast = FastPreprocessor.from_feature_extractor(
+        feature_extractor, max_batch=args.batch_size
+    )
+    if fast is None:
+        raise Exception("The feature extractor uses options the fast path lacks")
+    exact = FastPreprocessor.from_feature_extractor(
+        feature_extractor, max_batch=args.batch_size, draft=False
+    )
+
+    # Parity, per image, against the feature extractor
+    exact_max = 0.0
+    draft_mean = []
+    draft_max = 0.0
+    for data in files:
+        reference = reference_preprocess(feature_extractor, data)
+        exact_max = max(exact_max, float(np.abs(exact([data])[0] - reference).max()))
+        difference = np.abs(fast([data])[0] - reference)
+        draft_mean.append(float(difference.mean()))
+        draft_max = max(draft_max, float(difference.max()))
+
+    results = {
+        "images": len(files),
+        "feature_extractor": time_each(
+            lambda data: reference_preprocess(feature_extractor, data), files
+        ),
+        "fast_no_draft": time_each(lambda data: exact([data]), files),
+        "fast": time_each(lambda data: fast([data]), files),
+        "parity": {
+            "no_draft_max_diff": exact_max,
+            "draft_mean_diff": sum(draft_mean) / len(draft_mean),
+            "draft_worst_mean_diff": max(draft_mean),
+            "draft_max_diff": draft_max,
+            "drafted": fast.stats()["drafted"],
+        },
+    }
+    parity = results["parity"]
+    problems = []
+    if parity["no_draft_max_diff"] > args.exact_tolerance:
+        problems.append(
+            f"fast path without draft differs by up to {exact_max:.2e} "
+            f"(tolerance {args.exact_tolerance:.0e})"
+        )
+    if parity["draft_worst_mean_diff"] > args.draft_tolerance:
+        problems.append(
+            f"draft decoding differs by {parity['draft_worst_mean_diff']:.4f} on "
+            f"average for one image (tolerance {args.draft_tolerance})"
+        )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{len(files)} images")
+        print(f"{'path':<18} {'p50 ms':>8} {'p99 ms':>8} {'img/s':>8}")
+        for name in ("feature_extractor", "fast_no_draft", "fast"):
+            r = results[name]
+            print(
+                f"{name:<18} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                f"{r['images_per_s']:>8.1f}"
+            )
+        print(
+            f"parity: no-draft max diff {parity['no_draft_max_diff']:.2e}, draft "
+            f"mean diff {parity['draft_mean_diff']:.4f} (worst image "
+            f"{parity['draft_worst_mean_diff']:.4f}, max {parity['draft_max_diff']:.3f})"
+        )
+    if args.check:
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        if problems:
+            raise SystemExit(1)
+        print("OK: fast preprocessing matches the feature extractor")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmarks the Report state machine by driving synthetic sessions through the
+user reporting flow and the moderator review flow with fake Discord objects,
+reporting the cost of each transition and the memory held per session.
+
+    python bench_report_flow.py --sessions 5000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+from collections import defaultdict
+from types import SimpleNamespace
+from report import Report, State
+
+GUILD_ID = 1
+CHANNEL_ID = 2
+MESSAGE_ID = 3
+LINK = f"https://discord.com/channels/{GUILD_ID}/{CHANNEL_ID}/{MESSAGE_ID}"
+
+# Replies sent for each flow, in order. Kidnapping threats are left out since
+# reviewing them runs the deepfake and Perspective models.
+USER_FLOWS = {
+    "spam": ["report", LINK, "yes", "spam", "details", "no", "yes", "yes"],
+    "danger": ["report", LINK, "no", LINK, "yes", "imminent danger", "sh"]
+    + ["details", "no", "no", "yes"],
+    "retry": ["report", "not a link", LINK, "maybe", "yes", "spam?", "other"]
+    + ["details", "yes", LINK, "yes", "hate speech", "", "no", "no", "yes"],
+}
+MODERATOR_FLOWS = {
+    "review": (State.MODERATOR_REVIEW, ["start", "yes"]),
+    "deny": (State.MODERATOR_REVIEW, ["start", "no", "ok"]),
+    "auto_flagged": (State.AUTO_FLAGGED, ["start", "huh", "yes"]),
+}
+
+
+class FakeChannel:
+    def __init__(self):
+        self.id = CHANNEL_ID
+        self.reported = SimpleNamespace(
+            content="reported message",
+            author=SimpleNamespace(name="someone", id=42),
+            attachments=[],
+        )
+
+    async def fetch_message(self, message_id):
+        return self.reported
+
+
+class FakeClient:
+    def __init__(self):
+        self.channel = FakeChannel()
+        self.guild = SimpleNamespace(get_channel=lambda _: self.channel)
+
+    def get_guild(self, guild_id):
+        return self.guild
+
+
+def make_message(content, channel):
+    return SimpleNamespace(content=content, channel=channel)
+
+
+async def drive(report, replies, channel, timings):
+    for content in replies:
+        state = report.state
+        message = make_message(content, channel)
+        start = time.perf_counter()
+        await report.handle_message(message)
+        timings[state.name].append(time.perf_counter() - start)
+
+
+async def run(sessions):
+    client = FakeClient()
+    timings = defaultdict(list)  # Map from state to transition times
+    for i in range(sessions):
+        for replies in USER_FLOWS.values():
+            report = Report(client)
+            await drive(report, replies, client.channel, timings)
+            assert report.report_complete(), report.state
+        for state, replies in MODERATOR_FLOWS.values():
+            report = Report(client)
+            report.state = state
+            await drive(report, replies, client.channel, timings)
+            assert report.mod_complete(), report.state
+    return timings
+
+
+def session_memory(sessions):
+    """
+    Bytes allocated per report parked part-way through the user flow, as they
+    sit in the session store's hot set.
+    """
+    client = FakeClient()
+    replies = USER_FLOWS["spam"][:5]
+
+    async def build():
+        reports = []
+        for _ in range(sessions):
+            report = Report(client)
+            for content in replies:
+                await report.handle_message(make_message(content, client.channel))
+            reports.append(report)
+        return reports
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    reports = asyncio.run(build())
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return total / len(reports)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    timings = asyncio.run(run(args.sessions))
+    elapsed = time.perf_counter() - start
+    transitions = sum(len(t) for t in timings.values())
+    results = {
+        "sessions": args.sessions * (len(USER_FLOWS) + len(MODERATOR_FLOWS)),
+        "transitions_per_s": transitions / elapsed,
+        "bytes_per_session": session_memory(args.sessions),
+        "states": {
+            state: {
+                "count": len(t),
+                "mean_us": sum(t) / len(t) * 1e6,
+                "p99_us": percentile(t, 99) * 1e6,
+            }
+            for state, t in sorted(timings.items())
+        },
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(
+        f"{results['sessions']} sessions, {transitions} transitions, "
+        f"{results['transitions_per_s']:.0f} transitions/s, "
+        f"{results['bytes_per_session']:.0f} bytes/session"
+    )
+    print(f"{'state':<30} {'count':>8} {'mean us':>8} {'p99 us':>8}")
+    for state, r in results["states"].items():
+        print(f"{state:<30} {r['count']:>8} {r['mean_us']:>8.2f} {r['p99_us']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
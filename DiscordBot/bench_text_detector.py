@@ -0,0 +1,139 @@
+"""
+Benchmarks the AI-generated-text detector service on synthetic messages drawn
+from several length distributions, reporting throughput and per-text
+latency, with length bucketing and, for comparison, with every batch padded
+to its longest text.
+
+    python bench_text_detector.py --texts 256 --rate 50
+    python bench_text_detector.py --distributions chat long --no-compare
+
+Texts are offered at --rate per second (0 submits them all at once) and
+latency is measured from each text's scheduled time. Every text is unique,
+so the cache never answers.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import text_detector
+
+WORDS = (
+    "please send the money now or you will never see your daughter again we "
+    "have him and he is safe for now do not call the police wire ten thousand "
+    "dollars to this account by tonight hey are you coming to the game later "
+    "i think the match starts at eight lol see you there"
+).split()
+
+# Words per message for each distribution
+DISTRIBUTIONS = {
+    "short": lambda rng: rng.randint(3, 15),
+    "medium": lambda rng: rng.randint(20, 80),
+    "long": lambda rng: rng.randint(100, 300),
+    # Chat-like: mostly short, with a long tail
+    "chat": lambda rng: min(300, max(1, int(rng.lognormvariate(2.5, 1.0)))),
+}
+
+
+def make_texts(distribution, count, seed=152):
+    rng = random.Random(seed)
+    length = DISTRIBUTIONS[distribution]
+    return [f"{i} " + " ".join(rng.choices(WORDS, k=length(rng))) for i in range(count)]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+async def run(service, texts, rate):
+    loop = asyncio.get_running_loop()
+    latencies = []
+
+    async def one(text, scheduled):
+        await service.predict(text)
+        latencies.append(loop.time() - scheduled)
+
+    start = loop.time()
+    tasks = []
+    for i, text in enumerate(texts):
+        scheduled = start + (i / rate if rate else 0)
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(text, scheduled)))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - start
+    return {
+        "texts_per_s": len(texts) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def bench(args):
+    results = {}
+    modes = {"bucketed": args.batch_tokens}
+    if args.compare:
+        modes["padded"] = 10**9  # One forward pass per batch
+    for name, max_tokens in modes.items():
+        service = text_detector.TextDetectorService(
+            workers=args.workers, max_batch=args.max_batch, max_tokens=max_tokens
+        )
+        await service.warm_up()
+        for distribution in args.distributions:
+            texts = make_texts(distribution, args.texts)
+            await run(service, texts[: args.max_batch], 0)  # Warm-up
+            stats = await run(service, texts[args.max_batch :], args.rate)
+            results.setdefault(distribution, {})[name] = stats
+        await service.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--distributions", nargs="+", default=list(DISTRIBUTIONS), choices=DISTRIBUTIONS
+    )
+    parser.add_argument("--texts", type=int, default=256, help="per distribution")
+    parser.add_argument("--rate", type=float, default=0, help="texts/s, 0 for all")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--max-batch", type=int, default=text_detector.TEXT_DETECTOR_MAX_BATCH
+    )
+    parser.add_argument(
+        "--batch-tokens", type=int, default=text_detector.TEXT_DETECTOR_BATCH_TOKENS
+    )
+    parser.add_argument(
+        "--no-compare",
+        dest="compare",
+        action="store_false",
+        help="skip the run without length bucketing",
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = asyncio.run(bench(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(
+        f"{args.texts} texts per distribution, "
+        f"{'all at once' if not args.rate else f'{args.rate:g}/s'}, "
+        f"{time.perf_counter() - start:.0f}s total"
+    )
+    print(
+        f"{'distribution':<12} {'mode':<9} {'texts/s':>8} {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    for distribution, modes in results.items():
+        for mode, r in modes.items():
+            print(
+                f"{distribution:<12} {mode:<9} {r['texts_per_s']:>8.1f} "
+                f"{r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
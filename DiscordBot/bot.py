@@ -1,56 +1,151 @@
 # bot.py
+import asyncio
 import discord
 from discord.ext import commands
 import os
 import json
 import logging
+import multiprocessing
+from collections import deque
 import re
 import requests
 import pymongo
 from pymongo import MongoClient
 import datetime
 from report import Report, State
+from deepfake_detector import deepfake_service
+from image_fetch import attachment_fetcher
+from text_detector import text_detector
+from memory_mongo import MemoryClient
+from report_store import ReportStore
+from session_store import SESSION_DB_PATH, SessionStore
+from review_queue import (
+    ClaimError,
+    ReviewQueue,
+    SharedReviewQueue,
+    UnknownThreadError,
+)
+from types import SimpleNamespace
 import pdb
 from perspective_api import *
+from rate_limiter import Priority, QueueFullError
+from circuit_breaker import HALF_OPEN, STATE_CODES
+from metrics import METRICS_PORT, metrics
+from send_queue import OutboundDispatcher
+from risk_window import RiskWindow
+from near_duplicates import NearDuplicateIndex, minhash
+from score_cache import normalize_text
+from log_setup import LOG_PATH, setup_logging
 from dotenv import load_dotenv
 
 # Load environment variables from the .env file
 load_dotenv()
 ATLAS_URI = os.getenv("ATLAS_URI")
+# Set MONGO_BACKEND=memory to run without a MongoDB server
+MONGO_BACKEND = os.getenv("MONGO_BACKEND", "atlas")
+# Load the deepfake and AI-generated-text models in the background once
+# connected, instead of on the first moderator review
+DEEPFAKE_WARMUP = os.getenv("DEEPFAKE_WARMUP", "0") == "1"
+# Write the sampled span trace here on shutdown
+METRICS_TRACE_PATH = os.getenv("METRICS_TRACE_PATH")
+# Mod channel used for messages that don't belong to a guild, such as DMs
+DEFAULT_GUILD_ID = int(os.getenv("DEFAULT_GUILD_ID", "1211760623969370122"))
+# Gateway sharding. SHARD_COUNT=0 lets Discord pick the number of shards; with
+# SHARD_PROCESSES > 1 the shards are split across that many processes, which
+# share sessions, the review queue and the mod channel directory through the
+# SQLite database at SESSION_DB_PATH.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_PROCESSES = int(os.getenv("SHARD_PROCESSES", "1"))
+# Auto-flag scoring gives up on Perspective after SCORE_BUDGET seconds and
+# uses local heuristics instead. Messages scored that way are kept (at most
+# DEFERRED_MAX_MESSAGES) and re-checked every DEFERRED_RETRY_INTERVAL seconds
+# once Perspective is reachable again.
+SCORE_BUDGET = float(os.getenv("SCORE_BUDGET", "3"))
+DEFERRED_MAX_MESSAGES = int(os.getenv("DEFERRED_MAX_MESSAGES", "10000"))
+DEFERRED_RETRY_INTERVAL = float(os.getenv("DEFERRED_RETRY_INTERVAL", "15"))
 
-# Set up logging to the console
-logger = logging.getLogger("discord")
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename="discord.log", encoding="utf-8", mode="w")
-handler.setFormatter(
-    logging.Formatter("%(asctime)s:%(levelname)s:%(name)s: %(message)s")
-)
-logger.addHandler(handler)
+logger = logging.getLogger("bot")
+
+
+def load_token():
+    # There should be a file called 'tokens.json' inside the same folder as this file
+    token_path = "tokens.json"
+    if not os.path.isfile(token_path):
+        raise Exception(f"{token_path} not found!")
+    with open(token_path) as f:
+        tokens = json.load(f)
+        return tokens["discord"]
+
+
+def auto_flag_key(message_id):
+    """
+    Session key of an auto-flagged message. Sessions are keyed by integer, and
+    user IDs (the keys of user reports) are always positive, so auto-flags
+    use the negated message ID.
+    """
+    return -message_id
+
+
+def is_auto_flag_key(report_key):
+    return report_key < 0
+
+
+def _log_recheck_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Could not re-check a deferred message: %s", task.exception())
+
+
+def _log_post_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Could not post a report for review: %s", task.exception())
 
-# There should be a file called 'tokens.json' inside the same folder as this file
-token_path = "tokens.json"
-if not os.path.isfile(token_path):
-    raise Exception(f"{token_path} not found!")
-with open(token_path) as f:
-    tokens = json.load(f)
-    discord_token = tokens["discord"]
 
+def _log_warmup_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Could not warm up the models: %s", task.exception())
 
-class ModBot(discord.Client):
-    def __init__(self, group_num=None, guild_id=None):
+
+class ModBot(discord.AutoShardedClient):
+    def __init__(
+        self,
+        group_num=None,
+        guild_id=None,
+        shard_ids=None,
+        shard_count=None,
+        shared=False,
+        metrics_port=METRICS_PORT,
+    ):
         intents = discord.Intents.default()
         intents.message_content = True
-        super().__init__(intents=intents)
+        super().__init__(intents=intents, shard_ids=shard_ids, shard_count=shard_count)
         self.group_num = group_num
         self.guild_id = guild_id
-        self.mod_channels = {}  # Map from guild to the mod channel id for that guild
-        self.reports = {}  # Map from user IDs to the state of their report
-        self.curr_report_author = None  # Stores the author of the current report
+        self.metrics_port = metrics_port
+        self.mod_channels = {}  # Map from guild ID to the mod channel of that guild
+        # Map from user IDs to their report
+        self.reports = SessionStore(self, shared=shared)
+        # Reports waiting for moderator review
+        if shared:
+            self.review_queue = SharedReviewQueue(SESSION_DB_PATH)
+        else:
+            self.review_queue = ReviewQueue(self.reports)
+        self.outbox = OutboundDispatcher()  # Queued messages to Discord channels
+        self.review_posts = set()  # Tasks posting reports to mod channels
+        self.risk_window = RiskWindow()  # Recent scores of each user
+        self.near_duplicates = NearDuplicateIndex()  # Recent message clusters
+        # Messages scored in degraded mode, waiting to be re-checked
+        self.deferred = deque(maxlen=DEFERRED_MAX_MESSAGES)
+        self.deferred_task = None
+        self.warmup_task = None
 
         # Connect to MongoDB
-        self.client = MongoClient(ATLAS_URI)
+        if MONGO_BACKEND == "memory":
+            self.client = MemoryClient()
+        else:
+            self.client = MongoClient(ATLAS_URI)
         self.db = self.client["DiscordBot"]
         self.collection = self.db["usernames"]
+        self.report_store = ReportStore(self.collection, self.db["report_counts"])
 
     async def on_ready(self):
         print(f"{self.user.name} has connected to Discord! It is these guilds:")
@@ -69,10 +164,46 @@ class ModBot(discord.Client):
 
         # Find the mod channel in each guild that this bot should report to
         for guild in self.guilds:
-            for channel in guild.text_channels:
-                if channel.name == f"group-{self.group_num}-mod":
-                    self.mod_channels[guild.id] = channel
+            self.register_guild(guild)
 
+        await self.report_store.ensure_indexes()
+
+        # Re-queue reports that were waiting for review before a restart
+        for report_key in self.reports.keys():
+            if self.reports[report_key].in_review():
+                self.review_queue.enqueue(report_key, self.reports[report_key])
+
+        metrics.gauge("review_queue_waiting", lambda: len(self.review_queue))
+        metrics.gauge("outbound_queue_depth", self.outbox.pending)
+        metrics.gauge("risk_window_users", lambda: len(self.risk_window))
+        metrics.gauge("near_duplicate_hits", lambda: self.near_duplicates.hits)
+        metrics.gauge("deepfake_cache_hits", lambda: deepfake_service.verdict_hits)
+        metrics.gauge("deepfake_similar_images", lambda: deepfake_service.similar.hits)
+        metrics.gauge("report_buffer_size", lambda: len(self.report_store.buffer))
+        metrics.gauge("deferred_messages", lambda: len(self.deferred))
+        metrics.gauge(
+            "perspective_breaker_state",
+            lambda: STATE_CODES[perspective_client.breaker.state],
+        )
+        metrics.gauge(
+            "perspective_breaker_opened", lambda: perspective_client.breaker.opened
+        )
+        metrics.gauge("perspective_fallbacks", lambda: sum(fallbacks.values()))
+        metrics.gauge("perspective_hedged", lambda: perspective_client.hedged)
+        for priority in Priority:
+            metrics.gauge(
+                f"perspective_queue_depth_{priority.name.lower()}",
+                lambda p=priority: len(perspective_client.limiter.queues[p]),
+            )
+        await metrics.start_server(port=self.metrics_port)
+
+        if DEEPFAKE_WARMUP:
+            self.warmup_task = asyncio.ensure_future(
+                asyncio.gather(deepfake_service.warm_up(), text_detector.warm_up())
+            )
+            self.warmup_task.add_done_callback(_log_warmup_error)
+
+    @metrics.timed("on_message")
     async def on_message(self, message):
         """
         This function is called whenever a message is sent in a channel that the bot can see (including DMs).
@@ -88,31 +219,175 @@ class ModBot(discord.Client):
         else:
             await self.handle_dm(message)
 
-        mod_channel = self.mod_channels[self.guild_id]
-        scores = score_format(eval_text(message.content))
+        priority = Priority.CHANNEL if message.guild else Priority.DM
+        await self.auto_flag(message, priority)
+
+    async def auto_flag(self, message, priority, deferred=False):
+        """
+        Scores a message and alerts moderators if it, or its author's recent
+        messages, cross the thresholds. Returns False if Perspective couldn't
+        be reached and the message was set aside to be checked again.
+        """
+        try:
+            response, cluster = await self.score_message(message.content, priority)
+        except QueueFullError as e:
+            logger.info("Skipping auto-flag check: %s", e)
+            return True
+        scores = score_format(response)
+        degraded = response.get("degraded", False)
 
         eval = None
+        flag_score = max(scores["scores"].values())
+        # Escalation across the author's recent messages
+        risk = self.risk_window.check(message.author.id, scores["scores"])
         if (
             scores["scores"]["threat"] > 0.6
             or scores["scores"]["toxicity"] > 0.6
             or scores["scores"]["sexually_explicit"] > 0.6
         ):
             eval = "Alert! This message has been auto-flagged by our system."
-            eval += f"\n\nMessage:: {message.content}"
-            eval += f"\n\nScores: {scores}"
-            await mod_channel.send(eval)
-            await self.handle_dm(message, auto_flagged=True)
+        elif risk is not None:
+            eval = "Alert! This user's recent messages have been auto-flagged by our system."
+            eval += f"\n\nRisk over their last messages: {risk:.2f}"
+            flag_score = risk  # Can exceed 1, which puts escalations first
+        if eval is None:
+            if degraded:
+                self.defer(message, retry=deferred)
+            return not degraded
+        if degraded:
+            eval += "\n\n(Scored by local heuristics while Perspective is unavailable.)"
+        if cluster is not None and cluster.alert is not None:
+            # Another copy of an alerted message: count it on the existing alert
+            cluster.flagged += 1
+            cluster.authors.add(message.author.id)
+            await self.update_cluster_alert(cluster)
+            return True
+        eval += f"\n\nMessage:: {message.content}"
+        eval += f"\n\nScores: {scores}"
+        mod_channel = self.get_mod_channel(message.guild.id if message.guild else None)
+        if mod_channel is not None:
+            # Cluster alerts are edited later, so they must be sent on their own
+            alert = self.send(mod_channel, eval, merge=cluster is None)
+            if cluster is not None:
+                cluster.alert = alert
+                cluster.flagged = 1
+                cluster.authors.add(message.author.id)
+        await self.handle_dm(message, auto_flagged=True, flag_score=flag_score)
+        return True
+
+    def defer(self, message, retry=False):
+        if retry:
+            self.deferred.appendleft(message)  # Keep its place at the front
+        else:
+            self.deferred.append(message)
+        if self.deferred_task is None or self.deferred_task.done():
+            self.deferred_task = asyncio.create_task(self.check_deferred())
+
+    async def check_deferred(self):
+        """
+        Re-checks messages that were scored in degraded mode, oldest first,
+        whenever Perspective's circuit isn't open.
+        """
+        while self.deferred:
+            await asyncio.sleep(DEFERRED_RETRY_INTERVAL)
+            while self.deferred and perspective_client.breaker.available():
+                # A half-open circuit lets one probe through, so send just one
+                size = 1 if perspective_client.breaker.state == HALF_OPEN else 50
+                batch = [
+                    self.deferred.popleft()
+                    for _ in range(min(size, len(self.deferred)))
+                ]
+                tasks = [
+                    asyncio.create_task(
+                        self.auto_flag(
+                            message,
+                            Priority.CHANNEL if message.guild else Priority.DM,
+                            deferred=True,
+                        )
+                    )
+                    for message in batch
+                ]
+                for task in tasks:
+                    task.add_done_callback(_log_recheck_error)
+                # Scoring is over within SCORE_BUDGET; tasks still running
+                # after that are only waiting for their alerts to be posted
+                done, _ = await asyncio.wait(tasks, timeout=SCORE_BUDGET + 1)
+                if any(t.exception() is None and not t.result() for t in done):
+                    break
+
+    async def score_message(self, content, priority):
+        """
+        Scores a message with Perspective, unless an identical copy (after
+        normalization) was scored recently, in which case its scores are
+        reused. Returns the scores and the cluster of near-duplicates the
+        message belongs to (None for short messages). Scoring takes at most
+        SCORE_BUDGET seconds, after which local heuristic scores (marked
+        "degraded") are returned instead.
+        """
+        if not self.near_duplicates.eligible(content):
+            return await self.eval_within_budget(content, priority), None
+        signature = minhash(content)
+        key = normalize_text(content)
+        cluster = self.near_duplicates.match(signature)
+        if cluster is None:
+            cluster = self.near_duplicates.add(signature)
+        elif key in cluster.verdicts:
+            try:
+                return await asyncio.shield(cluster.verdicts[key]), cluster
+            except Exception:
+                pass  # The first copy could not be scored, so score this one
+        verdict = cluster.verdicts[key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await self.eval_within_budget(content, priority)
+        except Exception as e:
+            verdict.set_exception(e)
+            verdict.exception()  # Copies waiting on it handle it themselves
+            raise
+        finally:
+            # Later copies find settled scores in the score cache
+            if cluster.verdicts.get(key) is verdict:
+                del cluster.verdicts[key]
+        if response.get("degraded"):
+            # Not a verdict worth sharing: copies try Perspective themselves
+            verdict.set_exception(Exception("Scored in degraded mode"))
+            verdict.exception()
+        else:
+            verdict.set_result(response)
+        return response, cluster
 
-    async def handle_dm(self, message, auto_flagged=False):
+    async def eval_within_budget(self, content, priority):
+        return await eval_text(
+            content,
+            use_prefilter=True,
+            priority=priority,
+            budget=SCORE_BUDGET,
+            degrade=True,
+        )
+
+    async def update_cluster_alert(self, cluster):
+        # Edit at 2, 4, 8, ... copies so a raid costs a handful of edits
+        if cluster.flagged & (cluster.flagged - 1):
+            return
+        try:
+            post = await cluster.alert
+            if cluster.alert_text is None:
+                cluster.alert_text = post.content[:1900]  # Room for the count
+            await post.edit(
+                content=f"{cluster.alert_text}\n\nSeen {cluster.flagged} times "
+                f"from {len(cluster.authors)} account(s)."
+            )
+        except (discord.HTTPException, AttributeError):
+            pass
+
+    async def handle_dm(self, message, auto_flagged=False, flag_score=None):
         # Handle a help message
         if message.content == Report.HELP_KEYWORD:
             reply = "Use the `report` command to begin the reporting process.\n"
             reply += "Use the `cancel` command to cancel the report process.\n"
-            await message.channel.send(reply)
+            self.send(message.channel, reply)
             return
 
         author_id = message.author.id
-        mod_channel = self.mod_channels[self.guild_id]
         responses = []
 
         if not auto_flagged:
@@ -128,83 +403,316 @@ class ModBot(discord.Client):
 
             # Let the report class handle this message; forward all the messages it returns to us
             responses = await self.reports[author_id].handle_message(message)
+            self.reports.save(author_id)
             for r in responses:
-                await message.channel.send(r)
+                self.send(message.channel, r, merge=True)
 
             # If the report is complete or cancelled, remove it from our map
             if self.reports[author_id].report_complete():
-                self.curr_report_author = author_id
-                # Forward the report to the mod channel
-                await mod_channel.send(f"Report Submitted.")
-
                 # Handle moderator review
                 self.reports[author_id].state = State.MODERATOR_REVIEW
                 responses = await self.reports[author_id].handle_message(message)
-                for r in responses:
-                    await mod_channel.send(r)
+                self.reports.save(author_id)
+                await self.submit_for_review(author_id, responses)
         else:
-            if author_id not in self.reports:
-                self.reports[author_id] = Report(self)
-            self.curr_report_author = author_id
-            self.reports[author_id].state = State.AUTO_FLAGGED
-            responses = await self.reports[author_id].handle_message(message)
-            for r in responses:
-                await mod_channel.send(r)
+            # Each flagged message gets its own session, separate from any
+            # report its author is filing
+            report_key = auto_flag_key(message.id)
+            report = self.reports.get(report_key) or Report(self)
+            report.state = State.AUTO_FLAGGED
+            report.flag_score = flag_score
+            report.guild_id = message.guild.id if message.guild else None
+            responses = await report.handle_message(message)
+            self.reports.save(report_key, report)
+            await self.submit_for_review(report_key, responses)
+
+    async def submit_for_review(self, report_key, responses):
+        """
+        Queues a report for moderator review and posts it to the mod channel in
+        the background, in its own thread when the bot is allowed to create one.
+        """
+        report = self.reports[report_key]
+        ticket = self.review_queue.enqueue(report_key, report)
+        mod_channel = self.get_mod_channel(report.guild_id)
+        if mod_channel is None:
+            logger.warning(
+                "No mod channel for guild %s, report #%s is only queued",
+                report.guild_id,
+                ticket,
+            )
+            return
+        # The post waits its turn in the mod channel's send queue, which the
+        # message being handled shouldn't have to
+        task = asyncio.create_task(self.post_for_review(mod_channel, ticket, responses))
+        self.review_posts.add(task)
+        task.add_done_callback(self.review_posts.discard)
+        task.add_done_callback(_log_post_error)
+
+    async def post_for_review(self, mod_channel, ticket, responses):
+        post = await self.send(
+            mod_channel,
+            f"Report #{ticket} submitted. {len(self.review_queue)} report(s) waiting for review.",
+        )
+        channel = mod_channel
+        try:
+            channel = await post.create_thread(name=f"Report #{ticket}")
+            self.review_queue.attach_thread(ticket, channel.id)
+        except (discord.HTTPException, AttributeError):
+            pass
+        for r in responses:
+            self.send(channel, r, merge=True)
+
+    def register_guild(self, guild):
+        """
+        Records the guild's mod channel, in the shared directory as well so that
+        processes serving other shards can post to it.
+        """
+        for channel in guild.text_channels:
+            if channel.name == f"group-{self.group_num}-mod":
+                self.mod_channels[guild.id] = channel
+                self.review_queue.register_mod_channel(guild.id, channel.id)
+
+    async def on_guild_join(self, guild):
+        self.register_guild(guild)
+
+    def is_known_guild(self, guild_id):
+        return (
+            guild_id in self.mod_channels
+            or self.review_queue.mod_channel_id(guild_id) is not None
+        )
+
+    def get_mod_channel(self, guild_id=None):
+        """
+        The mod channel for a guild, falling back to the default guild's. Mod
+        channels of guilds on other shards are reached over the REST API.
+        """
+        for gid in (guild_id, self.guild_id):
+            if gid is None:
+                continue
+            if gid in self.mod_channels:
+                return self.mod_channels[gid]
+            channel_id = self.review_queue.mod_channel_id(gid)
+            if channel_id is not None:
+                return self.get_partial_messageable(channel_id, guild_id=gid)
+        return None
+
+    def is_mod_channel(self, channel):
+        name = f"group-{self.group_num}-mod"
+        parent = getattr(channel, "parent", None)
+        return channel.name == name or (parent is not None and parent.name == name)
+
+    async def handle_review_command(self, message):
+        """
+        Handles the `claim`, `release` and `queue` moderator commands. Returns
+        True if the message was one of them.
+        """
+        command = message.content.strip().lower()
+        moderator_id = message.author.id
+        if command == "queue":
+            waiting = self.review_queue.waiting()
+            reply = f"{len(self.review_queue)} report(s) waiting for review."
+            if waiting:
+                reply += " Next up: " + ", ".join(f"#{t}" for t in waiting)
+            self.send(message.channel, reply)
+        elif command == "claim":
+            ticket = self.review_queue.claim_next(moderator_id)
+            if ticket is None:
+                self.send(message.channel, "No reports are waiting for review.")
+            else:
+                report = self.reports.get(self.review_queue.report_key(ticket))
+                if report is None:
+                    self.expire_ticket(message.channel, ticket)
+                    return True
+                self.send(
+                    message.channel,
+                    f"You are now reviewing report #{ticket}.\n"
+                    f"Flagged message: {report.message}\n"
+                    f"Imminent danger: {report.imminent_danger}\n"
+                    f"Virtual kidnapping: {report.virtual_kidnapping}\n"
+                    f"Auto-flag score: {report.flag_score}",
+                )
+        elif command == "release":
+            ticket = self.review_queue.claim_of(moderator_id)
+            if ticket is not None:
+                self.review_queue.release(ticket)
+                self.send(message.channel, f"Report #{ticket} is back in the queue.")
+        else:
+            return False
+        return True
+
+    def expire_ticket(self, channel, ticket):
+        """
+        Drops a queued ticket whose report session no longer exists.
+        """
+        logger.warning("Report #%s has no session, dropping it", ticket)
+        self.review_queue.complete(ticket)
+        self.send(channel, f"Report #{ticket} has expired and was removed.")
 
     async def handle_channel_message(self, message):
         # Moderator review flow
-        if message.channel.name == f"group-{self.group_num}-mod":
-            mod_channel = self.mod_channels[message.guild.id]
-            responses = await self.reports[self.curr_report_author].handle_message(
-                message
-            )
-            print("Message: ", message)
-            print("Responses: ", responses)
-            report_count = self.get_report_count(
-                self.reports[self.curr_report_author].message_author_id
+        if self.is_mod_channel(message.channel):
+            if await self.handle_review_command(message):
+                return
+            try:
+                ticket, content = self.review_queue.route(
+                    message.channel.id,
+                    message.author.id,
+                    message.content,
+                    thread=isinstance(message.channel, discord.Thread),
+                )
+            except (ClaimError, UnknownThreadError) as e:
+                self.send(message.channel, str(e))
+                return
+            if ticket is None:
+                self.send(message.channel, "No reports are waiting for review.")
+                return
+            if content != message.content:
+                message = SimpleNamespace(
+                    content=content,
+                    author=message.author,
+                    channel=message.channel,
+                    guild=message.guild,
+                )
+
+            report_key = self.review_queue.report_key(ticket)
+            report = self.reports.get(report_key)
+            if report is None:
+                self.expire_ticket(message.channel, ticket)
+                return
+            reply_channel = message.channel
+            responses = await report.handle_message(message)
+            self.reports.save(report_key, report)
+            logger.debug(
+                "Report #%s: moderator said %r, %d responses",
+                ticket,
+                message.content,
+                len(responses),
             )
+            report_count = await self.get_report_count(report.message_author_id)
             if report_count > 0:
-                await mod_channel.send(
-                    f"This user has been previously reported {report_count} times for malicious behavior."
+                self.send(
+                    reply_channel,
+                    f"This user has been previously reported {report_count} times for malicious behavior.",
                 )
             for r in responses:
-                await mod_channel.send(r)
-
-            if self.reports[self.curr_report_author].mod_complete():
-                await mod_channel.send("Thank you for your review.")
-                if self.reports[self.curr_report_author].virtual_kidnapping:
-                    if not self.reports[self.curr_report_author].fake:
-                        await self.reports[self.curr_report_author].author_channel.send(
-                            "We have detected the user's messages to be malicious and have quarantined them. Our model has flagged the contents of their messages as potentially real. Please exercise caution and contact your local law enforcement."
+                self.send(reply_channel, r, merge=True)
+
+            if report.mod_complete():
+                self.send(
+                    reply_channel, f"Thank you for your review of report #{ticket}."
+                )
+                if report.virtual_kidnapping:
+                    author_channel = await self.get_author_channel(report)
+                    if not report.fake:
+                        self.send(
+                            author_channel,
+                            "We have detected the user's messages to be malicious and have quarantined them. Our model has flagged the contents of their messages as potentially real. Please exercise caution and contact your local law enforcement.",
                         )
                     else:
-                        await self.reports[self.curr_report_author].author_channel.send(
-                            "We have detected the user's messages to be malicious and have quarantined them. Our model has flagged the contents of their messages as AI-generated. Although the threat is likely false, please exercise caution and contact your local law enforcement."
+                        self.send(
+                            author_channel,
+                            "We have detected the user's messages to be malicious and have quarantined them. Our model has flagged the contents of their messages as AI-generated. Although the threat is likely false, please exercise caution and contact your local law enforcement.",
                         )
-                self.save_report(
-                    self.curr_report_author, self.reports[self.curr_report_author]
-                )
-                self.reports.pop(self.curr_report_author)
+                reporter_id = None if is_auto_flag_key(report_key) else report_key
+                await self.save_report(reporter_id, report)
+                self.review_queue.complete(ticket)
+                self.reports.pop(report_key)
             return
 
         # Only handle messages sent in the "group-#" channel
         if not message.channel.name == f"group-{self.group_num}":
             return
 
-    def get_report_count(self, user_id):
+    async def drain_outbox(self):
+        """
+        Waits for pending review posts and all queued messages to be sent.
+        """
+        if self.review_posts:
+            await asyncio.gather(*self.review_posts, return_exceptions=True)
+        await self.outbox.close()
+
+    def send(self, channel, content, merge=False):
+        """
+        Queues a message for a channel without waiting for it to be sent; await
+        the returned future for the sent discord.Message. With `merge`, it may
+        be sent in one Discord message with the merged messages around it.
+        """
+        return self.outbox.send(channel, content, merge=merge)
+
+    async def close(self):
+        if METRICS_TRACE_PATH:
+            metrics.dump_trace(METRICS_TRACE_PATH)
+        await self.drain_outbox()
+        await metrics.close()
+        await perspective_client.close()
+        score_cache.close()
+        if self.deferred_task is not None:
+            self.deferred_task.cancel()
+        await deepfake_service.close()
+        await text_detector.close()
+        await attachment_fetcher.close()
+        await self.report_store.close()
+        self.reports.close()
+        self.review_queue.close()
+        await super().close()
+
+    async def get_author_channel(self, report):
+        # Reports restored after a restart may only know the channel's ID
+        if report.author_channel is None:
+            report.author_channel = await self.fetch_channel(report.author_channel_id)
+        return report.author_channel
+
+    @metrics.timed("get_report_count")
+    async def get_report_count(self, user_id):
         # Query the database to check if the user ID exists
-        report_count = self.collection.count_documents({"reported_user_id": user_id})
+        report_count = await self.report_store.count_for_user(user_id)
         return report_count
 
-    def save_report(self, reporter_user_id, report):
+    @metrics.timed("save_report")
+    async def save_report(self, reporter_user_id, report):
         report_data = {
             "reporter_user_id": reporter_user_id,
             "reported_user_id": report.message_author_id,
             "timestamp": datetime.datetime.now(datetime.timezone.utc),
         }
-        self.collection.insert_one(report_data)
-        print("Report saved to database")
+        await self.report_store.save(report_data)
+        logger.debug("Report queued for database")
+
+
+def run_bot(shard_ids=None, shard_count=None, process_index=0):
+    # One log file per process, since rotation can't be shared between them
+    setup_logging(f"{LOG_PATH}.{process_index}" if SHARD_PROCESSES > 1 else LOG_PATH)
+    client = ModBot(
+        group_num=27,
+        guild_id=DEFAULT_GUILD_ID,
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+        shared=SHARD_PROCESSES > 1,
+        metrics_port=METRICS_PORT + process_index if METRICS_PORT else 0,
+    )
+    client.run(load_token(), log_handler=None)
+
+
+def main():
+    if SHARD_PROCESSES <= 1:
+        run_bot(shard_count=SHARD_COUNT or None)
+        return
+
+    # Shard i goes to process i % SHARD_PROCESSES
+    shard_count = SHARD_COUNT or SHARD_PROCESSES
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_bot,
+            args=(list(range(i, shard_count, SHARD_PROCESSES)), shard_count, i),
+        )
+        for i in range(SHARD_PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
 
 
-client = ModBot(group_num=27, guild_id=1211760623969370122)
-client.run(discord_token)
+if __name__ == "__main__":
+    main()
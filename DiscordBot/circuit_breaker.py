@@ -0,0 +1,98 @@
+import time
+
+CLOSED = "closed"  # Calls go through
+OPEN = "open"  # Calls fail fast
+HALF_OPEN = "half_open"  # One probe call goes through
+
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} circuit is open, retrying in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency that is failing. After `failures` consecutive
+    calls that errored or took longer than `slow` seconds, the circuit opens
+    and calls fail fast with CircuitOpenError for `reset_timeout` seconds.
+    Then a single probe call is let through: if it succeeds the circuit
+    closes, otherwise it opens again.
+    """
+
+    def __init__(self, name, failures=5, slow=1.5, reset_timeout=30):
+        self.name = name
+        self.failures = failures
+        self.slow = slow
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self.opened_at = 0.0
+        self.consecutive = 0
+        self.probing = False
+        self.opened = 0  # Times the circuit has opened
+        self.rejected = 0  # Calls failed fast while open
+
+    @property
+    def state(self):
+        if (
+            self._state == OPEN
+            and time.monotonic() - self.opened_at >= self.reset_timeout
+        ):
+            self._state = HALF_OPEN
+        return self._state
+
+    def available(self):
+        return self.state != OPEN
+
+    def before_call(self):
+        """
+        Raises CircuitOpenError unless a call may go through now. Every call
+        let through must end in `record` or `abandon`.
+        """
+        state = self.state
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return
+        self.rejected += 1
+        retry_in = max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record(self, ok, latency=0.0):
+        """
+        Records the outcome of a call; a slow success counts as a failure.
+        """
+        if ok and latency <= self.slow:
+            self.consecutive = 0
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+        else:
+            self.consecutive += 1
+            if self._state == HALF_OPEN or self.consecutive >= self.failures:
+                self._open()
+        self.probing = False
+
+    def abandon(self):
+        """
+        Ends a call that never reached the dependency, such as one shed by the
+        rate limiter, without counting it either way.
+        """
+        self.probing = False
+
+    def _open(self):
+        if self._state != OPEN:
+            self.opened += 1
+        self._state = OPEN
+        self.opened_at = time.monotonic()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
@@ -1,42 +1,749 @@
-import torch
-from torchvision import transforms
-from PIL import Image
-from transformers import AutoModelForImageClassification, AutoFeatureExtractor, pipeline
-import requests
 from io import BytesIO
+import asyncio
+import itertools
+import multiprocessing
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import SyncManager
+from image_fetch import attachment_fetcher, fetch_sync
+from image_hash import HASH_CACHE_SIZE, PerceptualHashIndex, content_hash, dhash
+from image_preprocess import FastPreprocessor
+from metrics import metrics
 
+# torch, transformers and PIL are imported on first use so that
+# importing this module (and therefore the bot) stays cheap.
 model_name = "DhruvJariwala/deepfake_vs_real_image_detection"
-model = AutoModelForImageClassification.from_pretrained(model_name)
-feature_extractor = AutoFeatureExtractor.from_pretrained(model_name)
+
+# Inference service settings
+DEEPFAKE_WORKERS = int(os.getenv("DEEPFAKE_WORKERS", "1"))
+DEEPFAKE_MAX_BATCH = int(os.getenv("DEEPFAKE_MAX_BATCH", "8"))
+DEEPFAKE_MAX_WAIT_MS = float(os.getenv("DEEPFAKE_MAX_WAIT_MS", "10"))
+
+# Inference backend: `eager` (fp32), `int8` (dynamic quantization) or `onnx`
+# (exported graph on ONNX Runtime). Thread counts of 0 keep the defaults.
+DEEPFAKE_BACKEND = os.getenv("DEEPFAKE_BACKEND", "eager")
+DEEPFAKE_THREADS = int(os.getenv("DEEPFAKE_THREADS", "0"))
+DEEPFAKE_INTEROP_THREADS = int(os.getenv("DEEPFAKE_INTEROP_THREADS", "0"))
+DEEPFAKE_ONNX_PATH = os.getenv("DEEPFAKE_ONNX_PATH", "deepfake_model.onnx")
+# Decode and resize images with image_preprocess.FastPreprocessor instead of
+# the feature extractor
+DEEPFAKE_FAST_PREPROCESS = os.getenv("DEEPFAKE_FAST_PREPROCESS", "1") == "1"
+
+# GIFs and videos are sampled at DEEPFAKE_FRAME_RATE frames per second, at most
+# DEEPFAKE_MAX_FRAMES per attachment. Analysis stops once any frame is at
+# least DEEPFAKE_EARLY_EXIT likely to be a deepfake.
+DEEPFAKE_FRAME_RATE = float(os.getenv("DEEPFAKE_FRAME_RATE", "1"))
+DEEPFAKE_MAX_FRAMES = int(os.getenv("DEEPFAKE_MAX_FRAMES", "32"))
+DEEPFAKE_EARLY_EXIT = float(os.getenv("DEEPFAKE_EARLY_EXIT", "0.95"))
+DEEPFAKE_VIDEO_MAX_BYTES = int(os.getenv("DEEPFAKE_VIDEO_MAX_BYTES", str(100 * 2**20)))
+
+# Label of the model's deepfake class
+DEEPFAKE_FAKE_LABEL = os.getenv("DEEPFAKE_FAKE_LABEL", "Fake")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".webm", ".mkv", ".avi")
 
 # Testing URL
 # URL = 'https://cdn.britannica.com/70/234870-050-D4D024BB/Orange-colored-cat-yawns-displaying-teeth.jpg'
 
+_model = None
+_feature_extractor = None
+_pipe = None
+_backend = None
+_preprocessor = None
+
+
+def load_model():
+    """
+    Loads the model and feature extractor once per process.
+    """
+    global _model, _feature_extractor
+    if _model is None:
+        from transformers import AutoModelForImageClassification, AutoFeatureExtractor
+
+        _model = AutoModelForImageClassification.from_pretrained(model_name)
+        _feature_extractor = AutoFeatureExtractor.from_pretrained(model_name)
+    return _model, _feature_extractor
+
+
+def get_pipeline():
+    """
+    Builds the image-classification pipeline once per process, reusing the
+    loaded model and feature extractor.
+    """
+    global _pipe
+    if _pipe is None:
+        from transformers import pipeline
+
+        model, feature_extractor = load_model()
+        _pipe = pipeline(
+            "image-classification",
+            model=model,
+            feature_extractor=feature_extractor,
+            device=-1,
+        )
+    return _pipe
+
+
+def get_preprocessor():
+    """
+    The fast preprocessor for the model's feature extractor, or None if it is
+    disabled or the feature extractor uses options it doesn't support.
+    """
+    global _preprocessor
+    if _preprocessor is None:
+        _, feature_extractor = load_model()
+        _preprocessor = False
+        if DEEPFAKE_FAST_PREPROCESS:
+            _preprocessor = (
+                FastPreprocessor.from_feature_extractor(
+                    feature_extractor, DEEPFAKE_MAX_BATCH
+                )
+                or False
+            )
+    return _preprocessor or None
+
+
+def pixel_values(images):
+    """
+    Model input for a list of PIL images or encoded image bytes, as a float32
+    array of shape (batch, 3, height, width).
+    """
+    import numpy as np
+    from PIL import Image
+
+    preprocessor = get_preprocessor()
+    if preprocessor is not None:
+        return preprocessor(images)
+    _, feature_extractor = load_model()
+    images = [
+        Image.open(BytesIO(image)) if isinstance(image, (bytes, bytearray)) else image
+        for image in images
+    ]
+    images = [image.convert("RGB") for image in images]
+    return feature_extractor(images=images, return_tensors="np")["pixel_values"].astype(
+        np.float32
+    )
+
 
 # Preprocess the image
 def preprocess_image(url):
-    response = requests.get(url)
-    image = Image.open(BytesIO(response.content)).convert("RGB")
-    inputs = feature_extractor(images=image, return_tensors="pt")
-    return inputs
+    import torch
 
+    # Copied, since the fast preprocessor reuses its output buffer
+    return {"pixel_values": torch.from_numpy(pixel_values([fetch_sync(url)]).copy())}
 
+
+@metrics.timed("predict_deepfake")
 def predict_deepfake(url):
+    import torch
+
+    model, _ = load_model()
     inputs = preprocess_image(url)
     with torch.no_grad():
         outputs = model(**inputs)
         logits = outputs.logits
         predicted_class_idx = logits.argmax(-1).item()
     ret = f"LOGITS: {logits} \n"
-    if predicted_class_idx == 1:
+    if model.config.id2label[predicted_class_idx] == find_fake_label(model):
         ret += "The image is AI-generated (deepfake). \n"
     else:
         ret += "The image is not AI-generated (real). \n"
     return ret
 
 
+@metrics.timed("predict_deepfake_nopreprocessing")
 def predict_deepfake_nopreprocessing(url):
-    pipe = pipeline("image-classification", model=model_name, device=-1)
-    response = requests.get(url)
-    img = Image.open(BytesIO(response.content))
-    return pipe(img)
+    from PIL import Image
+
+    img = Image.open(BytesIO(fetch_sync(url)))
+    return get_pipeline()(img)
+
+
+class EagerBackend:
+    """
+    fp32 model in eager mode.
+    """
+
+    name = "eager"
+
+    def __init__(self, model):
+        self.model = model.eval()
+
+    def logits(self, pixel_values):
+        import torch
+
+        with torch.no_grad():
+            return self.model(
+                pixel_values=torch.from_numpy(pixel_values)
+            ).logits.numpy()
+
+
+class Int8Backend(EagerBackend):
+    """
+    Linear layers dynamically quantized to int8; activations stay fp32.
+    """
+
+    name = "int8"
+
+    def __init__(self, model):
+        import torch
+
+        super().__init__(
+            torch.quantization.quantize_dynamic(
+                model.eval(), {torch.nn.Linear}, dtype=torch.qint8
+            )
+        )
+
+
+class OnnxBackend:
+    """
+    Model exported to ONNX once (cached at DEEPFAKE_ONNX_PATH) and run with
+    ONNX Runtime's graph optimizations. Requires the `onnxruntime` package.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model, feature_extractor, path=DEEPFAKE_ONNX_PATH, threads=0):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise Exception(
+                "DEEPFAKE_BACKEND=onnx requires onnxruntime (pip install onnxruntime)"
+            )
+        if not os.path.isfile(path):
+            export_onnx(model, feature_extractor, path)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+
+    def logits(self, pixel_values):
+        return self.session.run(["logits"], {"pixel_values": pixel_values})[0]
+
+
+def export_onnx(model, feature_extractor, path):
+    import torch
+    from PIL import Image
+
+    # Let the feature extractor decide the input shape
+    dummy = feature_extractor(images=Image.new("RGB", (64, 64)), return_tensors="pt")[
+        "pixel_values"
+    ]
+    torch.onnx.export(
+        model.eval(),
+        (dummy,),
+        path,
+        input_names=["pixel_values"],
+        output_names=["logits"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17,
+    )
+
+
+BACKENDS = {"eager": EagerBackend, "int8": Int8Backend, "onnx": OnnxBackend}
+
+
+def configure_threads(
+    threads=DEEPFAKE_THREADS, interop_threads=DEEPFAKE_INTEROP_THREADS
+):
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            pass  # Can only be set before any inter-op parallel work has started
+
+
+def load_backend(name=DEEPFAKE_BACKEND, threads=DEEPFAKE_THREADS):
+    if name not in BACKENDS:
+        raise Exception(
+            f"Unknown DEEPFAKE_BACKEND {name!r}, expected one of {', '.join(BACKENDS)}"
+        )
+    model, feature_extractor = load_model()
+    if name == "onnx":
+        return OnnxBackend(model, feature_extractor, threads=threads)
+    return BACKENDS[name](model)
+
+
+def get_backend(threads=DEEPFAKE_THREADS):
+    global _backend
+    if _backend is None:
+        _backend = load_backend(threads=threads)
+    return _backend
+
+
+def classify_images(images, backend=None):
+    """
+    Classifies PIL images or encoded image bytes in one batched forward pass.
+    Returns one list of {"label", "score"} dicts per image, highest score
+    first, in the same format as the transformers image-classification
+    pipeline.
+    """
+    import numpy as np
+
+    backend = backend or get_backend()
+    model, _ = load_model()
+    logits = backend.logits(pixel_values(images))
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    probs = np.exp(logits)
+    probs /= probs.sum(axis=-1, keepdims=True)
+    labels = model.config.id2label
+    return [
+        [{"label": labels[i], "score": float(row[i])} for i in np.argsort(row)[::-1]]
+        for row in probs
+    ]
+
+
+def find_fake_label(model, name=DEEPFAKE_FAKE_LABEL):
+    """
+    The model's label for deepfakes, matched case-insensitively by name.
+    """
+    labels = list(model.config.id2label.values())
+    for label in labels:
+        if label.lower() == name.lower():
+            return label
+    raise Exception(f"The model has no {name!r} label (labels: {labels})")
+
+
+def fake_probability(scores, label):
+    return next((s["score"] for s in scores if s["label"] == label), 0.0)
+
+
+def media_kind(attachment):
+    """
+    "image", "animation" (GIF) or "video", from the attachment's content type
+    or file extension; None for anything else.
+    """
+    content_type = (getattr(attachment, "content_type", None) or "").split(";")[0]
+    name = (
+        getattr(attachment, "filename", None) or attachment.url.split("?")[0]
+    ).lower()
+    if content_type == "image/gif" or name.endswith(".gif"):
+        return "animation"
+    if content_type.startswith("video/") or name.endswith(VIDEO_EXTENSIONS):
+        return "video"
+    if content_type.startswith("image/") or name.endswith(IMAGE_EXTENSIONS):
+        return "image"
+    return None
+
+
+def _animation_frames(path):
+    from PIL import Image, ImageSequence
+
+    with Image.open(path) as image:
+        time = 0.0
+        for frame in ImageSequence.Iterator(image):
+            yield time, frame
+            time += frame.info.get("duration", 100) / 1000
+
+
+def _video_frames(path):
+    try:
+        import av
+    except ImportError:
+        raise Exception("Video analysis requires PyAV (pip install av)")
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        for frame in container.decode(stream):
+            if frame.time is not None:
+                yield frame.time, frame
+
+
+def sample_frames(path, kind, frame_rate, max_frames):
+    """
+    Yields (seconds, RGB image) for one frame per 1 / `frame_rate` seconds of
+    a GIF or video file. Frames are decoded one at a time as the generator is
+    consumed, and only sampled frames are converted to RGB.
+    """
+    frames = _video_frames(path) if kind == "video" else _animation_frames(path)
+    next_time = 0.0
+    for time, frame in frames:
+        if time < next_time:
+            continue
+        yield time, frame.to_image() if kind == "video" else frame.convert("RGB")
+        max_frames -= 1
+        if max_frames <= 0:
+            return
+        next_time = time + 1 / frame_rate
+
+
+def _predict_frames(
+    path, kind, frame_rate, max_frames, batch_size, early_exit, cancel=None
+):
+    """
+    Classifies the sampled frames of a GIF or video in a worker process, a
+    batch at a time, and stops decoding after the batch in which a frame
+    reaches `early_exit`, or once the `cancel` event is set. Returns a list of
+    (seconds, deepfake probability) and whether it stopped early.
+    """
+    model, _ = load_model()
+    label = find_fake_label(model)
+    frames = sample_frames(path, kind, frame_rate, max_frames)
+    results = []
+    while True:
+        if cancel is not None and cancel.is_set():
+            frames.close()
+            return results, True
+        batch = list(itertools.islice(frames, batch_size))
+        if not batch:
+            return results, False
+        scores = classify_images([image for _, image in batch])
+        batch_results = [
+            (time, fake_probability(s, label)) for (time, _), s in zip(batch, scores)
+        ]
+        results += batch_results
+        if max(p for _, p in batch_results) >= early_exit:
+            frames.close()
+            return results, True
+
+
+def _fake_label():
+    model, _ = load_model()
+    return find_fake_label(model)
+
+
+def format_analysis(result):
+    """
+    Formats the result of DeepfakeService.analyze for moderators.
+    """
+    lines = []
+    for item in result["items"]:
+        if "error" in item:
+            lines.append(f"{item['filename']}: could not analyze ({item['error']})")
+        elif item.get("skipped"):
+            lines.append(f"{item['filename']}: skipped")
+        elif item.get("score") is None:
+            lines.append(f"{item['filename']}: no frames to analyze")
+        else:
+            lines.append(
+                f"{item['filename']} ({item['kind']}, {item['frames']} frame(s)): "
+                f"{item['score']:.0%} likely AI-generated"
+            )
+    if result["score"] is None:
+        lines.append("< NO IMAGE COULD BE ANALYZED >")
+    else:
+        verdict = (
+            "AI-generated (deepfake)"
+            if result["deepfake"]
+            else "not AI-generated (real)"
+        )
+        lines.append(
+            f"Overall: {verdict}, highest deepfake probability {result['score']:.0%}"
+            + (" (stopped early)" if result["early_exit"] else "")
+        )
+    return "\n".join(lines)
+
+
+def _init_worker(num_threads):
+    threads = DEEPFAKE_THREADS or num_threads
+    configure_threads(threads)
+    get_backend(threads)
+
+
+def _warm_up():
+    get_backend()
+    return os.getpid()
+
+
+def decode_image(data):
+    """
+    Decodes encoded image bytes into an RGB image, at model resolution when
+    the fast preprocessor is in use.
+    """
+    from PIL import Image
+
+    preprocessor = get_preprocessor()
+    if preprocessor is not None:
+        return preprocessor.open(data)
+    image = Image.open(BytesIO(data))
+    image.load()
+    return image.convert("RGB")
+
+
+def _predict_batch(images):
+    """
+    Runs one batched forward pass in a worker process. `images` is a list of
+    encoded image bytes; returns, per image, its list of label scores or
+    {"error": message} if it could not be decoded, so one corrupt upload
+    doesn't fail the rest of the batch.
+    """
+    results = [None] * len(images)
+    decoded = []
+    for i, data in enumerate(images):
+        try:
+            decoded.append((i, decode_image(data)))
+        except Exception as e:
+            results[i] = {"error": f"Could not decode image: {e}"}
+    if decoded:
+        scores = classify_images([image for _, image in decoded])
+        for (i, _), image_scores in zip(decoded, scores):
+            results[i] = image_scores
+    return results
+
+
+class DeepfakeService:
+    """
+    Pool of worker processes that each load the deepfake model once. Pending
+    images are grouped into batches of up to `max_batch`, waiting at most
+    `max_wait_ms` for a batch to fill, and `predict` can be awaited from the
+    event loop without blocking it. Verdicts are cached by content hash so
+    re-posted images skip inference; perceptual hashes only count how many
+    scored images were near-duplicates of earlier ones. `analyze` scores
+    every image, GIF and video attached to a message.
+    """
+
+    def __init__(
+        self,
+        workers=DEEPFAKE_WORKERS,
+        max_batch=DEEPFAKE_MAX_BATCH,
+        max_wait_ms=DEEPFAKE_MAX_WAIT_MS,
+        frame_rate=DEEPFAKE_FRAME_RATE,
+        max_frames=DEEPFAKE_MAX_FRAMES,
+    ):
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.frame_rate = frame_rate
+        self.max_frames = max_frames
+        self.executor = None
+        self.manager = None  # Serves the events that cancel frame analysis
+        self.verdicts = OrderedDict()  # Map from content hash to verdict, LRU
+        self.similar = PerceptualHashIndex()  # Hashes of scored images
+        self.verdict_hits = 0
+        self._fake_label = None
+        self._pending = []  # List of (image bytes, future)
+        self._flush_handle = None
+        self._tasks = set()
+
+    def start(self):
+        if self.executor is None:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(threads,),
+            )
+        return self.executor
+
+    async def warm_up(self):
+        """
+        Starts the worker processes and loads the model in each of them ahead of
+        the first real request.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self.start()
+        await asyncio.gather(
+            *(loop.run_in_executor(executor, _warm_up) for _ in range(self.workers))
+        )
+
+    @metrics.timed("predict_deepfake_service")
+    async def predict(self, url):
+        data = await attachment_fetcher.fetch(url)
+        key = content_hash(data)
+        if key in self.verdicts:
+            self.verdicts.move_to_end(key)
+            self.verdict_hits += 1
+            return self.verdicts[key]
+        verdict, image_hash = await asyncio.gather(
+            self.predict_bytes(data), asyncio.to_thread(dhash, data)
+        )
+        self.similar.get(image_hash)  # Counts near-duplicates in its stats
+        self.similar.put(image_hash, True)
+        self.verdicts[key] = verdict
+        while len(self.verdicts) > HASH_CACHE_SIZE:
+            self.verdicts.popitem(last=False)
+        return verdict
+
+    async def fake_label(self):
+        if self._fake_label is None:
+            loop = asyncio.get_running_loop()
+            self._fake_label = await loop.run_in_executor(self.start(), _fake_label)
+        return self._fake_label
+
+    @metrics.timed("deepfake_analyze")
+    async def analyze(self, attachments, early_exit=DEEPFAKE_EARLY_EXIT):
+        """
+        Scores all image, GIF and video attachments concurrently and returns
+        one verdict: {"score": highest deepfake probability, "deepfake",
+        "early_exit", "items": one result per attachment}. Once any item
+        reaches `early_exit`, the ones still running are cancelled, and GIFs
+        and videos being decoded stop after their current batch.
+        """
+        items = []
+        tasks = {}
+        for attachment in attachments:
+            item = {
+                "filename": getattr(attachment, "filename", None) or attachment.url,
+                "kind": media_kind(attachment),
+            }
+            items.append(item)
+            if item["kind"] is None:
+                item["error"] = "unsupported file type"
+                continue
+            task = asyncio.create_task(
+                self._analyze_item(attachment, item["kind"], early_exit)
+            )
+            tasks[task] = item
+
+        stopped = False
+        pending = set(tasks)
+        while pending and not stopped:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                item = tasks[task]
+                try:
+                    item.update(task.result())
+                except Exception as e:
+                    item["error"] = str(e)
+                    continue
+                if item["score"] is not None and item["score"] >= early_exit:
+                    stopped = True
+        for task in pending:
+            task.cancel()
+            tasks[task]["skipped"] = True
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        scores = [item["score"] for item in items if item.get("score") is not None]
+        score = max(scores) if scores else None
+        return {
+            "score": score,
+            "deepfake": score is not None and score >= 0.5,
+            "early_exit": stopped,
+            "items": items,
+        }
+
+    async def _analyze_item(self, attachment, kind, early_exit):
+        if kind == "image":
+            scores = await self.predict(attachment.url)
+            return {
+                "score": fake_probability(scores, await self.fake_label()),
+                "frames": 1,
+            }
+        # GIFs and videos are streamed to disk and decoded from there by the
+        # worker, so a long clip is never held in memory
+        loop = asyncio.get_running_loop()
+        fd, path = tempfile.mkstemp(prefix="deepfake_")
+        os.close(fd)
+        future = None
+        cancel = None
+        try:
+            await attachment_fetcher.fetch_to_file(
+                attachment.url,
+                path,
+                DEEPFAKE_VIDEO_MAX_BYTES if kind == "video" else None,
+            )
+            cancel = await self._cancel_event()
+            future = loop.run_in_executor(
+                self.start(),
+                _predict_frames,
+                path,
+                kind,
+                self.frame_rate,
+                self.max_frames,
+                self.max_batch,
+                early_exit,
+                cancel,
+            )
+            with metrics.span("deepfake_frames"):
+                # Shielded so that if this task is cancelled, `future` still
+                # tracks the worker, which stops at its next batch
+                frames, stopped = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if cancel is not None:
+                cancel.set()
+            raise
+        finally:
+            if future is None or future.done():
+                os.remove(path)
+            else:
+                # The worker may still be reading the file
+                future.add_done_callback(lambda f: _discard(f, path))
+        return {
+            "score": max(p for _, p in frames) if frames else None,
+            "frames": len(frames),
+            "early_exit": stopped,
+        }
+
+    async def _cancel_event(self):
+        if self.manager is None:
+            manager = SyncManager(ctx=multiprocessing.get_context("spawn"))
+            await asyncio.to_thread(manager.start)
+            if self.manager is None:
+                self.manager = manager
+            else:
+                manager.shutdown()  # Another item started one meanwhile
+        return await asyncio.to_thread(self.manager.Event)
+
+    async def predict_bytes(self, data):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((data, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            with metrics.span("deepfake_batch"):
+                results = await loop.run_in_executor(
+                    self.start(), _predict_batch, [data for data, _ in batch]
+                )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, dict):
+                future.set_exception(Exception(result["error"]))
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        if self.manager is not None:
+            self.manager.shutdown()
+            self.manager = None
+
+
+def _discard(future, path):
+    if not future.cancelled():
+        future.exception()  # Nobody is waiting for the result any more
+    os.remove(path)
+
+
+deepfake_service = DeepfakeService()
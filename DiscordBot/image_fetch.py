@@ -0,0 +1,103 @@
+import asyncio
+import os
+import aiohttp
+import requests
+
+# Attachment download limits
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(20 * 2**20)))
+ATTACHMENT_TIMEOUT = float(os.getenv("ATTACHMENT_TIMEOUT", "15"))
+ATTACHMENT_CONNECT_TIMEOUT = float(os.getenv("ATTACHMENT_CONNECT_TIMEOUT", "5"))
+ATTACHMENT_MAX_CONNECTIONS = int(os.getenv("ATTACHMENT_MAX_CONNECTIONS", "8"))
+CHUNK_SIZE = 64 * 2**10
+
+
+class AttachmentTooLarge(Exception):
+    def __init__(self, url, limit):
+        super().__init__(f"Attachment at {url} is larger than {limit} bytes")
+        self.url = url
+        self.limit = limit
+
+
+class AttachmentFetcher:
+    """
+    Downloads attachments over a pooled aiohttp session. Bodies are streamed
+    and the download is aborted as soon as it exceeds `max_bytes`; the whole
+    request is bounded by `timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        max_bytes=ATTACHMENT_MAX_BYTES,
+        timeout=ATTACHMENT_TIMEOUT,
+        connect_timeout=ATTACHMENT_CONNECT_TIMEOUT,
+        max_connections=ATTACHMENT_MAX_CONNECTIONS,
+    ):
+        self.max_bytes = max_bytes
+        self.timeout = aiohttp.ClientTimeout(
+            total=timeout, sock_connect=connect_timeout
+        )
+        self.max_connections = max_connections
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout
+            )
+        return self._session
+
+    async def fetch(self, url, max_bytes=None):
+        limit = max_bytes or self.max_bytes
+        async with self._get_session().get(url) as response:
+            response.raise_for_status()
+            if response.content_length and response.content_length > limit:
+                raise AttachmentTooLarge(url, limit)
+            data = bytearray()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                data += chunk
+                if len(data) > limit:
+                    raise AttachmentTooLarge(url, limit)
+        return bytes(data)
+
+    async def fetch_to_file(self, url, path, max_bytes=None):
+        """
+        Streams an attachment to `path` instead of memory, for large files
+        such as videos. Returns the number of bytes written.
+        """
+        limit = max_bytes or self.max_bytes
+        size = 0
+        async with self._get_session().get(url) as response:
+            response.raise_for_status()
+            if response.content_length and response.content_length > limit:
+                raise AttachmentTooLarge(url, limit)
+            with open(path, "wb") as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > limit:
+                        raise AttachmentTooLarge(url, limit)
+                    f.write(chunk)
+        return size
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+def fetch_sync(url, max_bytes=ATTACHMENT_MAX_BYTES, timeout=ATTACHMENT_TIMEOUT):
+    """
+    Blocking equivalent of AttachmentFetcher.fetch for scripts and workers.
+    """
+    with requests.get(
+        url, stream=True, timeout=(ATTACHMENT_CONNECT_TIMEOUT, timeout)
+    ) as response:
+        response.raise_for_status()
+        data = bytearray()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            data += chunk
+            if len(data) > max_bytes:
+                raise AttachmentTooLarge(url, max_bytes)
+    return bytes(data)
+
+
+attachment_fetcher = AttachmentFetcher()
@@ -0,0 +1,92 @@
+import hashlib
+import os
+from collections import OrderedDict
+from io import BytesIO
+
+# Images whose perceptual hashes differ in at most this many bits count as
+# near-duplicates in the metrics. A face swap can stay within a few bits of
+# the original photo, so verdicts are only reused for identical bytes.
+HASH_MAX_DISTANCE = int(os.getenv("DEEPFAKE_HASH_DISTANCE", "6"))
+HASH_CACHE_SIZE = int(os.getenv("DEEPFAKE_HASH_CACHE_SIZE", "50000"))
+
+# The 64-bit hash is split into 8 bands of 8 bits. Two hashes within 7 bits of
+# each other must agree exactly on at least one band, so band buckets find
+# every candidate for distances up to 7.
+NUM_BANDS = 8
+BAND_BITS = 64 // NUM_BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def dhash(data, size=8):
+    """
+    Difference hash of an encoded image: a 64-bit int that changes little under
+    re-encoding, resizing and small edits.
+    """
+    from PIL import Image
+
+    image = Image.open(BytesIO(data))
+    image.draft("L", (size * 8, size * 8))  # Cheap downscaled JPEG decode
+    pixels = list(image.convert("L").resize((size + 1, size)).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _bands(value):
+    return [(i, (value >> (i * BAND_BITS)) & BAND_MASK) for i in range(NUM_BANDS)]
+
+
+class PerceptualHashIndex:
+    """
+    LRU index from perceptual hashes to values. `get` returns the value of
+    the closest stored hash within `max_distance` bits.
+    """
+
+    def __init__(self, max_distance=HASH_MAX_DISTANCE, max_size=HASH_CACHE_SIZE):
+        self.max_distance = max_distance
+        self.max_size = max_size
+        self.entries = OrderedDict()  # Map from hash to value
+        self.buckets = {}  # Map from (band, band value) to set of hashes
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, value):
+        best = None
+        candidates = set()
+        for band in _bands(value):
+            candidates |= self.buckets.get(band, set())
+        for candidate in candidates:
+            distance = (candidate ^ value).bit_count()
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, candidate)
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(best[1])
+        return self.entries[best[1]]
+
+    def put(self, value, stored):
+        if value not in self.entries:
+            for band in _bands(value):
+                self.buckets.setdefault(band, set()).add(value)
+        self.entries[value] = stored
+        self.entries.move_to_end(value)
+        while len(self.entries) > self.max_size:
+            old, _ = self.entries.popitem(last=False)
+            for band in _bands(old):
+                bucket = self.buckets[band]
+                bucket.discard(old)
+                if not bucket:
+                    del self.buckets[band]
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
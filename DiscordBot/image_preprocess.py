@@ -0,0 +1,117 @@
+from io import BytesIO
+import numpy as np
+
+# Feature-extractor options the fast path doesn't implement. Feature extractors
+# using them, or resizing by shortest edge, keep using the feature extractor.
+UNSUPPORTED_FLAGS = ("do_center_crop", "do_pad")
+
+
+def _get(value, key):
+    if isinstance(value, dict):
+        return value.get(key)
+    return getattr(value, key, None)
+
+
+class FastPreprocessor:
+    """
+    Image preprocessing for fixed-size image classifiers, equivalent to a
+    feature extractor that resizes, rescales and normalizes. JPEGs are decoded
+    at a reduced size with PIL's draft mode (the smallest 1/2, 1/4 or 1/8
+    scale still at least the model resolution), every image is resized once
+    straight to the model resolution, and rescaling and normalization are one
+    multiply-add per pixel into a preallocated batch array.
+    """
+
+    def __init__(
+        self,
+        height=224,
+        width=224,
+        mean=(0.5, 0.5, 0.5),
+        std=(0.5, 0.5, 0.5),
+        rescale_factor=1 / 255,
+        resample=2,  # PIL.Image.BILINEAR
+        draft=True,
+        max_batch=8,
+    ):
+        self.height = height
+        self.width = width
+        self.resample = int(resample)
+        self.draft = draft
+        # (pixel * rescale - mean) / std as pixel * scale + offset
+        std = np.asarray(std, np.float32)
+        self.scale = (rescale_factor / std).reshape(3, 1, 1).astype(np.float32)
+        self.offset = (-np.asarray(mean, np.float32) / std).reshape(3, 1, 1)
+        self.buffer = np.empty((max_batch, 3, height, width), np.float32)
+        self.decoded = 0
+        self.drafted = 0
+
+    @classmethod
+    def from_feature_extractor(cls, feature_extractor, max_batch=8, draft=True):
+        """
+        A preprocessor matching `feature_extractor`, or None if it uses
+        options this class does not implement.
+        """
+        if any(getattr(feature_extractor, flag, None) for flag in UNSUPPORTED_FLAGS):
+            return None
+        if getattr(feature_extractor, "do_resize", True) is False:
+            return None
+        height = _get(feature_extractor.size, "height")
+        width = _get(feature_extractor.size, "width")
+        if not height or not width:
+            return None
+        normalize = getattr(feature_extractor, "do_normalize", True) is not False
+        rescale = getattr(feature_extractor, "do_rescale", True) is not False
+        return cls(
+            height=height,
+            width=width,
+            mean=feature_extractor.image_mean if normalize else (0.0, 0.0, 0.0),
+            std=feature_extractor.image_std if normalize else (1.0, 1.0, 1.0),
+            rescale_factor=feature_extractor.rescale_factor if rescale else 1.0,
+            resample=feature_extractor.resample,
+            draft=draft,
+            max_batch=max_batch,
+        )
+
+    def open(self, data):
+        """
+        Decodes encoded image bytes into an RGB image at model resolution.
+        """
+        from PIL import Image
+
+        image = Image.open(BytesIO(data))
+        self.decoded += 1
+        if self.draft and image.format == "JPEG":
+            before = image.size
+            image.draft("RGB", (self.width, self.height))
+            if image.size != before:
+                self.drafted += 1
+        return self.resize(image)
+
+    def resize(self, image):
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if image.size != (self.width, self.height):
+            image = image.resize((self.width, self.height), self.resample)
+        return image
+
+    def __call__(self, images):
+        """
+        Pixel values for a batch of PIL images or encoded image bytes, with
+        shape (batch, 3, height, width). The result is a view of a buffer that
+        the next call overwrites, so use it (or copy it) before then.
+        """
+        if len(images) > len(self.buffer):
+            self.buffer = np.empty((len(images),) + self.buffer.shape[1:], np.float32)
+        batch = self.buffer[: len(images)]
+        for i, image in enumerate(images):
+            if isinstance(image, (bytes, bytearray)):
+                image = self.open(image)
+            else:
+                image = self.resize(image)
+            pixels = np.asarray(image, np.uint8).transpose(2, 0, 1)
+            np.multiply(pixels, self.scale, out=batch[i])
+            batch[i] += self.offset
+        return batch
+
+    def stats(self):
+        return {"decoded": self.decoded, "drafted": self.drafted}
@@ -0,0 +1,141 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+# Records are handed to a queue on the event loop and formatted and written by
+# a background thread, to a JSON-lines file rotated at LOG_MAX_BYTES.
+LOG_PATH = os.getenv("LOG_PATH", "discord.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+DISCORD_LOG_LEVEL = os.getenv("DISCORD_LOG_LEVEL", "INFO")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+# Fraction of records kept per logger (and its children), below WARNING, e.g.
+# "discord.gateway=0.01,report=0.1"
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "discord.gateway=0.1")
+
+# Attributes every LogRecord has; anything else was passed with `extra=`
+RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread. The stock
+    `prepare` formats every record on the calling thread and drops its
+    exception; this one only resolves the message, since its arguments may
+    change after the call, and renders any traceback into `exc_text`.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fixed fraction of records below WARNING from each configured
+    logger. The most specific configured logger name wins.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.cache = {}  # Map from logger name to its rate
+
+    def rate(self, name):
+        if name not in self.cache:
+            rate = 1.0
+            parts = name.split(".")
+            for i in range(len(parts), 0, -1):
+                prefix = ".".join(parts[:i])
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+            self.cache[name] = rate
+        return self.cache[name]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+def parse_rates(spec):
+    rates = {}
+    for part in spec.split(","):
+        if "=" in part:
+            name, rate = part.split("=", 1)
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+_listener = None
+
+
+def setup_logging(
+    path=LOG_PATH,
+    level=LOG_LEVEL,
+    discord_level=DISCORD_LOG_LEVEL,
+    sample=LOG_SAMPLE,
+):
+    """
+    Routes all logging through a queue to a background thread that formats
+    records as JSON lines and writes them to a rotating file. Sampling runs
+    before a record is queued, so dropped records cost no formatting or I/O.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    records = queue.SimpleQueue()
+    handler = RecordQueueHandler(records)
+    handler.addFilter(SamplingFilter(parse_rates(sample)))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+    logging.getLogger("discord").setLevel(discord_level)
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"
+    )
+    file_handler.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(records, file_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+    Writes out queued records and stops the background thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,144 @@
+import copy
+import itertools
+import threading
+
+
+def _matches(document, query):
+    return all(document.get(key) == value for key, value in query.items())
+
+
+class InsertManyResult:
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+
+
+class UpdateResult:
+    def __init__(self, matched_count, upserted_id=None):
+        self.matched_count = matched_count
+        self.upserted_id = upserted_id
+
+
+class MemoryCollection:
+    """
+    In-memory stand-in for the subset of pymongo's Collection API the bot uses,
+    for tests and benchmarks without a mongod. Queries are plain equality
+    filters. Thread-safe, since the bot calls it from worker threads.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self.documents = []
+        self.indexes = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _insert(self, document):
+        document = copy.deepcopy(document)
+        document.setdefault("_id", next(self._ids))
+        self.documents.append(document)
+        return document["_id"]
+
+    def insert_one(self, document):
+        with self.lock:
+            return InsertManyResult([self._insert(document)])
+
+    def insert_many(self, documents, ordered=True):
+        with self.lock:
+            return InsertManyResult([self._insert(d) for d in documents])
+
+    def count_documents(self, query):
+        with self.lock:
+            return sum(1 for d in self.documents if _matches(d, query))
+
+    def find(self, query=None):
+        with self.lock:
+            return [
+                copy.deepcopy(d) for d in self.documents if _matches(d, query or {})
+            ]
+
+    def find_one(self, query=None):
+        found = self.find(query)
+        return found[0] if found else None
+
+    def update_one(self, query, update, upsert=False):
+        with self.lock:
+            return self._update_one(query, update, upsert)
+
+    def _update_one(self, query, update, upsert):
+        document = next((d for d in self.documents if _matches(d, query)), None)
+        upserted_id = None
+        if document is None:
+            if not upsert:
+                return UpdateResult(0)
+            document = dict(query)
+            upserted_id = self._insert(document)
+            document = self.documents[-1]
+        for operator, fields in update.items():
+            for key, value in fields.items():
+                if operator == "$inc":
+                    document[key] = document.get(key, 0) + value
+                elif operator == "$set":
+                    document[key] = value
+                elif operator == "$addToSet":
+                    values = document.setdefault(key, [])
+                    for item in value["$each"] if "$each" in value else [value]:
+                        if item not in values:
+                            values.append(item)
+                else:
+                    raise NotImplementedError(f"Unsupported update operator {operator}")
+        return UpdateResult(0 if upserted_id else 1, upserted_id)
+
+    def bulk_write(self, requests, ordered=True):
+        # Only UpdateOne requests are supported
+        with self.lock:
+            for request in requests:
+                self._update_one(request._filter, request._doc, request._upsert)
+
+    def aggregate(self, pipeline):
+        # Only a single {"$group": {"_id": "$field", name: accumulator}} stage,
+        # with {"$sum": 1} or {"$push": "$field"} as the accumulator
+        (stage,) = pipeline
+        group = stage["$group"]
+        field = group["_id"].lstrip("$")
+        (name,) = [k for k in group if k != "_id"]
+        ((operator, argument),) = group[name].items()
+        groups = {}
+        for document in self.find():
+            values = groups.setdefault(document.get(field), [])
+            values.append(
+                document.get(argument.lstrip("$")) if operator == "$push" else 1
+            )
+        if operator == "$sum":
+            return [{"_id": key, name: len(values)} for key, values in groups.items()]
+        return [{"_id": key, name: values} for key, values in groups.items()]
+
+    def create_index(self, keys, **kwargs):
+        name = kwargs.get("name") or "_".join(
+            f"{key}_{direction}" for key, direction in keys
+        )
+        self.indexes[name] = {"key": keys, **kwargs}
+        return name
+
+
+class MemoryDatabase:
+    def __init__(self, name=None):
+        self.name = name
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(name)
+        return self.collections[name]
+
+
+class MemoryClient:
+    def __init__(self, *args, **kwargs):
+        self.databases = {}
+
+    def __getitem__(self, name):
+        if name not in self.databases:
+            self.databases[name] = MemoryDatabase(name)
+        return self.databases[name]
+
+    def close(self):
+        pass
@@ -0,0 +1,222 @@
+import asyncio
+import bisect
+import functools
+import json
+import os
+import random
+import time
+from collections import deque
+
+# METRICS_PORT=0 disables the HTTP endpoint. A METRICS_TRACE_SAMPLE fraction
+# of spans is also kept, most recent first, for `/trace` and dump_trace().
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_TRACE_SAMPLE = float(os.getenv("METRICS_TRACE_SAMPLE", "0.01"))
+METRICS_TRACE_SIZE = int(os.getenv("METRICS_TRACE_SIZE", "1000"))
+
+# Histogram bucket upper bounds in seconds, 0.5 ms to 60 s
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram. Recording is a bisect and two additions,
+    and quantiles are interpolated within the bucket they fall in.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else lower
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Span:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(
+            self.name, time.perf_counter() - self.start, exc_type is not None
+        )
+        return False
+
+
+class Metrics:
+    """
+    Registry of named latency histograms. Time a stage with
+    `with metrics.span("name"):` or the `@metrics.timed("name")` decorator;
+    gauges are callables read when the metrics are scraped.
+    """
+
+    def __init__(
+        self, trace_sample=METRICS_TRACE_SAMPLE, trace_size=METRICS_TRACE_SIZE
+    ):
+        self.histograms = {}
+        self.gauges = {}
+        self.trace_sample = trace_sample
+        self.trace = deque(maxlen=trace_size)  # Sampled (name, start, seconds, error)
+        self.server = None
+
+    def span(self, name):
+        return Span(self, name)
+
+    def timed(self, name):
+        def decorate(func):
+            if asyncio.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return await func(*args, **kwargs)
+
+            else:
+
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorate
+
+    def observe(self, name, seconds, error=False):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds, error)
+        if self.trace_sample and random.random() < self.trace_sample:
+            self.trace.append((name, time.time() - seconds, seconds, error))
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def summary(self):
+        return {name: h.summary() for name, h in sorted(self.histograms.items())}
+
+    def render(self):
+        """
+        All histograms and gauges in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP modbot_stage_seconds Latency of each moderation pipeline stage.",
+            "# TYPE modbot_stage_seconds histogram",
+        ]
+        for name, h in sorted(self.histograms.items()):
+            cumulative = 0
+            bounds = [str(b) for b in h.buckets] + ["+Inf"]
+            for bound, n in zip(bounds, h.counts):
+                cumulative += n
+                lines.append(
+                    f'modbot_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}'
+                )
+            lines.append(f'modbot_stage_seconds_sum{{stage="{name}"}} {h.sum}')
+            lines.append(f'modbot_stage_seconds_count{{stage="{name}"}} {h.count}')
+        lines += [
+            "# HELP modbot_stage_errors_total Calls of each stage that raised.",
+            "# TYPE modbot_stage_errors_total counter",
+        ]
+        for name, h in sorted(self.histograms.items()):
+            lines.append(f'modbot_stage_errors_total{{stage="{name}"}} {h.errors}')
+        for name, read in sorted(self.gauges.items()):
+            try:
+                value = read()
+            except Exception:
+                continue
+            lines.append(f"# TYPE modbot_{name} gauge")
+            lines.append(f"modbot_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def recent_trace(self):
+        return [
+            {"stage": name, "start": start, "seconds": seconds, "error": error}
+            for name, start, seconds, error in reversed(self.trace)
+        ]
+
+    def dump_trace(self, path):
+        with open(path, "w") as f:
+            for span in self.recent_trace():
+                f.write(json.dumps(span) + "\n")
+
+    async def start_server(self, host=METRICS_HOST, port=METRICS_PORT):
+        """
+        Serves `/metrics` (Prometheus text) and `/trace` (sampled spans as JSON).
+        """
+        if not port or self.server is not None:
+            return
+        from aiohttp import web
+
+        async def handle_metrics(request):
+            return web.Response(text=self.render(), content_type="text/plain")
+
+        async def handle_trace(request):
+            return web.json_response(self.recent_trace())
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        app.router.add_get("/trace", handle_trace)
+        self.server = web.AppRunner(app)
+        await self.server.setup()
+        await web.TCPSite(self.server, host, port).start()
+
+    async def close(self):
+        if self.server is not None:
+            await self.server.cleanup()
+            self.server = None
+
+
+metrics = Metrics()
@@ -0,0 +1,166 @@
+import itertools
+import os
+import time
+import zlib
+from collections import OrderedDict
+import numpy as np
+from score_cache import normalize_text
+
+# Messages whose estimated Jaccard similarity (over character 3-grams) is at
+# least NEAR_DUP_THRESHOLD belong to one cluster and share one alert. Clusters
+# not seen for NEAR_DUP_TTL seconds expire.
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.7"))
+NEAR_DUP_TTL = float(os.getenv("NEAR_DUP_TTL", "600"))
+NEAR_DUP_MAX_SIZE = int(os.getenv("NEAR_DUP_MAX_SIZE", "50000"))
+# Shorter messages are too generic to cluster; the exact score cache covers them
+NEAR_DUP_MIN_CHARS = int(os.getenv("NEAR_DUP_MIN_CHARS", "20"))
+
+# 64 MinHash values split into 16 LSH bands of 4. A pair with similarity s
+# shares a band with probability 1 - (1 - s^4)^16: over 0.99 at s = 0.7 and
+# about 0.03 at s = 0.2.
+NUM_PERMUTATIONS = 64
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // NUM_BANDS
+SHINGLE_SIZE = 3
+
+# Multiply-shift hash functions: h(x) = (a * x + b) mod 2^64, top 32 bits
+_random = np.random.default_rng(152)
+_A = _random.integers(1, 2**63, NUM_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_B = _random.integers(0, 2**63, NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def minhash(text):
+    """
+    MinHash signature of the normalized text's character 3-grams, as an array
+    of NUM_PERMUTATIONS uint32 values.
+    """
+    text = normalize_text(text)
+    shingles = {text[i : i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    if not shingles:
+        shingles = {text}
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles), np.uint64, len(shingles)
+    )
+    permuted = (hashes[:, None] * _A + _B) >> np.uint64(32)
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def _bands(signature):
+    return [
+        (i, signature[i * ROWS_PER_BAND : (i + 1) * ROWS_PER_BAND].tobytes())
+        for i in range(NUM_BANDS)
+    ]
+
+
+def similarity(a, b):
+    """
+    Estimated Jaccard similarity of two signatures.
+    """
+    return float(np.count_nonzero(a == b)) / NUM_PERMUTATIONS
+
+
+class Cluster:
+    """
+    A group of near-identical messages that share one mod-channel alert.
+    Scores are only shared between exact copies: a few added words can turn
+    a harmless message into a threat, so every variant is scored itself.
+    """
+
+    def __init__(self, now):
+        # Map from normalized text to the future of its scores, only while it is
+        # being scored, so a cluster of many variants doesn't hold every one
+        self.verdicts = {}
+        self.first_seen = now
+        self.count = 1
+        self.authors = set()
+        self.alert = None  # Future of the alert posted for this cluster, if any
+        self.flagged = 0  # Copies counted on that alert
+        self.alert_text = None  # Content of that alert before any edits
+
+
+class NearDuplicateIndex:
+    """
+    Streaming near-duplicate detector. Each message's MinHash signature is
+    looked up through LSH band buckets; a candidate at or above `threshold`
+    similarity to a cluster's first message returns that cluster, otherwise
+    the caller starts a new cluster with `add`. Only first messages are
+    indexed, so a cluster can't drift away from its original text through a
+    chain of variants. Signatures expire
+    `ttl` seconds after their last match and the index holds at most
+    `max_size` of them.
+    """
+
+    def __init__(
+        self,
+        threshold=NEAR_DUP_THRESHOLD,
+        ttl=NEAR_DUP_TTL,
+        max_size=NEAR_DUP_MAX_SIZE,
+        min_chars=NEAR_DUP_MIN_CHARS,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.min_chars = min_chars
+        # Map from entry ID to (signature, cluster, last seen), oldest first
+        self.entries = OrderedDict()
+        self.buckets = {}  # Map from (band, band bytes) to set of entry IDs
+        self.ids = itertools.count()
+        self.hits = 0
+        self.misses = 0
+
+    def eligible(self, text):
+        return len(text) >= self.min_chars
+
+    def match(self, signature, now=None):
+        """
+        The live cluster most similar to `signature`, if any is at or above
+        the threshold. A match counts as another member of the cluster.
+        """
+        now = time.time() if now is None else now
+        self.expire(now)
+        candidates = set()
+        for band in _bands(signature):
+            candidates |= self.buckets.get(band, set())
+        best = None
+        for entry_id in candidates:
+            score = similarity(signature, self.entries[entry_id][0])
+            if score >= self.threshold and (best is None or score > best[0]):
+                best = (score, entry_id)
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        stored, cluster, _ = self.entries.pop(best[1])
+        self.entries[best[1]] = (stored, cluster, now)  # Now the most recent
+        cluster.count += 1
+        return cluster
+
+    def add(self, signature, now=None):
+        now = time.time() if now is None else now
+        cluster = Cluster(now)
+        self._put(signature, cluster, now)
+        return cluster
+
+    def _put(self, signature, cluster, now):
+        entry_id = next(self.ids)
+        for band in _bands(signature):
+            self.buckets.setdefault(band, set()).add(entry_id)
+        self.entries[entry_id] = (signature, cluster, now)
+        while len(self.entries) > self.max_size:
+            self._remove_oldest()
+
+    def _remove_oldest(self):
+        entry_id, (signature, _, _) = self.entries.popitem(last=False)
+        for band in _bands(signature):
+            bucket = self.buckets[band]
+            bucket.discard(entry_id)
+            if not bucket:
+                del self.buckets[band]
+
+    def expire(self, now=None):
+        cutoff = (time.time() if now is None else now) - self.ttl
+        while self.entries and next(iter(self.entries.values()))[2] < cutoff:
+            self._remove_oldest()
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
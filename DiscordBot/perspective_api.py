@@ -1,38 +1,302 @@
-from googleapiclient import discovery
+import asyncio
 import json
 import os
+import time
+from collections import Counter
+import aiohttp
 from dotenv import load_dotenv
+from score_cache import ScoreCache
+from prefilter import (
+    PREFILTER_ENABLED,
+    BENIGN,
+    benign_scores,
+    degraded_scores,
+    load_prefilter,
+)
+from rate_limiter import Priority, PriorityScheduler
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from metrics import metrics
 
 # Load environment variables from the .env file
 load_dotenv()
 API_KEY = os.getenv("API_KEY")
+PERSPECTIVE_URL = os.getenv(
+    "PERSPECTIVE_URL",
+    "https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze",
+)
 
+# Micro-batching settings: requests that arrive within BATCH_WINDOW_MS of each
+# other are dispatched together (up to MAX_BATCH) over the pooled connections.
+BATCH_WINDOW_MS = float(os.getenv("PERSPECTIVE_BATCH_WINDOW_MS", "20"))
+MAX_BATCH = int(os.getenv("PERSPECTIVE_MAX_BATCH", "16"))
+MAX_CONNECTIONS = int(os.getenv("PERSPECTIVE_MAX_CONNECTIONS", "8"))
 
-def analyze_message(message):
-    client = discovery.build(
-        "commentanalyzer",
-        "v1alpha1",
-        developerKey=API_KEY,
-        discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
-        static_discovery=False,
-    )
+# Outbound quota. Requests beyond PERSPECTIVE_QPS are queued by priority.
+PERSPECTIVE_QPS = float(os.getenv("PERSPECTIVE_QPS", "1"))
+PERSPECTIVE_BURST = float(os.getenv("PERSPECTIVE_BURST", str(PERSPECTIVE_QPS)))
 
-    analyze_request = {
+# Deadlines. Each HTTP attempt is abandoned after PERSPECTIVE_TIMEOUT seconds;
+# with PERSPECTIVE_HEDGE_MS > 0, a second attempt is sent if the first hasn't
+# answered by then and a rate-limit token is free. Callers can also give
+# eval_text a budget for the whole call, including time spent queued.
+PERSPECTIVE_TIMEOUT = float(os.getenv("PERSPECTIVE_TIMEOUT", "2"))
+PERSPECTIVE_HEDGE_MS = float(os.getenv("PERSPECTIVE_HEDGE_MS", "0"))
+
+# Circuit breaker: after PERSPECTIVE_BREAKER_FAILURES consecutive failed calls
+# (or calls slower than PERSPECTIVE_BREAKER_SLOW_MS), calls fail fast for
+# PERSPECTIVE_BREAKER_RESET seconds before a probe is let through.
+BREAKER_FAILURES = int(os.getenv("PERSPECTIVE_BREAKER_FAILURES", "5"))
+BREAKER_SLOW_MS = float(os.getenv("PERSPECTIVE_BREAKER_SLOW_MS", "1500"))
+BREAKER_RESET = float(os.getenv("PERSPECTIVE_BREAKER_RESET", "30"))
+
+# Score cache settings. SCORE_CACHE_PATH enables the on-disk tier, which holds
+# at most SCORE_CACHE_MAX_ROWS entries.
+SCORE_CACHE_SIZE = int(os.getenv("SCORE_CACHE_SIZE", "10000"))
+SCORE_CACHE_TTL = float(os.getenv("SCORE_CACHE_TTL", "3600"))
+SCORE_CACHE_PATH = os.getenv("SCORE_CACHE_PATH")
+SCORE_CACHE_MAX_ROWS = int(os.getenv("SCORE_CACHE_MAX_ROWS", "100000"))
+
+
+class PerspectiveError(Exception):
+    def __init__(self, status, body):
+        super().__init__(f"Perspective API returned {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+def build_request(message):
+    return {
         "comment": {"text": message},
         "requestedAttributes": {"TOXICITY": {}, "SEXUALLY_EXPLICIT": {}, "THREAT": {}},
         "languages": ["en"],
     }
 
-    response = client.comments().analyze(body=analyze_request).execute()
+
+class PerspectiveClient:
+    """
+    Async Perspective API client. The HTTP session (and its connection pool) is
+    created once and reused; concurrent calls are grouped into small
+    time-windowed batches, and identical texts within a batch share one request.
+    Responses are stored in `cache` as they arrive, so a request whose callers
+    all gave up on their budget still answers the next lookup of its text.
+    """
+
+    def __init__(
+        self,
+        api_key=API_KEY,
+        url=PERSPECTIVE_URL,
+        batch_window_ms=BATCH_WINDOW_MS,
+        max_batch=MAX_BATCH,
+        max_connections=MAX_CONNECTIONS,
+        qps=PERSPECTIVE_QPS,
+        burst=PERSPECTIVE_BURST,
+        timeout=PERSPECTIVE_TIMEOUT,
+        hedge_ms=PERSPECTIVE_HEDGE_MS,
+        cache=None,
+    ):
+        self.api_key = api_key
+        self.cache = cache
+        self.url = url
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self.max_connections = max_connections
+        self.limiter = PriorityScheduler(qps, burst)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.hedge_delay = hedge_ms / 1000
+        self.breaker = CircuitBreaker(
+            "Perspective",
+            failures=BREAKER_FAILURES,
+            slow=BREAKER_SLOW_MS / 1000,
+            reset_timeout=BREAKER_RESET,
+        )
+        self.hedged = 0
+        self._session = None
+        # Map from text to [future waiting on its score, highest caller priority]
+        self._pending = {}
+        self._flush_handle = None
+        self._tasks = set()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections, keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def analyze(self, message, priority=Priority.CHANNEL, budget=None):
+        """
+        Perspective's response for `message`. Raises asyncio.TimeoutError if
+        it takes longer than `budget` seconds, though the request itself
+        carries on for any other callers waiting on the same text.
+        """
+        # Fail fast instead of queueing behind a dependency that is down
+        if not self.breaker.available():
+            self.breaker.before_call()
+        loop = asyncio.get_running_loop()
+        entry = self._pending.get(message)
+        if entry is None:
+            entry = [loop.create_future(), priority]
+            self._pending[message] = entry
+            if priority == Priority.REVIEW or len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        else:
+            entry[1] = min(entry[1], priority)
+        # Shield so one cancelled caller doesn't cancel a shared request
+        return await asyncio.wait_for(asyncio.shield(entry[0]), budget)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._dispatch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch):
+        texts = list(batch)
+        results = await asyncio.gather(
+            *(self._post(text, batch[text][1]) for text in texts),
+            return_exceptions=True,
+        )
+        for text, result in zip(texts, results):
+            future = batch[text][0]
+            if isinstance(result, BaseException):
+                if not future.done():
+                    future.set_exception(result)
+                continue
+            # Cached even if every caller has timed out, so the quota isn't wasted
+            if self.cache is not None:
+                self.cache.put(text, result)
+            if not future.done():
+                future.set_result(result)
+
+    async def _post(self, message, priority):
+        self.breaker.before_call()
+        try:
+            with metrics.span("perspective_rate_limit"):
+                await self.limiter.acquire(priority)
+            start = time.monotonic()
+            result = await self._hedged(message)
+        except PerspectiveError as e:
+            # Rejected requests say nothing about the service's health
+            self.breaker.record(e.status < 500 and e.status != 429)
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.breaker.record(False)
+            raise
+        except BaseException:
+            self.breaker.abandon()  # Shed or cancelled before a request was made
+            raise
+        self.breaker.record(True, time.monotonic() - start)
+        return result
+
+    async def _hedged(self, message):
+        first = asyncio.ensure_future(self._request(message))
+        if not self.hedge_delay:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay)
+        # Hedges only use spare quota; they never queue behind real requests
+        if done or not self.limiter.bucket.try_take():
+            return await first
+        self.hedged += 1
+        pending = {first, asyncio.ensure_future(self._request(message))}
+        try:
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                if not pending:
+                    return task.result()  # Both failed: raise the last error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _request(self, message):
+        session = self._get_session()
+        with metrics.span("perspective_request"):
+            async with session.post(
+                self.url,
+                params={"key": self.api_key},
+                json=build_request(message),
+                timeout=self.timeout,
+            ) as response:
+                if response.status != 200:
+                    raise PerspectiveError(response.status, await response.text())
+                return await response.json()
+
+    def stats(self):
+        return {
+            "breaker": self.breaker.stats(),
+            "hedged": self.hedged,
+            "fallbacks": dict(fallbacks),
+        }
+
+    async def close(self):
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+score_cache = ScoreCache(
+    SCORE_CACHE_SIZE, SCORE_CACHE_TTL, SCORE_CACHE_PATH, max_rows=SCORE_CACHE_MAX_ROWS
+)
+perspective_client = PerspectiveClient(cache=score_cache)
+fallbacks = Counter()  # Map from failure type to calls answered in degraded mode
+prefilter = load_prefilter()
+
+
+async def analyze_message(message, priority=Priority.CHANNEL, budget=None):
+    response = await perspective_client.analyze(message, priority, budget)
     # print(json.dumps(response, indent=2))
     return response
 
 
-def eval_text(message):
+@metrics.timed("eval_text")
+async def eval_text(
+    message,
+    use_prefilter=False,
+    priority=Priority.CHANNEL,
+    budget=None,
+    degrade=False,
+):
     """'
     Use Google Perspective API to scan for toxicity and sexually explicit content.
+    Results are cached by normalized text, so repeated messages are scored once.
+    With `use_prefilter`, messages the local pre-filter clears as benign are
+    given zero scores without a network call. `priority` decides the order in
+    which queued calls are sent once the API quota is reached. The call gives
+    up after `budget` seconds; with `degrade`, a timeout, an open circuit or
+    an API error returns local heuristic scores (marked "degraded") instead
+    of raising.
     """
-    message_score = analyze_message(message)
+    message_score = score_cache.get(message)
+    if message_score is None:
+        if use_prefilter and PREFILTER_ENABLED:
+            if prefilter.classify(message) == BENIGN:
+                return benign_scores()
+        try:
+            message_score = await analyze_message(message, priority, budget)
+        except (
+            asyncio.TimeoutError,
+            CircuitOpenError,
+            PerspectiveError,
+            aiohttp.ClientError,
+        ) as e:
+            if not degrade:
+                raise
+            fallbacks[type(e).__name__] += 1
+            return degraded_scores(message, prefilter.model)
     return message_score
 
 
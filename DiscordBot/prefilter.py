@@ -0,0 +1,318 @@
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import zlib
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# Cascade thresholds. Messages the linear model scores at or below
+# PREFILTER_LOW are cleared locally, at or above PREFILTER_HIGH are treated as
+# suspicious; anything in between (or with no model loaded) is uncertain.
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "1") == "1"
+PREFILTER_LOW = float(os.getenv("PREFILTER_LOW", "0.05"))
+PREFILTER_HIGH = float(os.getenv("PREFILTER_HIGH", "0.5"))
+PREFILTER_MODEL_PATH = os.getenv("PREFILTER_MODEL_PATH")
+
+NUM_BUCKETS = 1 << 18
+
+BENIGN = "benign"
+UNCERTAIN = "uncertain"
+SUSPICIOUS = "suspicious"
+
+# Words and fragments that always send a message on to Perspective
+KEYWORDS = [
+    "kill",
+    "murder",
+    "shoot",
+    "stab",
+    "bomb",
+    "die",
+    "dead",
+    "hurt",
+    "kidnap",
+    "ransom",
+    "hostage",
+    "abduct",
+    "wire the money",
+    "gift card",
+    "bitcoin",
+    "police",
+    "nude",
+    "nudes",
+    "naked",
+    "sex",
+    "porn",
+    "rape",
+    "hate",
+    "suicide",
+    "kys",
+    "fuck",
+    "shit",
+    "bitch",
+    "slut",
+    "whore",
+]
+KEYWORD_PATTERN = re.compile(
+    r"\b(?:" + "|".join(re.escape(k) for k in KEYWORDS) + r")\w*", re.IGNORECASE
+)
+# Messages made only of these words ("ok", "lol thanks") are cleared. Short
+# messages in general are not: one-word insults and slurs still get scored.
+BENIGN_WORDS = frozenset("""
+    ok okay k kk lol lmao lmfao haha hahaha hehe xd thanks thank thx ty yes
+    yeah yep yup no nope nah hi hey hello bye gn gm gg nice cool np brb omg
+    wow sure true same
+    """.split())
+# Links and mentions are never cleared locally
+LINK_PATTERN = re.compile(r"https?://|www\.|<@!?\d+>", re.IGNORECASE)
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+# Custom Discord emoji, unicode emoji/symbols, punctuation and whitespace
+NON_TEXT_PATTERN = re.compile(r"(?:<a?:\w+:\d+>|\W)+")
+
+
+def hashed_features(text):
+    """
+    Maps a message to hashed word unigram/bigram and character trigram buckets.
+    """
+    text = text.lower()
+    words = WORD_PATTERN.findall(text)
+    grams = ["w:" + w for w in words]
+    grams += ["b:" + a + " " + b for a, b in zip(words, words[1:])]
+    padded = " " + " ".join(words) + " "
+    grams += ["c:" + padded[i : i + 3] for i in range(len(padded) - 2)]
+    features = {}
+    for gram in grams:
+        bucket = zlib.crc32(gram.encode("utf-8")) % NUM_BUCKETS
+        features[bucket] = features.get(bucket, 0) + 1
+    return features
+
+
+class LinearModel:
+    """
+    Logistic regression over hashed n-gram features, stored sparsely.
+    """
+
+    def __init__(self, weights=None, bias=0.0):
+        self.weights = weights or {}
+        self.bias = bias
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        weights = {int(k): v for k, v in data["weights"].items()}
+        return cls(weights, data["bias"])
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"weights": self.weights, "bias": self.bias}, f)
+
+    def predict(self, text):
+        z = self.bias
+        for bucket, count in hashed_features(text).items():
+            z += self.weights.get(bucket, 0.0) * count
+        return 1 / (1 + math.exp(-max(min(z, 30), -30)))
+
+    def train(self, examples, epochs=5, learning_rate=0.1, l2=1e-5):
+        for _ in range(epochs):
+            for text, label in examples:
+                features = hashed_features(text)
+                error = self.predict(text) - label
+                self.bias -= learning_rate * error
+                for bucket, count in features.items():
+                    w = self.weights.get(bucket, 0.0)
+                    self.weights[bucket] = w - learning_rate * (error * count + l2 * w)
+        return self
+
+
+class PreFilter:
+    """
+    Local first stage in front of Perspective. `classify` returns BENIGN for
+    messages that can be cleared without a network call, SUSPICIOUS for ones
+    that match known-bad patterns, and UNCERTAIN otherwise.
+    """
+
+    def __init__(
+        self,
+        model=None,
+        low=PREFILTER_LOW,
+        high=PREFILTER_HIGH,
+        benign_words=BENIGN_WORDS,
+    ):
+        self.model = model
+        self.low = low
+        self.high = high
+        self.benign_words = benign_words
+        self.checked = 0
+        self.cleared = 0
+
+    def classify(self, text):
+        self.checked += 1
+        decision = self._classify(text)
+        if decision == BENIGN:
+            self.cleared += 1
+        return decision
+
+    def _classify(self, text):
+        if KEYWORD_PATTERN.search(text) or LINK_PATTERN.search(text):
+            return SUSPICIOUS
+        if not NON_TEXT_PATTERN.sub("", text):
+            # Emoji-only or punctuation-only messages
+            return BENIGN
+        words = WORD_PATTERN.findall(text.lower())
+        if words and all(word in self.benign_words for word in words):
+            return BENIGN
+        if self.model is None:
+            return UNCERTAIN
+        p = self.model.predict(text)
+        if p <= self.low:
+            return BENIGN
+        if p >= self.high:
+            return SUSPICIOUS
+        return UNCERTAIN
+
+    def stats(self):
+        return {
+            "checked": self.checked,
+            "cleared": self.cleared,
+            "forwarded": self.checked - self.cleared,
+            "saved_ratio": self.cleared / self.checked if self.checked else 0.0,
+        }
+
+
+def benign_scores():
+    """
+    Perspective-shaped response for messages cleared by the pre-filter, so
+    score_format works unchanged.
+    """
+    return {
+        "attributeScores": {
+            attribute: {"summaryScore": {"value": 0.0, "type": "PROBABILITY"}}
+            for attribute in ("TOXICITY", "SEXUALLY_EXPLICIT", "THREAT")
+        },
+        "prefiltered": True,
+    }
+
+
+# Keyword groups used to estimate scores while Perspective is unavailable
+DEGRADED_PATTERNS = {
+    "THREAT": re.compile(
+        r"\b(?:kill|murder|shoot|stab|bomb|hurt|kidnap|ransom|hostage|abduct)\w*",
+        re.IGNORECASE,
+    ),
+    "SEXUALLY_EXPLICIT": re.compile(
+        r"\b(?:nudes?|naked|sex|porn|rape)\w*", re.IGNORECASE
+    ),
+    "TOXICITY": re.compile(
+        r"\b(?:hate|kys|fuck|shit|bitch|slut|whore)\w*", re.IGNORECASE
+    ),
+}
+DEGRADED_KEYWORD_SCORE = float(os.getenv("DEGRADED_KEYWORD_SCORE", "0.7"))
+
+
+def degraded_scores(text, model=None):
+    """
+    Perspective-shaped estimate used while Perspective can't be reached:
+    DEGRADED_KEYWORD_SCORE for attributes whose keywords appear in the text,
+    and the linear model's probability (if one is loaded) for toxicity.
+    Marked "degraded" so callers can re-score the message later.
+    """
+    scores = {
+        attribute: DEGRADED_KEYWORD_SCORE if pattern.search(text) else 0.0
+        for attribute, pattern in DEGRADED_PATTERNS.items()
+    }
+    if model is not None:
+        scores["TOXICITY"] = max(scores["TOXICITY"], model.predict(text))
+    return {
+        "attributeScores": {
+            attribute: {"summaryScore": {"value": value, "type": "PROBABILITY"}}
+            for attribute, value in scores.items()
+        },
+        "degraded": True,
+    }
+
+
+def load_prefilter():
+    model = None
+    if PREFILTER_MODEL_PATH and os.path.isfile(PREFILTER_MODEL_PATH):
+        model = LinearModel.load(PREFILTER_MODEL_PATH)
+    return PreFilter(model)
+
+
+def read_labeled(path):
+    """
+    Reads a JSONL replay set. Each line has `text` and a 0/1 `label`, and
+    optionally the recorded Perspective `scores` (the score_format output).
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(prefilter, examples, flag_threshold=0.6):
+    """
+    Runs a labeled set through the cascade. Recall is reported both for the
+    pre-filter alone (positives forwarded to Perspective) and end to end when
+    recorded Perspective scores are available.
+    """
+    positives = forwarded_positives = 0
+    baseline_hits = cascade_hits = scored = 0
+    forwarded = 0
+    for example in examples:
+        decision = prefilter.classify(example["text"])
+        forwarded_here = decision != BENIGN
+        forwarded += forwarded_here
+        if example["label"]:
+            positives += 1
+            forwarded_positives += forwarded_here
+            if "scores" in example:
+                scored += 1
+                flagged = max(example["scores"]["scores"].values()) > flag_threshold
+                baseline_hits += flagged
+                cascade_hits += flagged and forwarded_here
+    total = len(examples)
+    report = {
+        "messages": total,
+        "perspective_calls": forwarded,
+        "calls_saved": total - forwarded,
+        "calls_saved_ratio": (total - forwarded) / total if total else 0.0,
+        "prefilter_recall": forwarded_positives / positives if positives else None,
+    }
+    if scored:
+        report["baseline_recall"] = baseline_hits / scored
+        report["cascade_recall"] = cascade_hits / scored
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perspective pre-filter tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train_parser = commands.add_parser("train", help="train the linear model")
+    train_parser.add_argument("labeled")
+    train_parser.add_argument("model")
+    train_parser.add_argument("--epochs", type=int, default=5)
+    replay_parser = commands.add_parser("replay", help="report calls saved/recall")
+    replay_parser.add_argument("labeled")
+    replay_parser.add_argument("--model", default=PREFILTER_MODEL_PATH)
+    replay_parser.add_argument("--low", type=float, default=PREFILTER_LOW)
+    replay_parser.add_argument("--high", type=float, default=PREFILTER_HIGH)
+    args = parser.parse_args(argv)
+
+    examples = read_labeled(args.labeled)
+    if args.command == "train":
+        data = [(e["text"], e["label"]) for e in examples]
+        LinearModel().train(data, epochs=args.epochs).save(args.model)
+        print(f"Model saved to {args.model}")
+        return
+
+    model = LinearModel.load(args.model) if args.model else None
+    prefilter = PreFilter(model, args.low, args.high)
+    json.dump(replay(prefilter, examples), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
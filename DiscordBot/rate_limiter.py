@@ -0,0 +1,154 @@
+import asyncio
+import time
+from collections import deque
+from enum import IntEnum
+
+
+class Priority(IntEnum):
+    REVIEW = 0  # Moderator and report-flow scoring
+    DM = 1  # Messages sent to the bot directly
+    CHANNEL = 2  # Bulk channel traffic
+
+
+SHED = "shed"  # Reject new requests while the queue is full
+DEFER = "defer"  # Make the caller wait for room in the queue
+
+
+class QueueFullError(Exception):
+    def __init__(self, priority):
+        super().__init__(f"{priority.name} request queue is full, request shed")
+        self.priority = priority
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def time_until_token(self):
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def full(self):
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class PriorityScheduler:
+    """
+    Token-bucket rate limiter with one bounded FIFO queue per priority class.
+    Tokens are always handed to the highest-priority waiter first, so review
+    traffic never waits behind channel chatter. When a queue is full, its
+    policy either sheds the request (QueueFullError) or defers the caller
+    until there is room.
+    """
+
+    def __init__(self, rate, burst=None, queue_limits=None, policies=None):
+        self.bucket = TokenBucket(rate, burst or max(1, rate))
+        self.queue_limits = queue_limits or {
+            Priority.REVIEW: 100,
+            Priority.DM: 500,
+            Priority.CHANNEL: 1000,
+        }
+        self.policies = policies or {
+            Priority.REVIEW: DEFER,
+            Priority.DM: DEFER,
+            Priority.CHANNEL: SHED,
+        }
+        self.queues = {priority: deque() for priority in Priority}
+        self.space = {priority: asyncio.Condition() for priority in Priority}
+        self.wakeup = asyncio.Event()
+        self.worker = None
+        self.metrics = {
+            priority: {"granted": 0, "shed": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for priority in Priority
+        }
+
+    async def acquire(self, priority=Priority.CHANNEL):
+        priority = Priority(priority)
+        queue = self.queues[priority]
+        if not self._waiting(priority) and self.bucket.try_take():
+            self._record(priority, 0.0)
+            return
+
+        if len(queue) >= self.queue_limits[priority]:
+            if self.policies[priority] == SHED:
+                self.metrics[priority]["shed"] += 1
+                raise QueueFullError(priority)
+            async with self.space[priority]:
+                await self.space[priority].wait_for(
+                    lambda: len(queue) < self.queue_limits[priority]
+                )
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append((time.monotonic(), future))
+        self._ensure_worker()
+        self.wakeup.set()
+        await future
+
+    def _waiting(self, priority):
+        """
+        Whether anyone at this priority or higher is already queued.
+        """
+        return any(self.queues[p] for p in Priority if p <= priority)
+
+    def _ensure_worker(self):
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            priority = next((p for p in Priority if self.queues[p]), None)
+            if priority is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            delay = self.bucket.time_until_token()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue  # A higher-priority request may have arrived meanwhile
+            enqueued, future = self.queues[priority].popleft()
+            await self._notify_space(priority)
+            if future.done():  # Caller was cancelled while waiting
+                continue
+            self.bucket.try_take()
+            self._record(priority, time.monotonic() - enqueued)
+            future.set_result(None)
+
+    async def _notify_space(self, priority):
+        async with self.space[priority]:
+            self.space[priority].notify()
+
+    def _record(self, priority, wait):
+        metrics = self.metrics[priority]
+        metrics["granted"] += 1
+        metrics["wait_total"] += wait
+        metrics["wait_max"] = max(metrics["wait_max"], wait)
+
+    def stats(self):
+        stats = {}
+        for priority in Priority:
+            metrics = self.metrics[priority]
+            granted = metrics["granted"]
+            stats[priority.name.lower()] = {
+                "queue_depth": len(self.queues[priority]),
+                "granted": granted,
+                "shed": metrics["shed"],
+                "wait_avg": metrics["wait_total"] / granted if granted else 0.0,
+                "wait_max": metrics["wait_max"],
+            }
+        return stats
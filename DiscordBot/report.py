@@ -1,9 +1,16 @@
+import asyncio
 from enum import Enum, auto
+from collections import namedtuple
 import discord
+import logging
 import pprint
 import re
-from deepfake_detector import *
+from deepfake_detector import deepfake_service, format_analysis
 from perspective_api import *
+from text_detector import format_detection, text_detector
+from rate_limiter import Priority
+
+logger = logging.getLogger("report")
 
 
 class State(Enum):
@@ -29,19 +36,441 @@ class State(Enum):
     AWAITING_AUTO_FLAGGED_REVIEW = auto()
 
 
+# Attachment details kept when a report is restored from the session store
+StoredAttachment = namedtuple("StoredAttachment", ["url", "filename", "content_type"])
+
+MESSAGE_LINK_PATTERN = re.compile(r"/(\d+)/(\d+)/(\d+)")
+
+# CATEGORIES = (
+#     "`spam`, `inappropriate content`, `hate speech`, `imminent danger`, or `other`"
+# )
+CATEGORIES = (
+    "- `spam`\n"
+    "- `inappropriate content`\n"
+    "- `hate speech`\n"
+    "- `imminent danger`\n"
+    "- `other`"
+)
+CATEGORY_DESCRIPTIONS = {
+    "spam": "Spam includes unsolicited, low-quality communications.",
+    "inappropriate content": "Inappropriate content contains sexually explicit, violent, or otherwise inappropriate content.",
+    "hate speech": "Hate Speech: Hate speech contains discriminatory or derogatory language or images.",
+    "imminent danger": "Imminent Danger contains threats of self-harm, violence, or kidnapping.",
+    "other": "Other: Reported content doesn't fit into the above categories.",
+}
+DANGER_TYPES = (
+    "- `sh` for self-harm or suicidal intent\n"
+    + "- `ct` for credible threat of violence\n"
+    + "- `kt` for kidnapping threat"
+)
+
+# Prompts, built once
+START_PROMPT = (
+    "Thank you for starting the reporting process. "
+    + "Say `help` at any time for more information.\n\n"
+    + "Please copy paste the link to the message you want to report.\n"
+    + "You can obtain this link by right-clicking the message and clicking `Copy Message Link`."
+)
+YES_NO_RETRY = "I'm sorry, I didn't understand that. Please respond with `yes` or `no`."
+BAD_LINK = "I'm sorry, I could not read the message link you sent. Please try again or say `cancel` to cancel."
+UNKNOWN_GUILD = "I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."
+UNKNOWN_CHANNEL = "It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel."
+UNKNOWN_MESSAGE = "It seems this message was deleted or never existed. Please try again or say `cancel` to cancel."
+CONFIRM_MESSAGE = (
+    "Is this the message you'd like to report? Please respond with `yes` or `no`."
+)
+CATEGORY_PROMPT = (
+    "What category would you like to report this message under?\n"
+    + "Please respond with one of the following:\n"
+    + CATEGORIES
+)
+LINK_PROMPT = "Please copy paste the link to the message you want to report."
+CATEGORY_RETRY = (
+    "I'm sorry, I couldn't understand the category.\n"
+    + "Please respond with one of the following:\n"
+    + CATEGORIES
+)
+# Map from category to (next state, whether it is imminent danger, reply)
+CATEGORY_REPLIES = {
+    category: (
+        State.ADDITIONAL_MESSAGE,
+        False,
+        # TODO: Insert description of what this abuse type is + our policy on it in text below
+        f"You've selected: `{category}`\n"
+        + f"{CATEGORY_DESCRIPTIONS[category]}\n"
+        + "Please provide any additional details you'd like to include in your report.",
+    )
+    for category in ["spam", "inappropriate content", "hate speech"]
+}
+CATEGORY_REPLIES["other"] = (
+    State.ADDITIONAL_MESSAGE,
+    False,
+    "You've selected: `other`\n"
+    + f"{CATEGORY_DESCRIPTIONS['other']}\n"
+    + "Please explain why you reported this message and provide any additional details you'd like to include in your report.",
+)
+CATEGORY_REPLIES["imminent danger"] = (
+    State.IMMINENT_DANGER_SELECTION,
+    True,
+    # "Thank you for your urgency.\n" +
+    "You've selected: `imminent danger`\n"
+    + f"{CATEGORY_DESCRIPTIONS['imminent danger']}\n"
+    + "To further inform the action we should take, please select what kind of imminent danger this message falls under.\n"
+    + "Respond with one of the following:\n"
+    + DANGER_TYPES,
+)
+DANGER_RETRY = (
+    "I'm sorry, I couldn't understand the kind of imminent danger specified."
+    + "Please respond with one of the following:\n"
+    + DANGER_TYPES
+)
+KIDNAPPING_SELECTED = (
+    "You've selected that this message falls under: `kidnapping threat`\n"
+    + "Our moderator's have been notified of this report, and the message is being run through our AI-detection model. Please provide any additional details you'd like to include in your report."
+)
+# TODO: Insert description of what this abuse type is + our policy on it in text below
+DANGER_SELECTED = {
+    danger: f"You've selected that this message falls under: `{name}`\n"
+    + "Our moderator's have been notified of this report. Please provide any additional details you'd like to include in your report."
+    for danger, name in [
+        ("sh", "self-harm or suicidal intent"),
+        ("ct", "credible threat of violence"),
+    ]
+}
+ADDITIONAL_PROMPT = "Are there other messages you would like to flag? Please respond with `yes` or `no`."
+REPEAT_PROMPT = (
+    "The same process will be repeated for the next message.\n\n" + START_PROMPT
+)
+BLOCK_PROMPT = "Would you like to block this user from sending you more messages in the future? Please respond with `yes` or `no`."
+NOT_BLOCKED = "Message has been deleted. This user will continue to be allowed to send you messages in the future. Do you want to submit this report? Please respond with `yes` or `no`."
+SUBMITTED_URGENT = "Thank you for your report. It has been submitted. Due to the urgent nature of this case, it has been moved to the front of our priority queue."
+SUBMITTED = "Thank you for your report, our moderators will review the message shortly."
+CONFIRMED = "This report has been confirmed as an abuse violation. We will move forward with the report-handling protocol.\n"
+CONFIRMED_NOT_URGENT = (
+    CONFIRMED
+    + "The reporter has confirmed that this report is not an imminent danger. Please investigate if the reported user has violated our guidelines before. If they are a repeat offender, ban the user from the platform. If this is their first offense, issue a warning."
+)
+CONFIRMED_URGENT = (
+    CONFIRMED
+    + "The reporter has confirmed that this report is an imminent danger. Please report immediately to your manager and the authorities."
+)
+CONFIRMED_KIDNAPPING = (
+    CONFIRMED
+    + "The reporter has confirmed that this report is a kidnapping threat. The next is to investigate if this report could be a case virtual kidnapping. Please consult the results of our AI-detection models evalutaions below before completing the rest of this report review. \n"
+)
+MODEL_QUESTION = "\n After considerations using our models, is the message content AI-generated/Fake ? Please respond with 'yes' or 'no'."
+NOT_ABUSE = "This report is not an abuse violation."
+MODERATOR_DISCRETION = "The rest of this report handling is left to moderator discretion. Please investigate the intent of the reporter and decide is further action is needed. Malicious reporting may result in user suspension."
+LIKELY_FAKE = "This report is likely an attempt at a virtual kidnapping and a message has been sent to the user. Please report immediately to your manager and the authorities."
+# TODO: send a message to the user ^^
+LIKELY_REAL = "The reported message is malicious and dangerous and a message has been sent to the user. Please report immediately to your manager and the authorities."
+AUTO_FLAGGED_PROMPT = "Please review the contents of this report and decide if this is a safety violation. Respond with 'yes' or 'no'."
+AUTO_FLAGGED_CONFIRMED = "This report has been confirmed as an abuse violation. We will move forward with the report-handling protocol. \nPlease investigate if the reported user has violated our guidelines before. If they are a repeat offender, ban the user from the platform. If this is their first offense, issue a warning."
+AUTO_FLAGGED_DENIED = "This auto-flagged report is not an abuse violation."
+AUTO_FLAGGED_RETRY = (
+    "I'm sorry, I didn't understand that. Please respond with 'yes' or 'no'."
+)
+
+
+def normalize(content):
+    return content.strip().lower()
+
+
+# Map from (state, normalized input) to the handler for that transition. An
+# input of None matches anything not listed for the state.
+TRANSITIONS = {}
+
+
+def transition(state, *inputs):
+    def register(handler):
+        for text in inputs or (None,):
+            TRANSITIONS[(state, text)] = handler
+        return handler
+
+    return register
+
+
+def reply(text):
+    """
+    Handler that only answers with a fixed text.
+    """
+
+    async def handler(report, message):
+        return [text]
+
+    return handler
+
+
+# User reporting flow
+
+
+@transition(State.REPORT_START)
+async def start_report(report, message):
+    report.author_channel = message.channel
+    report.author_channel_id = message.channel.id
+    report.state = State.AWAITING_MESSAGE
+    return [START_PROMPT]
+
+
+@transition(State.AWAITING_MESSAGE)
+async def find_message(report, message):
+    # Parse out the three ID strings from the message link
+    m = MESSAGE_LINK_PATTERN.search(message.content)
+    if not m:
+        return [BAD_LINK]
+    guild_id, channel_id = int(m.group(1)), int(m.group(2))
+    guild = report.client.get_guild(guild_id)
+    if guild:
+        channel = guild.get_channel(channel_id)
+    elif report.client.is_known_guild(guild_id):
+        # Served by another shard, so fetch it over the REST API instead
+        channel = report.client.get_partial_messageable(channel_id, guild_id=guild_id)
+    else:
+        return [UNKNOWN_GUILD]
+    if not channel:
+        return [UNKNOWN_CHANNEL]
+    try:
+        message = await channel.fetch_message(int(m.group(3)))
+    except discord.errors.NotFound:
+        return [UNKNOWN_MESSAGE]
+
+    # Here we've found the message - it's up to you to decide what to do next!
+    report.state = State.MESSAGE_IDENTIFIED
+    report.guild_id = guild_id
+    report.message = message.content
+    report.message_author = message.author.name
+    report.message_author_id = message.author.id
+    report.attachments = message.attachments if message.attachments else None
+    return [
+        "I found this message:",
+        "```" + message.author.name + ": " + message.content + "```",
+        CONFIRM_MESSAGE,
+    ]
+
+
+@transition(State.MESSAGE_IDENTIFIED, "yes")
+async def message_confirmed(report, message):
+    report.state = State.AWAITING_CATEGORY
+    return [CATEGORY_PROMPT]
+
+
+@transition(State.MESSAGE_IDENTIFIED, "no")
+async def message_rejected(report, message):
+    report.state = State.AWAITING_MESSAGE
+    return [LINK_PROMPT]
+
+
+@transition(State.AWAITING_CATEGORY, *CATEGORY_REPLIES)
+async def choose_category(report, message):
+    state, imminent_danger, text = CATEGORY_REPLIES[normalize(message.content)]
+    report.state = state
+    if imminent_danger:
+        report.imminent_danger = True
+    return [text]
+
+
+@transition(State.IMMINENT_DANGER_SELECTION, "kt")
+async def choose_kidnapping(report, message):
+    report.state = State.ADDITIONAL_MESSAGE
+    report.virtual_kidnapping = True
+    return [KIDNAPPING_SELECTED]
+
+
+@transition(State.IMMINENT_DANGER_SELECTION, *DANGER_SELECTED)
+async def choose_danger(report, message):
+    report.state = State.ADDITIONAL_MESSAGE
+    return [DANGER_SELECTED[normalize(message.content)]]
+
+
+@transition(State.ADDITIONAL_MESSAGE)
+async def add_details(report, message):
+    report.additional_message = message.content
+    report.state = State.AWAITING_ADDITIONAL_MESSAGE
+    return [ADDITIONAL_PROMPT]
+
+
+@transition(State.AWAITING_ADDITIONAL_MESSAGE, "yes")
+async def report_another(report, message):
+    report.state = State.AWAITING_MESSAGE
+    return [REPEAT_PROMPT]
+
+
+@transition(State.AWAITING_ADDITIONAL_MESSAGE, "no")
+async def no_more_messages(report, message):
+    report.state = State.AWAITING_BLOCK
+    return [BLOCK_PROMPT]
+
+
+@transition(State.AWAITING_BLOCK, "yes")
+async def block_user(report, message):
+    report.state = State.CONFIRM_SUBMIT
+    report.block_user = True
+    return [
+        f"Message has been deleted. {report.message_author} is now blocked from sending you messages in the future. Do you want to submit this report? Please respond with `yes` or `no`."
+    ]
+
+
+@transition(State.AWAITING_BLOCK, "no")
+async def dont_block_user(report, message):
+    report.state = State.CONFIRM_SUBMIT
+    return [NOT_BLOCKED]
+
+
+@transition(State.CONFIRM_SUBMIT, "yes")
+async def submit_report(report, message):
+    report.state = State.REPORT_COMPLETE
+    return [SUBMITTED_URGENT if report.imminent_danger else SUBMITTED]
+
+
+@transition(State.CONFIRM_SUBMIT, "no")
+async def cancel_report(report, message):
+    report.state = State.REPORT_COMPLETE
+    return ["Report cancelled."]
+
+
+# Moderator flow
+
+
+@transition(State.MODERATOR_REVIEW)
+async def start_review(report, message):
+    report.state = State.AWAITING_ABUSE_VERIFICATION
+    text = "Please review the contents of ths report and decide if this is a safety violation. Respond with `yes` or `no`. Attached is the flagged message:\n"
+    text += f"Flagged message: {report.message}\n"
+    text += f"Imminent danger: {report.imminent_danger}\n"
+    text += f"Virtual kidnapping: {report.virtual_kidnapping}\n"
+    text += f"Additional message: {report.additional_message}\n"
+    text += f"Attachments: {report.attachments}\n"
+    return [text]
+
+
+@transition(State.AWAITING_ABUSE_VERIFICATION, "yes")
+async def abuse_confirmed(report, message):
+    if not report.imminent_danger:
+        report.state = State.MOD_COMPLETE
+        return [CONFIRMED_NOT_URGENT]
+    if not report.virtual_kidnapping:
+        report.state = State.MOD_COMPLETE
+        return [CONFIRMED_URGENT]
+
+    # The models are independent, so run them at the same time. A failing
+    # model is reported in the results rather than ending the review.
+    image_result, perspective, detection = await asyncio.gather(
+        deepfake_service.analyze(report.attachments or []),
+        eval_text(report.message, priority=Priority.REVIEW, degrade=True),
+        text_detector.predict(report.message),
+        return_exceptions=True,
+    )
+    ans = "\n MODELS RESULTS: \n \n"
+    ans += "Image Evaluation : \n"
+    if isinstance(image_result, Exception):
+        ans += f"< IMAGE MODEL FAILED: {image_result} > \n\n"
+    elif report.attachments:
+        ans += format_analysis(image_result) + "\n\n"
+    else:
+        ans += "< NO IMAGE FOUND > \n\n"
+
+    ans += "Text Evaluation: \n"
+    if isinstance(detection, Exception):
+        ans += f"< TEXT MODEL FAILED: {detection} > \n"
+    else:
+        ans += format_detection(detection) + "\n"
+    if isinstance(perspective, Exception):
+        ans += f"< PERSPECTIVE UNAVAILABLE: {perspective} > \n\n"
+    else:
+        if perspective.get("degraded"):
+            ans += "< PERSPECTIVE UNAVAILABLE: keyword estimate below > \n"
+        ans += pprint.pformat(score_format(perspective)) + "\n\n"
+    report.state = State.AWAITING_MODEL_RESULTS
+    return [CONFIRMED_KIDNAPPING + ans + MODEL_QUESTION]
+
+
+@transition(State.AWAITING_ABUSE_VERIFICATION, "no")
+async def abuse_denied(report, message):
+    report.state = State.ABUSE_DENIED
+    return [NOT_ABUSE]
+
+
+@transition(State.ABUSE_DENIED)
+async def leave_to_moderator(report, message):
+    report.state = State.MOD_COMPLETE
+    return [MODERATOR_DISCRETION]
+
+
+@transition(State.AWAITING_MODEL_RESULTS, "yes")
+async def model_says_fake(report, message):
+    report.state = State.MOD_COMPLETE
+    report.fake = True
+    return [LIKELY_FAKE]
+
+
+@transition(State.AWAITING_MODEL_RESULTS, "no")
+async def model_says_real(report, message):
+    report.state = State.MOD_COMPLETE
+    report.fake = False
+    return [LIKELY_REAL]
+
+
+@transition(State.AUTO_FLAGGED)
+async def start_auto_flag_review(report, message):
+    report.state = State.AWAITING_AUTO_FLAGGED_REVIEW
+    return [AUTO_FLAGGED_PROMPT]
+
+
+@transition(State.AWAITING_AUTO_FLAGGED_REVIEW, "yes")
+async def auto_flag_confirmed(report, message):
+    report.state = State.MOD_COMPLETE
+    return [AUTO_FLAGGED_CONFIRMED]
+
+
+@transition(State.AWAITING_AUTO_FLAGGED_REVIEW, "no")
+async def auto_flag_denied(report, message):
+    report.state = State.ABUSE_DENIED
+    return [AUTO_FLAGGED_DENIED]
+
+
+# Anything else in a yes/no state asks again
+for state in [
+    State.MESSAGE_IDENTIFIED,
+    State.AWAITING_ADDITIONAL_MESSAGE,
+    State.AWAITING_BLOCK,
+    State.CONFIRM_SUBMIT,
+    State.AWAITING_ABUSE_VERIFICATION,
+    State.AWAITING_MODEL_RESULTS,
+]:
+    transition(state)(reply(YES_NO_RETRY))
+transition(State.AWAITING_AUTO_FLAGGED_REVIEW)(reply(AUTO_FLAGGED_RETRY))
+transition(State.AWAITING_CATEGORY)(reply(CATEGORY_RETRY))
+transition(State.IMMINENT_DANGER_SELECTION)(reply(DANGER_RETRY))
+
+
 class Report:
+    """
+    State of one report. The flow itself lives in TRANSITIONS; a Report is a
+    plain slotted record so that many can be held at once cheaply.
+    """
+
     START_KEYWORD = "report"
     CANCEL_KEYWORD = "cancel"
     HELP_KEYWORD = "help"
-    # CATEGORIES = (
-    #     "`spam`, `inappropriate content`, `hate speech`, `imminent danger`, or `other`"
-    # )
-    CATEGORIES = (
-        "- `spam`\n"
-        "- `inappropriate content`\n"
-        "- `hate speech`\n"
-        "- `imminent danger`\n"
-        "- `other`"
+    CATEGORIES = CATEGORIES
+
+    __slots__ = (
+        "state",
+        "client",
+        "message",
+        "message_author",
+        "message_author_id",
+        "imminent_danger",
+        "virtual_kidnapping",
+        "message_type",
+        "fake",
+        "block_user",
+        "additional_message",
+        "author_channel",
+        "author_channel_id",
+        "attachments",
+        "flag_score",
+        "guild_id",
     )
 
     def __init__(self, client):
@@ -57,324 +486,88 @@ class Report:
         self.block_user = False
         self.additional_message = None
         self.author_channel = None
+        self.author_channel_id = None
         self.attachments = None
+        self.flag_score = None  # Highest Perspective score if auto-flagged
+        self.guild_id = None  # Guild of the reported message
 
     async def handle_message(self, message):
         """
-        This function makes up the meat of the user-side reporting flow. It defines how we transition between states and what
-        prompts to offer at each of those states. You're welcome to change anything you want; this skeleton is just here to
-        get you started and give you a model for working with Discord.
+        This function makes up the meat of the user-side reporting flow. It looks up the handler for the current state
+        and the normalized message in TRANSITIONS, which moves the report to its next state and returns the prompts to send.
         """
-        print("in handle_message(): ", self.state, message)
+        logger.debug("handle_message: %s %r", self.state, message.content)
         if message.content == self.CANCEL_KEYWORD:
             self.state = State.REPORT_COMPLETE
             return ["Report cancelled."]
 
-        if self.state == State.REPORT_START:
-            self.author_channel = message.channel
-            reply = "Thank you for starting the reporting process. "
-            reply += "Say `help` at any time for more information.\n\n"
-            reply += "Please copy paste the link to the message you want to report.\n"
-            reply += "You can obtain this link by right-clicking the message and clicking `Copy Message Link`."
-            self.state = State.AWAITING_MESSAGE
-            return [reply]
-
-        if self.state == State.AWAITING_MESSAGE:
-            # Parse out the three ID strings from the message link
-            m = re.search("/(\d+)/(\d+)/(\d+)", message.content)
-            if not m:
-                return [
-                    "I'm sorry, I could not read the message link you sent. Please try again or say `cancel` to cancel."
-                ]
-            guild = self.client.get_guild(int(m.group(1)))
-            if not guild:
-                return [
-                    "I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."
-                ]
-            channel = guild.get_channel(int(m.group(2)))
-            if not channel:
-                return [
-                    "It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel."
-                ]
-            try:
-                message = await channel.fetch_message(int(m.group(3)))
-            except discord.errors.NotFound:
-                return [
-                    "It seems this message was deleted or never existed. Please try again or say `cancel` to cancel."
-                ]
-
-            # Here we've found the message - it's up to you to decide what to do next!
-            self.state = State.MESSAGE_IDENTIFIED
-            self.message = message.content
-            self.message_author = message.author.name
-            self.message_author_id = message.author.id
-            self.attachments = message.attachments if message.attachments else None
-            return [
-                "I found this message:",
-                "```" + message.author.name + ": " + message.content + "```",
-                "Is this the message you'd like to report? Please respond with `yes` or `no`.",
-            ]
-
-        if self.state == State.MESSAGE_IDENTIFIED:
-            if message.content.lower() == "yes":
-                self.state = State.AWAITING_CATEGORY
-                # return [
-                #     "What category would you like to report this message under? Please respond with "
-                #     + self.CATEGORIES
-                #     + "."
-                # ]
-                return [
-                    "What category would you like to report this message under?\n"
-                    + "Please respond with one of the following:\n"
-                    + self.CATEGORIES
-                ]
-            elif message.content.lower() == "no":
-                self.state = State.AWAITING_MESSAGE
-                return ["Please copy paste the link to the message you want to report."]
-            else:
-                return [
-                    "I'm sorry, I didn't understand that. Please respond with `yes` or `no`."
-                ]
-
-        if self.state == State.AWAITING_CATEGORY:
-            category = message.content
-            category_dict = {
-                "spam": "Spam includes unsolicited, low-quality communications.",
-                "inappropriate content": "Inappropriate content contains sexually explicit, violent, or otherwise inappropriate content.",
-                "hate speech": "Hate Speech: Hate speech contains discriminatory or derogatory language or images.",
-                "imminent danger": "Imminent Danger contains threats of self-harm, violence, or kidnapping.",
-                "other": "Other: Reported content doesn't fit into the above categories.",
-            }
-            if category in ["spam", "inappropriate content", "hate speech"]:
-                self.state = State.ADDITIONAL_MESSAGE
-                return [  # TODO: Insert description of what this abuse type is + our policy on it in text below
-                    f"You've selected: `{category}`\n"
-                    + f"{category_dict[category]}\n"
-                    + "Please provide any additional details you'd like to include in your report."
-                ]
-            elif category == "other":
-                self.state = State.ADDITIONAL_MESSAGE
-                return [
-                    f"You've selected: `{category}`\n"
-                    + f"{category_dict[category]}\n"
-                    + "Please explain why you reported this message and provide any additional details you'd like to include in your report."
-                ]
-            elif category == "imminent danger":
-                self.state = State.IMMINENT_DANGER_SELECTION
-                self.imminent_danger = True
-                return [
-                    # "Thank you for your urgency.\n" +
-                    f"You've selected: `{category}`\n"
-                    + f"{category_dict[category]}\n"
-                    + "To further inform the action we should take, please select what kind of imminent danger this message falls under.\n"
-                    + "Respond with one of the following:\n"
-                    + "- `sh` for self-harm or suicidal intent\n"
-                    + "- `ct` for credible threat of violence\n"
-                    + "- `kt` for kidnapping threat"
-                ]
-            else:
-                return [
-                    "I'm sorry, I couldn't understand the category.\n"
-                    + "Please respond with one of the following:\n"
-                    + self.CATEGORIES
-                ]
-
-        if self.state == State.IMMINENT_DANGER_SELECTION:
-            category = message.content
-            if category not in ["sh", "ct", "kt"]:
-                return [
-                    "I'm sorry, I couldn't understand the kind of imminent danger specified."
-                    + "Please respond with one of the following:\n"
-                    + "- `sh` for self-harm or suicidal intent\n"
-                    + "- `ct` for credible threat of violence\n"
-                    + "- `kt` for kidnapping threat"
-                ]
-            self.state = State.ADDITIONAL_MESSAGE
-            if category == "kt":
-                self.virtual_kidnapping = True
-                return [
-                    "You've selected that this message falls under: `kidnapping threat`\n"
-                    + "Our moderator's have been notified of this report, and the message is being run through our AI-detection model. Please provide any additional details you'd like to include in your report."
-                ]
-            else:
-                type = (
-                    "self-harm or suicidal intent"
-                    if category == "sh"
-                    else "credible threat of violence"
-                )
-                return [  # TODO: Insert description of what this abuse type is + our policy on it in text below
-                    f"You've selected that this message falls under: `{type}`\n"
-                    + "Our moderator's have been notified of this report. Please provide any additional details you'd like to include in your report."
-                ]
-
-        if self.state == State.ADDITIONAL_MESSAGE:
-            self.additional_message = message.content
-            self.state = State.AWAITING_ADDITIONAL_MESSAGE
-            return [
-                "Are there other messages you would like to flag? Please respond with `yes` or `no`.",
-            ]
-
-        if self.state == State.AWAITING_ADDITIONAL_MESSAGE:
-            if message.content.lower() == "yes":
-                reply = "The same process will be repeated for the next message.\n\n"
-                reply += "Thank you for starting the reporting process. "
-                reply += "Say `help` at any time for more information.\n\n"
-                reply += (
-                    "Please copy paste the link to the message you want to report.\n"
-                )
-                reply += "You can obtain this link by right-clicking the message and clicking `Copy Message Link`."
-                self.state = State.AWAITING_MESSAGE
-                return [reply]
-            elif message.content.lower() == "no":
-                self.state = State.AWAITING_BLOCK
-                return [
-                    "Would you like to block this user from sending you more messages in the future? Please respond with `yes` or `no`."
-                ]
-            else:
-                return [
-                    "I'm sorry, I didn't understand that. Please respond with `yes` or `no`."
-                ]
-
-        if self.state == State.AWAITING_BLOCK:
-            if message.content.lower() == "yes":
-                self.state = State.CONFIRM_SUBMIT
-                self.block_user = True
-                return [
-                    f"Message has been deleted. {self.message_author} is now blocked from sending you messages in the future. Do you want to submit this report? Please respond with `yes` or `no`."
-                ]
-            elif message.content.lower() == "no":
-                self.state = State.CONFIRM_SUBMIT
-                return [
-                    "Message has been deleted. This user will continue to be allowed to send you messages in the future. Do you want to submit this report? Please respond with `yes` or `no`."
-                ]
-            else:
-                return [
-                    "I'm sorry, I didn't understand that. Please respond with `yes` or `no`."
-                ]
-
-        if self.state == State.CONFIRM_SUBMIT:
-            if message.content.lower() == "yes":
-                self.state = State.REPORT_COMPLETE
-                if self.imminent_danger:
-                    return [
-                        "Thank you for your report. It has been submitted. Due to the urgent nature of this case, it has been moved to the front of our priority queue."
-                    ]
-                else:
-                    return [
-                        "Thank you for your report, our moderators will review the message shortly."
-                    ]
-            elif message.content.lower() == "no":
-                self.state = State.REPORT_COMPLETE
-                return ["Report cancelled."]
-            else:
-                return [
-                    "I'm sorry, I didn't understand that. Please respond with `yes` or `no`."
-                ]
-
-        # entering moderator flow below!
-        if self.state == State.MODERATOR_REVIEW:
-            self.state = State.AWAITING_ABUSE_VERIFICATION
-            reply = "Please review the contents of ths report and decide if this is a safety violation. Respond with `yes` or `no`. Attached is the flagged message:\n"
-            reply += f"Flagged message: {self.message}\n"
-            reply += f"Imminent danger: {self.imminent_danger}\n"
-            reply += f"Virtual kidnapping: {self.virtual_kidnapping}\n"
-            reply += f"Additional message: {self.additional_message}\n"
-            reply += f"Attachments: {self.attachments}\n"
-            return [reply]
-
-        if self.state == State.AWAITING_ABUSE_VERIFICATION:
-            if message.content.lower() == "yes":
-                if not self.imminent_danger:
-                    self.state = State.MOD_COMPLETE
-                    return [
-                        "This report has been confirmed as an abuse violation. We will move forward with the report-handling protocol.\n"
-                        + "The reporter has confirmed that this report is not an imminent danger. Please investigate if the reported user has violated our guidelines before. If they are a repeat offender, ban the user from the platform. If this is their first offense, issue a warning."
-                    ]
-                else:
-                    if not self.virtual_kidnapping:
-                        self.state = State.MOD_COMPLETE
-                        return [
-                            "This report has been confirmed as an abuse violation. We will move forward with the report-handling protocol.\n"
-                            + "The reporter has confirmed that this report is an imminent danger. Please report immediately to your manager and the authorities."
-                        ]
-                    else:
-                        self.state = State.AWAITING_MODEL_RESULTS
-
-                        ans = "\n MODELS RESULTS: \n \n"
-                        ans += "Image Evaluation : \n"
-                        if self.attachments:
-                            ans = f"{ans} {predict_deepfake_nopreprocessing(self.attachments[0].url)} \n\n"
-                        else:
-                            ans += "< NO IMAGE FOUND > \n\n"
-
-                        ans += "Text Evaluation: \n"
-                        # TODO: text model scores/results
-                        scores = score_format(eval_text(self.message))
-                        ans += pprint.pformat(scores) + "\n\n"
-
-                        return [
-                            "This report has been confirmed as an abuse violation. We will move forward with the report-handling protocol.\n"
-                            + "The reporter has confirmed that this report is a kidnapping threat. The next is to investigate if this report could be a case virtual kidnapping. Please consult the results of our AI-detection models evalutaions below before completing the rest of this report review. \n"
-                            + ans
-                            + "\n After considerations using our models, is the message content AI-generated/Fake ? Please respond with 'yes' or 'no'."
-                        ]
-
-            elif message.content.lower() == "no":
-                self.state = State.ABUSE_DENIED
-                return ["This report is not an abuse violation."]
-            else:
-                return [
-                    "I'm sorry, I didn't understand that. Please respond with `yes` or `no`."
-                ]
-
-        if self.state == State.ABUSE_DENIED:
-            self.state = State.MOD_COMPLETE
-            return [
-                "The rest of this report handling is left to moderator discretion. Please investigate the intent of the reporter and decide is further action is needed. Malicious reporting may result in user suspension."
-            ]
-
-        if self.state == State.AWAITING_MODEL_RESULTS:
-            if message.content.lower() == "yes":
-                self.state = State.MOD_COMPLETE
-                self.fake = True
-                return [
-                    "This report is likely an attempt at a virtual kidnapping and a message has been sent to the user. Please report immediately to your manager and the authorities."
-                ]
-            elif message.content.lower() == "no":
-                self.state = State.MOD_COMPLETE
-                self.fake = False
-                return [  # TODO: send a message to the user ^^
-                    "The reported message is malicious and dangerous and a message has been sent to the user. Please report immediately to your manager and the authorities."
-                ]
-            else:
-                return [
-                    "I'm sorry, I didn't understand that. Please respond with `yes` or `no`."
-                ]
+        handler = TRANSITIONS.get((self.state, normalize(message.content)))
+        if handler is None:
+            handler = TRANSITIONS.get((self.state, None))
+        if handler is None:
+            return []
+        return await handler(self, message)
 
-        if self.state == State.AUTO_FLAGGED:
-            self.state = State.AWAITING_AUTO_FLAGGED_REVIEW
-            return [
-                "Please review the contents of this report and decide if this is a safety violation. Respond with 'yes' or 'no'."
-            ]
-
-        if self.state == State.AWAITING_AUTO_FLAGGED_REVIEW:
-            if message.content.lower() == "yes":
-                self.state = State.MOD_COMPLETE
-                return [
-                    "This report has been confirmed as an abuse violation. We will move forward with the report-handling protocol. \nPlease investigate if the reported user has violated our guidelines before. If they are a repeat offender, ban the user from the platform. If this is their first offense, issue a warning."
-                ]
-            elif message.content.lower() == "no":
-                self.state = State.ABUSE_DENIED
-                return ["This auto-flagged report is not an abuse violation."]
-            else:
-                return [
-                    "I'm sorry, I didn't understand that. Please respond with 'yes' or 'no'."
+    def to_dict(self):
+        """
+        Serializable snapshot of this report's state, without Discord objects.
+        """
+        return {
+            "state": self.state.name,
+            "message": self.message,
+            "message_author": self.message_author,
+            "message_author_id": self.message_author_id,
+            "imminent_danger": self.imminent_danger,
+            "virtual_kidnapping": self.virtual_kidnapping,
+            "message_type": self.message_type,
+            "fake": self.fake,
+            "block_user": self.block_user,
+            "additional_message": self.additional_message,
+            "flag_score": self.flag_score,
+            "guild_id": self.guild_id,
+            "author_channel_id": self.author_channel_id,
+            "attachments": (
+                [
+                    [a.url, a.filename, getattr(a, "content_type", None)]
+                    for a in self.attachments
                 ]
+                if self.attachments
+                else None
+            ),
+        }
 
-        return []
+    @classmethod
+    def from_dict(cls, client, data):
+        report = cls(client)
+        for key, value in data.items():
+            if key not in ("state", "author_channel_id", "attachments"):
+                setattr(report, key, value)
+        report.state = State[data["state"]]
+        if data["author_channel_id"] is not None:
+            # DM channels may not be cached after a restart; the bot fetches
+            # them by ID when needed
+            report.author_channel = client.get_channel(data["author_channel_id"])
+        report.author_channel_id = data["author_channel_id"]
+        if data["attachments"]:
+            report.attachments = [StoredAttachment(*a) for a in data["attachments"]]
+        return report
 
     def report_complete(self):
         return self.state == State.REPORT_COMPLETE
 
     def mod_complete(self):
         return self.state == State.MOD_COMPLETE
+
+    def in_review(self):
+        return self.state in REVIEW_STATES
+
+
+# States in which a report is waiting on a moderator
+REVIEW_STATES = {
+    State.MODERATOR_REVIEW,
+    State.AWAITING_ABUSE_VERIFICATION,
+    State.ABUSE_DENIED,
+    State.AWAITING_MODEL_RESULTS,
+    State.AUTO_FLAGGED,
+    State.AWAITING_AUTO_FLAGGED_REVIEW,
+}
@@ -0,0 +1,232 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+from collections import OrderedDict
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger("report_store")
+
+# Buffered writes are flushed when REPORT_BATCH_SIZE reports are waiting or
+# every REPORT_FLUSH_INTERVAL seconds, whichever comes first.
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", "50"))
+REPORT_FLUSH_INTERVAL = float(os.getenv("REPORT_FLUSH_INTERVAL", "2"))
+REPORT_SPOOL_PATH = os.getenv("REPORT_SPOOL_PATH", "report_spool.jsonl")
+REPORT_COUNT_CACHE_SIZE = int(os.getenv("REPORT_COUNT_CACHE_SIZE", "10000"))
+
+DUPLICATE_KEY = 11000
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {"__oid__": str(value)}
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _decode(value):
+    if "__datetime__" in value:
+        return datetime.datetime.fromisoformat(value["__datetime__"])
+    if "__oid__" in value:
+        return ObjectId(value["__oid__"])
+    return value
+
+
+class ReportStore:
+    """
+    Async persistence for saved reports. pymongo calls run in worker threads so
+    they never block the event loop. Writes are buffered and sent with
+    insert_many; if Mongo is unreachable they are appended to a local JSONL
+    spool and retried on the next flush.
+
+    Per-user report counts are kept in a materialized `counters` collection
+    ({_id: reported user id, reports: [report ids]}) that each flush updates
+    with $addToSet, so a retried flush never counts a report twice, and cached
+    in an in-process LRU that is invalidated on write.
+    """
+
+    def __init__(
+        self,
+        collection,
+        counters=None,
+        batch_size=REPORT_BATCH_SIZE,
+        flush_interval=REPORT_FLUSH_INTERVAL,
+        spool_path=REPORT_SPOOL_PATH,
+        count_cache_size=REPORT_COUNT_CACHE_SIZE,
+    ):
+        self.collection = collection
+        self.counters = counters
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self.count_cache_size = count_cache_size
+        self.buffer = []
+        self.in_flight = []
+        self.spooled = self._read_spool()
+        self.count_cache = OrderedDict()  # Map from user ID to stored count
+        self.writes = 0  # Number of successful flushes, to detect stale reads
+        self.flush_lock = asyncio.Lock()
+        self.flusher = None
+        self._tasks = set()
+
+    async def ensure_indexes(self):
+        """
+        Creates the indexes the bot queries by, and builds the counters from the
+        stored reports the first time they are used.
+        """
+        await asyncio.to_thread(self._ensure_indexes)
+
+    def _ensure_indexes(self):
+        self.collection.create_index([("reported_user_id", ASCENDING)])
+        self.collection.create_index([("reporter_user_id", ASCENDING)])
+        if self.counters is None:
+            return
+        first = self.counters.find_one()
+        if first is not None and "reports" in first:
+            return
+        # Also rebuilds counters from before they listed report IDs
+        totals = self.collection.aggregate(
+            [{"$group": {"_id": "$reported_user_id", "reports": {"$push": "$_id"}}}]
+        )
+        requests = [
+            UpdateOne(
+                {"_id": t["_id"]}, {"$set": {"reports": t["reports"]}}, upsert=True
+            )
+            for t in totals
+        ]
+        if requests:
+            self.counters.bulk_write(requests, ordered=False)
+
+    async def save(self, report_data):
+        # Assigning the _id up front makes retried inserts idempotent
+        report_data.setdefault("_id", ObjectId())
+        self.buffer.append(report_data)
+        self.count_cache.pop(report_data.get("reported_user_id"), None)
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.create_task(self._flush_periodically())
+        if len(self.buffer) >= self.batch_size:
+            task = asyncio.create_task(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def count(self, query):
+        """
+        Counts stored reports matching an equality filter, including ones that
+        are still buffered or spooled.
+        """
+        stored = await asyncio.to_thread(self.collection.count_documents, query)
+        return stored + sum(1 for d in self._pending() if _matches(d, query))
+
+    async def count_for_user(self, user_id):
+        """
+        Number of reports against `user_id`, read from the materialized counter
+        (or the LRU) plus reports not yet written to Mongo.
+        """
+        if self.counters is None:
+            return await self.count({"reported_user_id": user_id})
+        if user_id in self.count_cache:
+            self.count_cache.move_to_end(user_id)
+            stored = self.count_cache[user_id]
+        else:
+            writes = self.writes
+            document = await asyncio.to_thread(self.counters.find_one, {"_id": user_id})
+            stored = len(document.get("reports", [])) if document else 0
+            if writes == self.writes:
+                self._cache_count(user_id, stored)
+        pending = sum(
+            1 for d in self._pending() if d.get("reported_user_id") == user_id
+        )
+        return stored + pending
+
+    def _cache_count(self, user_id, count):
+        self.count_cache[user_id] = count
+        while len(self.count_cache) > self.count_cache_size:
+            self.count_cache.popitem(last=False)
+
+    def _pending(self):
+        return self.buffer + self.in_flight + self.spooled
+
+    async def flush(self):
+        async with self.flush_lock:
+            batch, self.buffer = self.buffer, []
+            spooled = self.spooled
+            self.in_flight = batch
+            documents = spooled + batch
+            if not documents:
+                return
+            try:
+                await asyncio.to_thread(self._write, documents)
+            except Exception:
+                # Whatever went wrong, keep the reports rather than drop them
+                logger.exception("Could not write reports to MongoDB, spooling locally")
+                self.spooled = spooled + batch
+                await asyncio.to_thread(self._append_spool, batch)
+                return
+            finally:
+                self.in_flight = []
+            self.writes += 1
+            for document in documents:
+                self.count_cache.pop(document.get("reported_user_id"), None)
+            if spooled:
+                self.spooled = []
+                await asyncio.to_thread(self._clear_spool)
+
+    def _write(self, documents):
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Reports already written by an earlier, partly failed flush
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+        if self.counters is not None:
+            report_ids = {}
+            for d in documents:
+                report_ids.setdefault(d.get("reported_user_id"), []).append(d["_id"])
+            self.counters.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": user_id},
+                        {"$addToSet": {"reports": {"$each": ids}}},
+                        upsert=True,
+                    )
+                    for user_id, ids in report_ids.items()
+                ],
+                ordered=False,
+            )
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _read_spool(self):
+        if not os.path.isfile(self.spool_path):
+            return []
+        with open(self.spool_path) as f:
+            return [json.loads(line, object_hook=_decode) for line in f if line.strip()]
+
+    def _append_spool(self, documents):
+        with open(self.spool_path, "a") as f:
+            for document in documents:
+                f.write(json.dumps(document, default=_encode) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _clear_spool(self):
+        os.remove(self.spool_path)
+
+    async def close(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+
+def _matches(document, query):
+    return all(document.get(key) == value for key, value in query.items())
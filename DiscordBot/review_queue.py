@@ -0,0 +1,357 @@
+import heapq
+import itertools
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# "#12 yes" addresses ticket 12 directly
+TICKET_PATTERN = re.compile(r"^#(\d+)\s*(.*)$", re.DOTALL)
+
+
+class ClaimError(Exception):
+    def __init__(self, ticket, moderator_id):
+        super().__init__(f"Report #{ticket} is being reviewed by another moderator")
+        self.ticket = ticket
+        self.moderator_id = moderator_id
+
+
+class UnknownThreadError(Exception):
+    def __init__(self, thread_id):
+        super().__init__(
+            "This thread isn't linked to a report waiting for review. Use "
+            "`claim` or `#<ticket>` in the mod channel instead."
+        )
+        self.thread_id = thread_id
+
+
+class ReviewQueue:
+    """
+    Priority queue of reports awaiting moderator review. Urgent reports
+    (imminent danger, kidnapping) come first, then higher auto-flag scores,
+    then older reports. Each report gets a short ticket number moderators can
+    use to address it; moderators claim reports so several can work through
+    the backlog at once. Enqueue and claim_next are O(log n): claimed or
+    completed tickets are dropped lazily when they reach the top of the heap.
+
+    Report threads are recorded by report key. Given the bot's SessionStore
+    they are also kept in its SQLite database, so after a restart a thread
+    still leads to its report even though the re-queued report gets a new
+    ticket number.
+    """
+
+    def __init__(self, sessions=None):
+        self.heap = []  # (priority key, ticket)
+        self.tickets = {}  # Map from ticket to report key
+        self.ticket_of = {}  # Map from report key to ticket
+        self.keys = {}  # Map from ticket to its priority key
+        self.claims = {}  # Map from ticket to moderator ID
+        self.claimed_by = {}  # Map from moderator ID to ticket
+        self.threads = {}  # Map from thread ID to report key
+        self.mod_channels = {}  # Map from guild ID to its mod channel ID
+        self.counter = itertools.count(1)
+        self.sessions = sessions
+        if sessions is not None:
+            sessions.db.execute(
+                "CREATE TABLE IF NOT EXISTS review_threads "
+                "(thread_id INTEGER PRIMARY KEY, report_key INTEGER)"
+            )
+            sessions.commit()
+            self.threads = dict(
+                sessions.db.execute("SELECT thread_id, report_key FROM review_threads")
+            )
+
+    def __len__(self):
+        return len(self.tickets) - len(self.claims)
+
+    @staticmethod
+    def priority(report, created_at=None):
+        urgent = report.imminent_danger or report.virtual_kidnapping
+        return (
+            0 if urgent else 1,
+            -(report.flag_score or 0.0),
+            created_at or time.time(),
+        )
+
+    def enqueue(self, report_key, report):
+        """
+        Adds a report (or re-prioritizes one already queued) and returns its
+        ticket number.
+        """
+        ticket = self.ticket_of.get(report_key)
+        if ticket is None:
+            ticket = next(self.counter)
+            self.tickets[ticket] = report_key
+            self.ticket_of[report_key] = ticket
+            key = self.priority(report)
+        else:
+            key = self.priority(report, self.keys[ticket][2])
+        self.keys[ticket] = key
+        if ticket not in self.claims:
+            heapq.heappush(self.heap, (key, ticket))
+        return ticket
+
+    def _is_waiting(self, key, ticket):
+        return self.keys.get(ticket) == key and ticket not in self.claims
+
+    def claim_next(self, moderator_id):
+        """
+        Claims the highest-priority unclaimed report for a moderator, or
+        returns None if the queue is empty.
+        """
+        while self.heap:
+            key, ticket = heapq.heappop(self.heap)
+            if self._is_waiting(key, ticket):
+                self._assign(ticket, moderator_id)
+                return ticket
+        return None
+
+    def claim(self, ticket, moderator_id):
+        """
+        Claims a specific ticket. Raises ClaimError if another moderator has it.
+        """
+        if ticket not in self.tickets:
+            raise KeyError(ticket)
+        owner = self.claims.get(ticket)
+        if owner is not None and owner != moderator_id:
+            raise ClaimError(ticket, owner)
+        self._assign(ticket, moderator_id)
+
+    def _assign(self, ticket, moderator_id):
+        previous = self.claimed_by.get(moderator_id)
+        if previous is not None and previous != ticket:
+            self.release(previous)
+        self.claims[ticket] = moderator_id
+        self.claimed_by[moderator_id] = ticket
+
+    def release(self, ticket):
+        moderator_id = self.claims.pop(ticket, None)
+        if moderator_id is not None and self.claimed_by.get(moderator_id) == ticket:
+            del self.claimed_by[moderator_id]
+        if ticket in self.tickets:
+            heapq.heappush(self.heap, (self.keys[ticket], ticket))
+
+    def complete(self, ticket):
+        moderator_id = self.claims.pop(ticket, None)
+        if moderator_id is not None and self.claimed_by.get(moderator_id) == ticket:
+            del self.claimed_by[moderator_id]
+        report_key = self.tickets.pop(ticket, None)
+        self.ticket_of.pop(report_key, None)
+        self.keys.pop(ticket, None)
+        for thread_id in [t for t, key in self.threads.items() if key == report_key]:
+            del self.threads[thread_id]
+        if self.sessions is not None:
+            self.sessions.db.execute(
+                "DELETE FROM review_threads WHERE report_key = ?", (report_key,)
+            )
+            self.sessions.commit_soon()
+
+    def attach_thread(self, ticket, thread_id):
+        report_key = self.tickets[ticket]
+        self.threads[thread_id] = report_key
+        if self.sessions is not None:
+            self.sessions.db.execute(
+                "INSERT OR REPLACE INTO review_threads VALUES (?, ?)",
+                (thread_id, report_key),
+            )
+            self.sessions.commit_soon()
+
+    def report_key(self, ticket):
+        return self.tickets.get(ticket)
+
+    def claim_of(self, moderator_id):
+        return self.claimed_by.get(moderator_id)
+
+    def ticket_for_thread(self, thread_id):
+        return self.ticket_of.get(self.threads.get(thread_id))
+
+    def register_mod_channel(self, guild_id, channel_id):
+        self.mod_channels[guild_id] = channel_id
+
+    def mod_channel_id(self, guild_id):
+        return self.mod_channels.get(guild_id)
+
+    def route(self, channel_id, moderator_id, content, thread=False):
+        """
+        Works out which ticket a moderator's message is for: the ticket of the
+        thread it was sent in, an explicit "#<ticket>" prefix, the moderator's
+        current claim, or else the next report in the queue. Returns
+        (ticket, remaining content), with ticket None if nothing is waiting;
+        raises ClaimError if the addressed ticket belongs to someone else, and
+        UnknownThreadError for a message in a thread (`thread=True`) with no
+        open report, rather than handing it the next report.
+        """
+        ticket = self.ticket_for_thread(channel_id)
+        if thread and ticket is None:
+            raise UnknownThreadError(channel_id)
+        match = TICKET_PATTERN.match(content)
+        if (
+            ticket is None
+            and match
+            and self.report_key(int(match.group(1))) is not None
+        ):
+            ticket = int(match.group(1))
+            content = match.group(2)
+        if ticket is not None:
+            self.claim(ticket, moderator_id)
+            return ticket, content
+        ticket = self.claim_of(moderator_id)
+        if ticket is None:
+            ticket = self.claim_next(moderator_id)
+        return ticket, content
+
+    def waiting(self, limit=10):
+        """
+        The next `limit` unclaimed tickets in priority order.
+        """
+        return [
+            ticket
+            for key, ticket in heapq.nsmallest(limit, set(self.heap))
+            if self._is_waiting(key, ticket)
+        ]
+
+    def close(self):
+        pass
+
+
+class SharedReviewQueue(ReviewQueue):
+    """
+    ReviewQueue kept in a SQLite database (WAL mode) so that every bot process
+    of a sharded deployment works from the same queue, claims and mod channel
+    directory. Claims run in `BEGIN IMMEDIATE` transactions, so two
+    processes can never hand the same report to different moderators.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS review_queue ("
+                "ticket INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "report_key INTEGER UNIQUE, "
+                "urgent INTEGER, score REAL, created_at REAL, "
+                "moderator_id INTEGER, thread_id INTEGER)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS review_order ON review_queue "
+                "(moderator_id, urgent, score, created_at)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS mod_channels "
+                "(guild_id INTEGER PRIMARY KEY, channel_id INTEGER)"
+            )
+
+    @contextmanager
+    def _transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def _one(self, query, args=()):
+        row = self.db.execute(query, args).fetchone()
+        return row[0] if row else None
+
+    def __len__(self):
+        return self._one("SELECT COUNT(*) FROM review_queue WHERE moderator_id IS NULL")
+
+    def enqueue(self, report_key, report):
+        urgent, score, created_at = self.priority(report)
+        with self._transaction():
+            self.db.execute(
+                "INSERT INTO review_queue (report_key, urgent, score, created_at) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (report_key) DO UPDATE SET "
+                "urgent = excluded.urgent, score = excluded.score",
+                (report_key, urgent, score, created_at),
+            )
+            return self._one(
+                "SELECT ticket FROM review_queue WHERE report_key = ?", (report_key,)
+            )
+
+    def claim_next(self, moderator_id):
+        with self._transaction():
+            ticket = self._one(
+                "SELECT ticket FROM review_queue WHERE moderator_id IS NULL "
+                "ORDER BY urgent, score, created_at LIMIT 1"
+            )
+            if ticket is not None:
+                self._assign(ticket, moderator_id)
+            return ticket
+
+    def claim(self, ticket, moderator_id):
+        with self._transaction():
+            row = self.db.execute(
+                "SELECT moderator_id FROM review_queue WHERE ticket = ?", (ticket,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(ticket)
+            if row[0] is not None and row[0] != moderator_id:
+                raise ClaimError(ticket, row[0])
+            self._assign(ticket, moderator_id)
+
+    def _assign(self, ticket, moderator_id):
+        # Runs inside the caller's transaction
+        self.db.execute(
+            "UPDATE review_queue SET moderator_id = NULL "
+            "WHERE moderator_id = ? AND ticket != ?",
+            (moderator_id, ticket),
+        )
+        self.db.execute(
+            "UPDATE review_queue SET moderator_id = ? WHERE ticket = ?",
+            (moderator_id, ticket),
+        )
+
+    def release(self, ticket):
+        self.db.execute(
+            "UPDATE review_queue SET moderator_id = NULL WHERE ticket = ?", (ticket,)
+        )
+
+    def complete(self, ticket):
+        self.db.execute("DELETE FROM review_queue WHERE ticket = ?", (ticket,))
+
+    def attach_thread(self, ticket, thread_id):
+        self.db.execute(
+            "UPDATE review_queue SET thread_id = ? WHERE ticket = ?",
+            (thread_id, ticket),
+        )
+
+    def report_key(self, ticket):
+        return self._one(
+            "SELECT report_key FROM review_queue WHERE ticket = ?", (ticket,)
+        )
+
+    def claim_of(self, moderator_id):
+        return self._one(
+            "SELECT ticket FROM review_queue WHERE moderator_id = ?", (moderator_id,)
+        )
+
+    def ticket_for_thread(self, thread_id):
+        return self._one(
+            "SELECT ticket FROM review_queue WHERE thread_id = ?", (thread_id,)
+        )
+
+    def register_mod_channel(self, guild_id, channel_id):
+        self.db.execute(
+            "INSERT OR REPLACE INTO mod_channels VALUES (?, ?)", (guild_id, channel_id)
+        )
+
+    def mod_channel_id(self, guild_id):
+        return self._one(
+            "SELECT channel_id FROM mod_channels WHERE guild_id = ?", (guild_id,)
+        )
+
+    def waiting(self, limit=10):
+        rows = self.db.execute(
+            "SELECT ticket FROM review_queue WHERE moderator_id IS NULL "
+            "ORDER BY urgent, score, created_at LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,164 @@
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+
+# Each user keeps their last RISK_WINDOW score vectors. Only the part of a
+# score above RISK_FLOOR counts, and risk is the decayed sum of those excesses
+# (per attribute, halving every RISK_HALF_LIFE seconds), so a run of
+# borderline messages can cross RISK_THRESHOLD even though none of them would
+# be auto-flagged alone, while any number of ordinary messages can't: with
+# the defaults, scores at or below 0.375 never add up to the threshold.
+RISK_WINDOW = int(os.getenv("RISK_WINDOW", "20"))
+RISK_HALF_LIFE = float(os.getenv("RISK_HALF_LIFE", "600"))
+RISK_THRESHOLD = float(os.getenv("RISK_THRESHOLD", "1.5"))
+RISK_FLOOR = float(os.getenv("RISK_FLOOR", "0.3"))
+RISK_MAX_USERS = int(os.getenv("RISK_MAX_USERS", "200000"))
+RISK_IDLE_TTL = float(os.getenv("RISK_IDLE_TTL", "3600"))
+
+ATTRIBUTES = ("toxicity", "sexually_explicit", "threat")
+
+
+class RiskWindow:
+    """
+    Per-user sliding windows of score vectors held in preallocated NumPy ring
+    buffers: user i's last `window` scores are row i of a
+    (users, window, attributes) array. Adding a score is O(window), and
+    `aggregate` computes decayed risk for every tracked user in one vectorized
+    pass. Rows are handed out least-recently-active first once `max_users` is
+    reached, and users idle for `idle_ttl` seconds are dropped.
+    """
+
+    def __init__(
+        self,
+        window=RISK_WINDOW,
+        half_life=RISK_HALF_LIFE,
+        threshold=RISK_THRESHOLD,
+        floor=RISK_FLOOR,
+        max_users=RISK_MAX_USERS,
+        idle_ttl=RISK_IDLE_TTL,
+        initial_capacity=1024,
+    ):
+        self.window = window
+        self.half_life = half_life
+        self.threshold = threshold
+        self.floor = floor
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.epoch = time.time()  # Times are stored as float32 offsets from this
+        self.slots = OrderedDict()  # Map from user ID to row, least recent first
+        capacity = min(initial_capacity, max_users)
+        self.scores = np.zeros((capacity, window, len(ATTRIBUTES)), np.float32)
+        self.times = np.full((capacity, window), -np.inf, np.float32)
+        self.heads = np.zeros(capacity, np.int32)  # Next row position to write
+        self.free = list(range(capacity - 1, -1, -1))
+        self.evicted = 0
+        self.flagged = 0
+
+    def _grow(self):
+        size = len(self.heads)
+        extra = min(size * 2, self.max_users) - size
+        self.scores = np.concatenate(
+            [self.scores, np.zeros((extra,) + self.scores.shape[1:], np.float32)]
+        )
+        self.times = np.concatenate(
+            [self.times, np.full((extra, self.window), -np.inf, np.float32)]
+        )
+        self.heads = np.concatenate([self.heads, np.zeros(extra, np.int32)])
+        self.free += range(size + extra - 1, size - 1, -1)
+
+    def _slot(self, user_id, now):
+        slot = self.slots.get(user_id)
+        if slot is not None:
+            self.slots.move_to_end(user_id)
+            return slot
+        self.evict_idle(now)
+        if not self.free and len(self.scores) < self.max_users:
+            self._grow()
+        if self.free:
+            slot = self.free.pop()
+        else:
+            # Full: reuse the row of the least recently active user
+            _, slot = self.slots.popitem(last=False)
+            self.evicted += 1
+        self._clear(slot)
+        self.slots[user_id] = slot
+        return slot
+
+    def _clear(self, slot):
+        self.scores[slot] = 0
+        self.times[slot] = -np.inf
+        self.heads[slot] = 0
+
+    def _weights(self, times, now):
+        return np.exp2((times - (now - self.epoch)) / self.half_life)
+
+    def add(self, user_id, scores, now=None):
+        """
+        Records one message's scores (a dict keyed by attribute) and returns
+        the user's current risk: the highest decayed sum of attribute scores
+        above the floor.
+        """
+        now = time.time() if now is None else now
+        slot = self._slot(user_id, now)
+        head = self.heads[slot]
+        self.scores[slot, head] = [max(0.0, scores[a] - self.floor) for a in ATTRIBUTES]
+        self.times[slot, head] = now - self.epoch
+        self.heads[slot] = (head + 1) % self.window
+        weights = self._weights(self.times[slot], now)
+        return float((weights @ self.scores[slot]).max())
+
+    def check(self, user_id, scores, now=None):
+        """
+        Adds the scores and returns the user's risk if it crossed the
+        threshold, or None. A flagged user's window starts over, so they are
+        not flagged again by every following message.
+        """
+        risk = self.add(user_id, scores, now)
+        if risk < self.threshold:
+            return None
+        self._clear(self.slots[user_id])
+        self.flagged += 1
+        return risk
+
+    def aggregate(self, now=None):
+        """
+        Risk per attribute for every tracked user, as (user IDs, array of shape
+        (users, attributes)).
+        """
+        now = time.time() if now is None else now
+        users = list(self.slots)
+        rows = np.fromiter(self.slots.values(), np.int64, len(users))
+        weights = self._weights(self.times[rows], now)
+        return users, np.einsum("uw,uwa->ua", weights, self.scores[rows])
+
+    def riskiest(self, limit=10, now=None):
+        users, risks = self.aggregate(now)
+        if not users:
+            return []
+        risk = risks.max(axis=1)
+        order = np.argsort(risk)[::-1][:limit]
+        return [(users[i], float(risk[i])) for i in order]
+
+    def evict_idle(self, now=None):
+        now = time.time() if now is None else now
+        cutoff = now - self.epoch - self.idle_ttl
+        while self.slots:
+            user_id, slot = next(iter(self.slots.items()))
+            last = self.times[slot, (self.heads[slot] - 1) % self.window]
+            if last >= cutoff:
+                break
+            del self.slots[user_id]
+            self.free.append(slot)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def stats(self):
+        return {
+            "users": len(self.slots),
+            "capacity": len(self.scores),
+            "bytes": self.scores.nbytes + self.times.nbytes + self.heads.nbytes,
+            "evicted": self.evicted,
+            "flagged": self.flagged,
+        }
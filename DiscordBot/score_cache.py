@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    Normalizes text so trivially different copies (case, spacing, unicode
+    compatibility forms) map to the same cache entry.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def text_key(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class ScoreCache:
+    """
+    Bounded LRU cache of scoring results keyed by a hash of the normalized text.
+    Entries expire after `ttl` seconds. If `path` is given, entries are also
+    written to an on-disk SQLite tier so a restarted bot starts warm. Disk
+    writes are batched and committed from a worker thread every
+    `flush_interval` seconds, which also drops expired rows and keeps at most
+    `max_rows` of them.
+    """
+
+    def __init__(
+        self, max_size=10000, ttl=3600, path=None, flush_interval=2, max_rows=100000
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.entries = OrderedDict()  # Map from key to (expires_at, value)
+        self.pending = {}  # Map from key to the row not yet written to disk
+        self.flush_handle = None
+        self.flush_lock = threading.Lock()
+        self.pending_lock = threading.Lock()  # Held only to add or swap rows
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.db = None
+        self.writer = None
+        if path:
+            self.db = sqlite3.connect(path)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS scores "
+                "(key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS scores_expires_at ON scores (expires_at)"
+            )
+            self.db.commit()
+            # Separate connection for the flush thread; WAL lets reads go on
+            # while it writes
+            self.writer = sqlite3.connect(path, check_same_thread=False)
+            self.writer.execute("PRAGMA synchronous=NORMAL")
+            self._prune()
+
+    def get(self, text):
+        key = text_key(text)
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+
+        if self.db is not None:
+            row = self.pending.get(key)
+            if row is None:
+                row = self.db.execute(
+                    "SELECT key, value, expires_at FROM scores WHERE key = ?", (key,)
+                ).fetchone()
+            if row and row[2] > now:
+                value = json.loads(row[1])
+                self._insert(key, row[2], value)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, text, value):
+        key = text_key(text)
+        expires_at = time.time() + self.ttl
+        self._insert(key, expires_at, value)
+        if self.db is None:
+            return
+        with self.pending_lock:
+            self.pending[key] = (key, json.dumps(value), expires_at)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not called from the bot (e.g. preloading); write in batches
+            if len(self.pending) >= 1000:
+                self.flush()
+            return
+        if self.flush_handle is None:
+            self.flush_handle = loop.call_later(
+                self.flush_interval, self._flush_in_thread, loop
+            )
+
+    def _flush_in_thread(self, loop):
+        self.flush_handle = None
+        loop.run_in_executor(None, self.flush)
+
+    def flush(self):
+        """
+        Writes pending entries to disk in one transaction and prunes the table.
+        """
+        with self.flush_lock:
+            if self.writer is None:
+                return  # Closed
+            with self.pending_lock:
+                rows, self.pending = self.pending, {}
+            if rows:
+                self.writer.executemany(
+                    "INSERT OR REPLACE INTO scores VALUES (?, ?, ?)", rows.values()
+                )
+            self._prune()
+
+    def _prune(self):
+        # The newest max_rows rows by expiry survive
+        self.writer.execute(
+            "DELETE FROM scores WHERE expires_at < ? OR expires_at <= "
+            "(SELECT expires_at FROM scores ORDER BY expires_at DESC "
+            "LIMIT 1 OFFSET ?)",
+            (time.time(), self.max_rows),
+        )
+        self.writer.commit()
+
+    def _insert(self, key, expires_at, value):
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.db is not None:
+            self.flush()
+            with self.flush_lock:
+                self.writer.close()
+                self.writer = None
+            self.db.close()
+            self.db = None
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from metrics import metrics
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger("send_queue")
+
+# Discord allows about 5 messages per 5 seconds in a channel and 50 requests a
+# second overall; sends are paced to stay under both instead of hitting 429s.
+DISCORD_MESSAGE_LIMIT = 2000
+SEND_CHANNEL_RATE = float(os.getenv("SEND_CHANNEL_RATE", "1"))
+SEND_CHANNEL_BURST = float(os.getenv("SEND_CHANNEL_BURST", "5"))
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "50"))
+# How often state of channels with nothing queued is dropped
+PRUNE_INTERVAL = 60
+
+
+def split_message(content, limit=DISCORD_MESSAGE_LIMIT):
+    """
+    Splits text longer than Discord's message limit, at a line break where
+    possible.
+    """
+    pieces = []
+    while len(content) > limit:
+        cut = content.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        pieces.append(content[:cut])
+        content = content[cut:].lstrip("\n")
+    pieces.append(content)
+    return pieces
+
+
+def _consume(future):
+    # Callers that don't wait on a send shouldn't get "exception never retrieved"
+    if not future.cancelled():
+        future.exception()
+
+
+class OutboundDispatcher:
+    """
+    Per-channel outbound message queues. `send` queues a message and returns a
+    future for the Discord message it ends up in, so handlers don't have to
+    wait on each send. Each channel has its own worker, so channels are
+    served in parallel while order within a channel is kept. Consecutive
+    queued messages sent with `merge=True` are merged into one up to the
+    2000-character limit; other messages are always sent on their own, so
+    callers that use the returned message get one with only their content.
+    Sends are paced by per-channel and global token buckets.
+    """
+
+    def __init__(
+        self,
+        channel_rate=SEND_CHANNEL_RATE,
+        channel_burst=SEND_CHANNEL_BURST,
+        global_rate=SEND_GLOBAL_RATE,
+        limit=DISCORD_MESSAGE_LIMIT,
+    ):
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.limit = limit
+        self.queues = {}  # Map from channel ID to deque of (content, future, merge)
+        self.buckets = {}  # Map from channel ID to its TokenBucket
+        self.workers = {}  # Map from channel ID to its worker task
+        self.sent = 0
+        self.merged = 0
+        self.last_prune = time.monotonic()
+
+    def send(self, channel, content, merge=False):
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume)
+        pieces = split_message(str(content), self.limit)
+        queue = self.queues.setdefault(channel.id, deque())
+        for piece in pieces[:-1]:
+            queue.append((piece, None, merge))
+        queue.append((pieces[-1], future, merge))
+        worker = self.workers.get(channel.id)
+        if worker is None or worker.done():
+            self._maybe_prune()
+            self.workers[channel.id] = asyncio.create_task(self._run(channel))
+        return future
+
+    def pending(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def _maybe_prune(self):
+        """
+        Drops the worker and rate limit state of channels that have nothing
+        queued and whose bucket has refilled, so idle channels don't pile up.
+        """
+        now = time.monotonic()
+        if now - self.last_prune < PRUNE_INTERVAL:
+            return
+        self.last_prune = now
+        for channel_id in list(self.workers):
+            if self.workers[channel_id].done() and channel_id not in self.queues:
+                del self.workers[channel_id]
+        for channel_id, bucket in list(self.buckets.items()):
+            if channel_id not in self.queues and bucket.full():
+                del self.buckets[channel_id]
+
+    def _next_batch(self, queue):
+        content, future, merge = queue.popleft()
+        parts, futures = [content], [future]
+        size = len(content)
+        while (
+            merge
+            and queue
+            and queue[0][2]
+            and size + 1 + len(queue[0][0]) <= self.limit
+        ):
+            content, future, _ = queue.popleft()
+            parts.append(content)
+            futures.append(future)
+            size += 1 + len(content)
+        self.merged += len(parts) - 1
+        return "\n".join(parts), [f for f in futures if f is not None]
+
+    async def _wait_for_token(self, bucket):
+        while not bucket.try_take():
+            await asyncio.sleep(bucket.time_until_token())
+
+    async def _run(self, channel):
+        queue = self.queues[channel.id]
+        bucket = self.buckets.get(channel.id)
+        if bucket is None:
+            bucket = self.buckets[channel.id] = TokenBucket(
+                self.channel_rate, self.channel_burst
+            )
+        while queue:
+            await self._wait_for_token(bucket)
+            await self._wait_for_token(self.global_bucket)
+            # Take the batch only now, so messages queued while waiting join it
+            content, futures = self._next_batch(queue)
+            try:
+                with metrics.span("discord_send"):
+                    sent = await channel.send(content)
+            except Exception as e:
+                logger.warning(
+                    "Could not send message to channel %s: %s", channel.id, e
+                )
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.sent += 1
+            for future in futures:
+                if not future.done():
+                    future.set_result(sent)
+        del self.queues[channel.id]
+
+    async def close(self):
+        """
+        Waits for all queued messages to be sent.
+        """
+        workers = [w for w in self.workers.values() if not w.done()]
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+        self.workers.clear()
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from report import REVIEW_STATES, Report
+
+# Sessions untouched for SESSION_TTL seconds are dropped entirely, unless a
+# moderator has yet to review them; hot copies idle for SESSION_HOT_TTL
+# seconds are evicted from memory but stay on disk.
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.sqlite")
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+SESSION_HOT_TTL = float(os.getenv("SESSION_HOT_TTL", "1800"))
+SESSION_MAX_HOT = int(os.getenv("SESSION_MAX_HOT", "1000"))
+# Writes are committed in batches every SESSION_COMMIT_INTERVAL seconds, so a
+# crash can lose at most that much. Shared stores commit every write, since
+# other processes only see committed sessions.
+SESSION_COMMIT_INTERVAL = float(os.getenv("SESSION_COMMIT_INTERVAL", "1"))
+EVICT_INTERVAL = 60
+
+# A session is live if it was used within the TTL or is still waiting on a
+# moderator: the review queue refers to it until the review is complete.
+LIVE = "(updated_at > ? OR json_extract(data, '$.state') IN (%s))" % ", ".join(
+    f"'{state.name}'" for state in REVIEW_STATES
+)
+
+
+class SessionStore:
+    """
+    Durable store of in-flight Report sessions keyed by user ID, used like the
+    dict it replaces. Every change is written through to an embedded SQLite
+    database in WAL mode and committed within `commit_interval` seconds, so
+    a restart loses at most that much; recently used reports are also kept
+    in memory, and sessions are restored lazily the next time they are
+    looked up. Call `save(key)` after mutating a report.
+
+    With `shared=True` several processes can use the same database: a hot
+    copy is only reused while its stored version is still the latest.
+    """
+
+    def __init__(
+        self,
+        client,
+        path=SESSION_DB_PATH,
+        ttl=SESSION_TTL,
+        hot_ttl=SESSION_HOT_TTL,
+        max_hot=SESSION_MAX_HOT,
+        shared=False,
+        commit_interval=SESSION_COMMIT_INTERVAL,
+    ):
+        self.client = client
+        self.ttl = ttl
+        self.hot_ttl = hot_ttl
+        self.max_hot = max_hot
+        self.shared = shared
+        self.commit_interval = commit_interval
+        self.commit_handle = None
+        # Map from key to (report, last access time, stored updated_at)
+        self.hot = OrderedDict()
+        self.last_eviction = time.monotonic()
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions "
+            "(key INTEGER PRIMARY KEY, data TEXT, updated_at REAL)"
+        )
+        self.db.commit()
+
+    def __contains__(self, key):
+        if key in self.hot and not self.shared:
+            return True
+        row = self.db.execute(
+            f"SELECT 1 FROM sessions WHERE key = ? AND {LIVE}",
+            (key, time.time() - self.ttl),
+        ).fetchone()
+        return row is not None
+
+    def __getitem__(self, key):
+        report = self.get(key)
+        if report is None:
+            raise KeyError(key)
+        return report
+
+    def __setitem__(self, key, report):
+        self.save(key, report)
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def keys(self):
+        rows = self.db.execute(
+            f"SELECT key FROM sessions WHERE {LIVE}",
+            (time.time() - self.ttl,),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get(self, key, default=None):
+        self._maybe_evict()
+        if key in self.hot and not self.shared:
+            report, _, updated_at = self.hot[key]
+            self._touch(key, report, updated_at)
+            return report
+        row = self.db.execute(
+            f"SELECT data, updated_at FROM sessions WHERE key = ? AND {LIVE}",
+            (key, time.time() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return default
+        if key in self.hot and self.hot[key][2] == row[1]:
+            report = self.hot[key][0]  # No other process has changed it
+        else:
+            report = Report.from_dict(self.client, json.loads(row[0]))
+        self._touch(key, report, row[1])
+        return report
+
+    def save(self, key, report=None):
+        """
+        Writes the current state of a session through to disk.
+        """
+        report = report or self.hot[key][0]
+        updated_at = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+            (key, json.dumps(report.to_dict()), updated_at),
+        )
+        self.commit_soon()
+        self._touch(key, report, updated_at)
+
+    def pop(self, key, default=None):
+        report = self.get(key, default)
+        self.hot.pop(key, None)
+        self.db.execute("DELETE FROM sessions WHERE key = ?", (key,))
+        self.commit_soon()
+        return report
+
+    def commit_soon(self):
+        if self.shared or self.commit_interval <= 0:
+            self.db.commit()
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.db.commit()  # Not called from the bot
+            return
+        if self.commit_handle is None:
+            self.commit_handle = loop.call_later(self.commit_interval, self.commit)
+
+    def commit(self):
+        if self.commit_handle is not None:
+            self.commit_handle.cancel()
+            self.commit_handle = None
+        self.db.commit()
+
+    def _touch(self, key, report, updated_at):
+        self.hot[key] = (report, time.monotonic(), updated_at)
+        self.hot.move_to_end(key)
+        while len(self.hot) > self.max_hot:
+            self.hot.popitem(last=False)  # Already persisted
+
+    def _maybe_evict(self):
+        now = time.monotonic()
+        if now - self.last_eviction < EVICT_INTERVAL:
+            return
+        self.last_eviction = now
+        self.evict_idle()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        while self.hot:
+            key, (_, last_access, _) = next(iter(self.hot.items()))
+            if now - last_access < self.hot_ttl:
+                break
+            del self.hot[key]
+        self.db.execute(
+            f"DELETE FROM sessions WHERE NOT {LIVE}", (time.time() - self.ttl,)
+        )
+        self.commit_soon()
+
+    def close(self):
+        self.commit()
+        self.db.close()
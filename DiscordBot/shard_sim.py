@@ -0,0 +1,277 @@
+"""
+Runs a sharded ModBot deployment on one machine without connecting to Discord.
+Each process serves one fake guild, as one shard of a real deployment would,
+and all of them share the SQLite session and review-queue store. Checks that
+auto-flags go to the mod channel of their own guild, that a report filed over
+DM on one shard can be reviewed from another, and that concurrent moderators
+on different processes never review the same report twice.
+
+    python shard_sim.py --processes 3 --reports 30
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+from collections import Counter
+from types import SimpleNamespace
+
+GROUP = 27
+BOT_ID = 1
+GUILD_BASE = 1000  # Guild i has ID GUILD_BASE + i
+MOD_CHANNEL_BASE = 2000
+GROUP_CHANNEL_BASE = 3000
+REPORTED_MESSAGE_ID = 4000
+MODERATOR_BASE = 5000
+USER_BASE = 6000
+MESSAGE_BASE = 10**9  # Process i numbers its messages from MESSAGE_BASE * (i + 1)
+message_ids = itertools.count(MESSAGE_BASE)
+
+
+class SimChannel:
+    """
+    Text channel that appends what the bot sends to a log shared by all
+    processes, and holds one message that can be reported.
+    """
+
+    def __init__(self, channel_id, name, log_path, process):
+        self.id = channel_id
+        self.name = name
+        self.log_path = log_path
+        self.process = process
+
+    async def send(self, content):
+        with open(self.log_path, "a") as f:
+            f.write(
+                json.dumps(
+                    {"process": self.process, "channel": self.id, "content": content}
+                )
+                + "\n"
+            )
+        return SimpleNamespace(id=None, content=content)
+
+    async def fetch_message(self, message_id):
+        return SimpleNamespace(
+            id=message_id,
+            content="you will regret this",
+            author=SimpleNamespace(id=USER_BASE - 1, name="offender"),
+            attachments=[],
+        )
+
+
+def make_guild(index, log_path, process):
+    guild_id = GUILD_BASE + index
+    channels = {
+        MOD_CHANNEL_BASE
+        + index: SimChannel(
+            MOD_CHANNEL_BASE + index, f"group-{GROUP}-mod", log_path, process
+        ),
+        GROUP_CHANNEL_BASE
+        + index: SimChannel(
+            GROUP_CHANNEL_BASE + index, f"group-{GROUP}", log_path, process
+        ),
+    }
+    return SimpleNamespace(
+        id=guild_id,
+        name=f"guild {index}",
+        text_channels=list(channels.values()),
+        get_channel=channels.get,
+    )
+
+
+def make_message(content, author_id, channel, guild=None):
+    return SimpleNamespace(
+        id=next(message_ids),
+        content=content,
+        author=SimpleNamespace(id=author_id, name=f"user {author_id}"),
+        channel=channel,
+        guild=guild,
+        attachments=[],
+    )
+
+
+def message_link(guild_index):
+    return (
+        f"https://discord.com/channels/{GUILD_BASE + guild_index}/"
+        f"{GROUP_CHANNEL_BASE + guild_index}/{REPORTED_MESSAGE_ID}"
+    )
+
+
+async def fake_eval_text(
+    message, use_prefilter=False, priority=None, budget=None, degrade=False
+):
+    score = 0.9 if "THREAT" in message else 0.0
+    return {
+        "attributeScores": {
+            name: {"summaryScore": {"value": score}}
+            for name in ["THREAT", "TOXICITY", "SEXUALLY_EXPLICIT"]
+        }
+    }
+
+
+def make_bot(index, processes, log_path):
+    import bot
+
+    bot.eval_text = fake_eval_text  # No Perspective calls
+    guild = make_guild(index, log_path, index)
+
+    class SimBot(bot.ModBot):
+        user = SimpleNamespace(id=BOT_ID, name=f"Group {GROUP} Bot")
+        guilds = [guild]
+
+        def get_guild(self, guild_id):
+            return guild if guild_id == guild.id else None
+
+        def get_partial_messageable(self, channel_id, guild_id=None):
+            return SimChannel(channel_id, "remote", log_path, index)
+
+    client = SimBot(
+        group_num=GROUP,
+        guild_id=GUILD_BASE,
+        shard_ids=[index],
+        shard_count=processes,
+        shared=True,
+        metrics_port=0,
+    )
+    client.register_guild(guild)
+    return client, guild
+
+
+async def drain(client):
+    await client.drain_outbox()
+
+
+async def run_worker(index, processes, reports, log_path, barrier):
+    global message_ids
+    message_ids = itertools.count(MESSAGE_BASE * (index + 1))
+    client, guild = make_bot(index, processes, log_path)
+    await client.report_store.ensure_indexes()
+    mod_channel, group_channel = guild.text_channels
+    await asyncio.to_thread(barrier.wait)  # All mod channels are registered
+
+    # Auto-flag a message in this guild's group channel
+    await client.on_message(
+        make_message("THREAT from guild", USER_BASE - 2 - index, group_channel, guild)
+    )
+
+    # Process 0 serves DMs: file reports against messages in every guild
+    if index == 0:
+        dm = SimChannel(0, "dm", log_path, index)
+        for i in range(reports):
+            user_id = USER_BASE + i
+            replies = ["report", message_link(i % processes), "yes", "spam"]
+            replies += ["details", "no", "no", "yes"]
+            for content in replies:
+                await client.on_message(make_message(content, user_id, dm))
+    await drain(client)
+    await asyncio.to_thread(barrier.wait)  # All reports are queued
+
+    # Every process has a moderator working through the shared queue
+    moderator_id = MODERATOR_BASE + index
+    while True:
+        await client.on_message(make_message("claim", moderator_id, mod_channel, guild))
+        if client.review_queue.claim_of(moderator_id) is None:
+            break
+        await client.on_message(make_message("yes", moderator_id, mod_channel, guild))
+    await drain(client)
+    await client.report_store.flush()
+    client.reports.close()
+    client.review_queue.close()
+
+
+def worker(index, processes, reports, log_path, barrier):
+    asyncio.run(run_worker(index, processes, reports, log_path, barrier))
+
+
+def check(log_path, processes, reports):
+    with open(log_path) as f:
+        sent = [json.loads(line) for line in f]
+    problems = []
+
+    for index in range(processes):
+        alerts = [
+            s
+            for s in sent
+            if "auto-flagged" in s["content"] and "THREAT from guild" in s["content"]
+        ]
+        if not any(s["channel"] == MOD_CHANNEL_BASE + index for s in alerts):
+            problems.append(f"no auto-flag alert in the mod channel of guild {index}")
+    stray = [s for s in sent if "auto-flagged" in s["content"] and s["channel"] < 2000]
+    if stray:
+        problems.append(f"{len(stray)} alerts outside mod channels")
+
+    submitted = Counter()
+    for s in sent:
+        for line in s["content"].split("\n"):  # Sends may have been merged
+            if line.startswith("Report #") and "submitted" in line:
+                submitted[s["channel"]] += 1
+    for index in range(processes):
+        expected = len(range(index, reports, processes))
+        if submitted[MOD_CHANNEL_BASE + index] < expected:
+            problems.append(
+                f"guild {index} mod channel got {submitted[MOD_CHANNEL_BASE + index]} "
+                f"of {expected} submitted reports"
+            )
+
+    reviewed = Counter()
+    reviewers = Counter()
+    for s in sent:
+        for line in s["content"].split("\n"):
+            if line.startswith("Thank you for your review of report #"):
+                reviewed[line] += 1
+                reviewers[s["process"]] += 1
+    twice = [line for line, n in reviewed.items() if n > 1]
+    if twice:
+        problems.append(f"{len(twice)} reports reviewed more than once")
+    # Every DM report plus one auto-flag per guild
+    if len(reviewed) != reports + processes:
+        problems.append(f"{len(reviewed)} of {reports + processes} reports reviewed")
+    return problems, reviewers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--reports", type=int, default=20)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="shard_sim_")
+    log_path = os.path.join(directory, "sent.jsonl")
+    # Inherited by the spawned processes, before they import the bot
+    os.environ["SESSION_DB_PATH"] = os.path.join(directory, "shared.sqlite")
+    os.environ["REPORT_SPOOL_PATH"] = os.path.join(directory, "spool.jsonl")
+    os.environ["MONGO_BACKEND"] = "memory"
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["SHARD_PROCESSES"] = str(args.processes)
+
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(args.processes)
+    processes = [
+        context.Process(
+            target=worker, args=(i, args.processes, args.reports, log_path, barrier)
+        )
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    if any(process.exitcode for process in processes):
+        raise SystemExit("A shard process failed")
+
+    problems, reviewers = check(log_path, args.processes, args.reports)
+    print(f"Reviews per process: {dict(sorted(reviewers.items()))}")
+    if problems:
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        raise SystemExit(1)
+    print(
+        f"OK: {args.processes} processes, {args.reports} DM reports, state in {directory}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Reports the import time and resident memory of each module the bot loads at
+startup, so cold-start cost can be tracked as a number.
+
+    python startup_profile.py            # modules imported by bot.py
+    python startup_profile.py --model    # also load the deepfake model
+    python startup_profile.py --json
+"""
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+
+# Imported in the same order as bot.py
+STARTUP_MODULES = [
+    "discord",
+    "pymongo",
+    "dotenv",
+    "requests",
+    "aiohttp",
+    "image_fetch",
+    "image_hash",
+    "image_preprocess",
+    "metrics",
+    "deepfake_detector",
+    "rate_limiter",
+    "prefilter",
+    "score_cache",
+    "circuit_breaker",
+    "perspective_api",
+    "text_detector",
+    "report",
+    "memory_mongo",
+    "report_store",
+    "session_store",
+    "review_queue",
+    "send_queue",
+    "risk_window",
+    "near_duplicates",
+    "log_setup",
+]
+
+
+def rss_mb():
+    """
+    Current resident set size of this process in MB.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+
+        # ru_maxrss is the peak, in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def measure(label, fn):
+    before_rss = rss_mb()
+    start = time.perf_counter()
+    error = None
+    try:
+        fn()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return {
+        "module": label,
+        "seconds": time.perf_counter() - start,
+        "rss_mb": rss_mb(),
+        "rss_delta_mb": rss_mb() - before_rss,
+        "error": error,
+    }
+
+
+def profile(modules=STARTUP_MODULES, load_model=False):
+    results = [measure(m, lambda m=m: importlib.import_module(m)) for m in modules]
+    if load_model:
+        results.append(
+            measure(
+                "deepfake model",
+                lambda: importlib.import_module("deepfake_detector").get_pipeline(),
+            )
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", action="store_true", help="load the model too")
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    start_rss = rss_mb()
+    results = profile(load_model=args.model)
+    total = sum(r["seconds"] for r in results)
+
+    if args.json:
+        print(json.dumps({"modules": results, "total_seconds": total}, indent=2))
+        return
+    print(f"{'module':<20} {'seconds':>8} {'rss MB':>8} {'delta MB':>9}")
+    for r in results:
+        line = f"{r['module']:<20} {r['seconds']:>8.3f} {r['rss_mb']:>8.1f} {r['rss_delta_mb']:>9.1f}"
+        if r["error"]:
+            line += f"  ({r['error']})"
+        print(line)
+    print(f"{'total':<20} {total:>8.3f} {rss_mb():>8.1f} {rss_mb() - start_rss:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
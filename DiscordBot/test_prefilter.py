@@ -0,0 +1,17 @@
+from prefilter import BENIGN, SUSPICIOUS, PreFilter
+
+
+def test_one_word_insults_are_not_cleared():
+    prefilter = PreFilter()
+    for text in ["idiot", "loser", "moron!", "whore", "ur next", "u r trash"]:
+        assert prefilter.classify(text) != BENIGN, text
+
+
+def test_harmless_short_messages_are_cleared():
+    prefilter = PreFilter()
+    for text in ["ok", "lol", "thanks!", "ok ok", "lol thanks", "👍👍", ":)"]:
+        assert prefilter.classify(text) == BENIGN, text
+
+
+def test_keywords_are_suspicious():
+    assert PreFilter().classify("kys") == SUSPICIOUS
@@ -0,0 +1,28 @@
+from risk_window import RiskWindow
+
+
+def scores(value):
+    return {"toxicity": value, "sexually_explicit": 0.0, "threat": 0.0}
+
+
+def test_many_benign_messages_do_not_flag():
+    window = RiskWindow()
+    for i in range(500):
+        assert window.check("chatty", scores(0.1), now=1000 + i) is None
+    for i in range(500):
+        assert window.check("borderline", scores(0.35), now=1000 + i) is None
+
+
+def test_escalating_messages_flag():
+    window = RiskWindow()
+    values = (0.5, 0.6, 0.7, 0.8, 0.9)
+    risks = [window.check("user", scores(s), now=1000) for s in values]
+    assert risks[:4] == [None] * 4
+    assert risks[4] is not None
+
+
+def test_flagged_window_starts_over():
+    window = RiskWindow()
+    risks = [window.check("user", scores(0.8), now=1000) for _ in range(4)]
+    assert risks == [None, None, risks[2], None]
+    assert risks[2] is not None
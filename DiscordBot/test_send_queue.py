@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+import send_queue
+from send_queue import OutboundDispatcher
+
+
+class Channel:
+    def __init__(self, channel_id=1):
+        self.id = channel_id
+        self.sent = []
+
+    async def send(self, content):
+        self.sent.append(content)
+        return SimpleNamespace(content=content)
+
+
+def test_only_opted_in_messages_are_merged():
+    async def run():
+        outbox = OutboundDispatcher(channel_rate=1000, global_rate=1000)
+        channel = Channel()
+        alert = outbox.send(channel, "alert")
+        outbox.send(channel, "Report #1 submitted.")
+        outbox.send(channel, "first", merge=True)
+        outbox.send(channel, "second", merge=True)
+        outbox.send(channel, "last")
+        await outbox.close()
+        return channel.sent, (await alert).content
+
+    sent, alert = asyncio.run(run())
+    assert sent == ["alert", "Report #1 submitted.", "first\nsecond", "last"]
+    assert alert == "alert"
+
+
+def test_idle_channels_are_pruned(monkeypatch):
+    monkeypatch.setattr(send_queue, "PRUNE_INTERVAL", 0)
+
+    async def run():
+        outbox = OutboundDispatcher(channel_rate=1000, global_rate=1000)
+        for channel_id in range(100):
+            outbox.send(Channel(channel_id), "hi")
+        await outbox.close()
+        await asyncio.sleep(0.01)  # Every bucket refills
+        outbox.send(Channel(100), "hi")
+        await outbox.close()
+        return outbox
+
+    outbox = asyncio.run(run())
+    assert set(outbox.buckets) <= {100}
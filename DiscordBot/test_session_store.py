@@ -0,0 +1,23 @@
+import time
+from report import Report, State
+from session_store import SessionStore
+
+
+def make_report(state):
+    report = Report(None)
+    report.state = state
+    return report
+
+
+def test_expiry_keeps_sessions_waiting_for_review(tmp_path):
+    store = SessionStore(None, path=str(tmp_path / "s.db"), ttl=0.01)
+    store.save(1, make_report(State.MODERATOR_REVIEW))
+    store.save(-2, make_report(State.AUTO_FLAGGED))
+    store.save(3, make_report(State.AWAITING_MESSAGE))
+    time.sleep(0.05)
+    store.hot.clear()
+    store.evict_idle()
+    assert sorted(store.keys()) == [-2, 1]
+    assert store[1].state == State.MODERATOR_REVIEW
+    assert 3 not in store
+    store.close()
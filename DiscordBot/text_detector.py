@@ -0,0 +1,239 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from metrics import metrics
+from score_cache import ScoreCache
+
+# torch and transformers are imported on first use, as in deepfake_detector.
+# The default model is RoBERTa fine-tuned to tell GPT-2 output from human text.
+TEXT_DETECTOR_MODEL = os.getenv(
+    "TEXT_DETECTOR_MODEL", "openai-community/roberta-base-openai-detector"
+)
+# Label of the model's machine-generated class
+TEXT_DETECTOR_AI_LABEL = os.getenv("TEXT_DETECTOR_AI_LABEL", "Fake")
+TEXT_DETECTOR_WORKERS = int(os.getenv("TEXT_DETECTOR_WORKERS", "1"))
+TEXT_DETECTOR_THREADS = int(os.getenv("TEXT_DETECTOR_THREADS", "0"))
+TEXT_DETECTOR_MAX_BATCH = int(os.getenv("TEXT_DETECTOR_MAX_BATCH", "32"))
+TEXT_DETECTOR_MAX_WAIT_MS = float(os.getenv("TEXT_DETECTOR_MAX_WAIT_MS", "10"))
+# Texts are truncated to TEXT_DETECTOR_MAX_TOKENS. A batch is split into
+# forward passes of similar-length texts holding at most
+# TEXT_DETECTOR_BATCH_TOKENS tokens including padding.
+TEXT_DETECTOR_MAX_TOKENS = int(os.getenv("TEXT_DETECTOR_MAX_TOKENS", "256"))
+TEXT_DETECTOR_BATCH_TOKENS = int(os.getenv("TEXT_DETECTOR_BATCH_TOKENS", "4096"))
+TEXT_DETECTOR_CACHE_SIZE = int(os.getenv("TEXT_DETECTOR_CACHE_SIZE", "10000"))
+TEXT_DETECTOR_CACHE_TTL = float(os.getenv("TEXT_DETECTOR_CACHE_TTL", "86400"))
+
+_model = None
+_tokenizer = None
+
+
+def load_model(name=TEXT_DETECTOR_MODEL):
+    """
+    Loads the classifier and its tokenizer once per process. Raises if the
+    model has no TEXT_DETECTOR_AI_LABEL class, rather than scoring every
+    text as human-written.
+    """
+    global _model, _tokenizer
+    if _model is None:
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        model = AutoModelForSequenceClassification.from_pretrained(name).eval()
+        find_ai_label(model)
+        _tokenizer = AutoTokenizer.from_pretrained(name)
+        _model = model
+    return _model, _tokenizer
+
+
+def find_ai_label(model, name=TEXT_DETECTOR_AI_LABEL):
+    """
+    The model's label for machine-generated text, matched case-insensitively
+    by name.
+    """
+    labels = list(model.config.id2label.values())
+    for label in labels:
+        if label.lower() == name.lower():
+            return label
+    raise Exception(f"The model has no {name!r} label (labels: {labels})")
+
+
+def length_buckets(lengths, max_tokens):
+    """
+    Groups text indices into forward passes: texts are sorted by token count
+    and each pass takes the next texts while (texts x longest) stays within
+    `max_tokens`, so short texts aren't padded to the length of long ones.
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    buckets = []
+    bucket = []
+    for i in order:
+        # Sorted, so this text is the longest in the bucket if added
+        if bucket and (len(bucket) + 1) * lengths[i] > max_tokens:
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(i)
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+
+def classify_texts(
+    texts, max_length=TEXT_DETECTOR_MAX_TOKENS, max_tokens=TEXT_DETECTOR_BATCH_TOKENS
+):
+    """
+    Classifies texts with length-bucketed, dynamically padded forward passes.
+    Returns one list of {"label", "score"} dicts per text, highest score
+    first, in the input order.
+    """
+    import torch
+
+    model, tokenizer = load_model()
+    encoded = tokenizer(list(texts), truncation=True, max_length=max_length)
+    features = [
+        {key: encoded[key][i] for key in encoded.keys()} for i in range(len(texts))
+    ]
+    lengths = [len(f["input_ids"]) for f in features]
+    labels = model.config.id2label
+    results = [None] * len(texts)
+    for bucket in length_buckets(lengths, max_tokens):
+        batch = tokenizer.pad([features[i] for i in bucket], return_tensors="pt")
+        with torch.no_grad():
+            probs = model(**batch).logits.softmax(-1).numpy()
+        for i, row in zip(bucket, probs):
+            results[i] = [
+                {"label": labels[j], "score": float(row[j])}
+                for j in row.argsort()[::-1]
+            ]
+    return results
+
+
+def ai_probability(scores, label=TEXT_DETECTOR_AI_LABEL):
+    return next(s["score"] for s in scores if s["label"].lower() == label.lower())
+
+
+def format_detection(scores):
+    """
+    Formats a TextDetectorService.predict result for moderators.
+    """
+    probability = ai_probability(scores)
+    verdict = "likely AI-generated" if probability >= 0.5 else "likely human-written"
+    return f"AI-generated text: {probability:.0%} ({verdict})"
+
+
+def _init_worker(num_threads):
+    import torch
+
+    torch.set_num_threads(TEXT_DETECTOR_THREADS or num_threads)
+    load_model()
+
+
+def _warm_up():
+    load_model()
+    return os.getpid()
+
+
+def _predict_batch(texts, max_tokens):
+    return classify_texts(texts, max_tokens=max_tokens)
+
+
+class TextDetectorService:
+    """
+    Pool of worker processes running the AI-generated-text classifier, with
+    the same micro-batching as DeepfakeService: concurrent `predict` calls
+    are grouped into batches of up to `max_batch` texts, waiting at most
+    `max_wait_ms` for a batch to fill. Results are cached by text hash.
+    """
+
+    def __init__(
+        self,
+        workers=TEXT_DETECTOR_WORKERS,
+        max_batch=TEXT_DETECTOR_MAX_BATCH,
+        max_wait_ms=TEXT_DETECTOR_MAX_WAIT_MS,
+        max_tokens=TEXT_DETECTOR_BATCH_TOKENS,
+    ):
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_tokens = max_tokens
+        self.executor = None
+        self.cache = ScoreCache(TEXT_DETECTOR_CACHE_SIZE, TEXT_DETECTOR_CACHE_TTL)
+        self._pending = {}  # Map from text to the future of its scores
+        self._flush_handle = None
+        self._tasks = set()
+
+    def start(self):
+        if self.executor is None:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(threads,),
+            )
+        return self.executor
+
+    async def warm_up(self):
+        loop = asyncio.get_running_loop()
+        executor = self.start()
+        await asyncio.gather(
+            *(loop.run_in_executor(executor, _warm_up) for _ in range(self.workers))
+        )
+
+    @metrics.timed("text_detector")
+    async def predict(self, text):
+        scores = self.cache.get(text)
+        if scores is None:
+            scores = await self._submit(text)
+            self.cache.put(text, scores)
+        return scores
+
+    async def _submit(self, text):
+        loop = asyncio.get_running_loop()
+        future = self._pending.get(text)
+        if future is None:
+            future = self._pending[text] = loop.create_future()
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        texts = list(batch)
+        try:
+            with metrics.span("text_detector_batch"):
+                results = await loop.run_in_executor(
+                    self.start(), _predict_batch, texts, self.max_tokens
+                )
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()  # Callers that left don't need to see it
+            return
+        for text, result in zip(texts, results):
+            if not batch[text].done():
+                batch[text].set_result(result)
+
+    async def close(self):
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+text_detector = TextDetectorService()